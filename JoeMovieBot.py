@@ -1,14 +1,25 @@
 from telegram.helpers import escape_markdown
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 from config import Config
-from telegram import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, LabeledPrice, ForceReply, Update
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, PreCheckoutQueryHandler
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, LabeledPrice, ForceReply, Update, Message, InlineQueryResultArticle, InputTextMessageContent
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, PreCheckoutQueryHandler, ChatMemberHandler, InlineQueryHandler
 from database import Database
+from google_drive import AsyncDriveClient, DownloadTooLarge
+from drive_sync import DriveFolderSync, SyncBusy
+from cache import TTLCache
+from user_buffer import UserWriteBuffer
+from webhook import WebhookServer
+from scaleout import UserOrderedUpdateProcessor, run_supervisor
+from scheduler import JobScheduler
+from rate_limiter import PriorityRateLimiter, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_BULK
+from metrics import MetricsServer
+from profiling import MemoryTracer, CpuProfiler, ProfilerBusy
+import metrics
 import os
 import sys
 import io
+import shutil
+import tempfile
 import time
 from datetime import datetime, timedelta
 import logging
@@ -18,12 +29,10 @@ import aiohttp
 import socket
 import psycopg2
 from psycopg2 import errors as pg_errors
-import tracemalloc
 import random # Import random for jitter
 import uuid # For generating unique content IDs
 import signal
-
-tracemalloc.start()
+from urllib.parse import urlparse
 
 
 # Custom exceptions
@@ -43,6 +52,8 @@ logger = logging.getLogger(__name__)
 
 
 class MovieBot:
+    MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
     def __init__(self):
         self.app = None
         self.initialized = False
@@ -51,15 +62,42 @@ class MovieBot:
         self._admin_notified = False
         self._bg_tasks = [] #Initialize background tasks lists
         self._shutdown_event = asyncio.Event()
-        self.google_drive_service = None # To store the  Google Drive API service client
+        self.drive_client = None # Async Google Drive API client
+        self.drive_sync = None # Mirrors GOOGLE_DRIVE_CONTENT_FOLDER_ID into content_library
         self._is_shutting_down = False
+        self._http_session = None # Shared aiohttp session for streamed uploads
+        self._delivery_wakeup = asyncio.Event() # Wakes idle delivery workers when a job is queued
+        self._broadcast_wakeup = asyncio.Event() # Wakes the broadcast watcher when a broadcast is queued
+        self._user_buffer = UserWriteBuffer(
+            max_size=Config.USER_BUFFER_MAX_SIZE,
+            flush_interval=Config.USER_BUFFER_FLUSH_INTERVAL,
+            last_active_resolution=Config.USER_LAST_ACTIVE_RESOLUTION
+        )
+        self.webhook_server = None # Embedded aiohttp server when BOT_MODE=webhook
+        self.metrics_port = Config.METRICS_PORT # Offset per worker process in supervisor mode
+        self.metrics_server = None
+        self.memory_tracer = MemoryTracer() # tracemalloc stays off until /memtrace start
+        self.cpu_profiler = CpuProfiler()
+        # The limits are bot-wide; with WORKER_PROCESSES workers each process gets its share
+        workers = max(Config.WORKER_PROCESSES, 1)
+        self.rate_limiter = PriorityRateLimiter(
+            overall_rate=Config.SEND_RATE_PER_SECOND / workers,
+            burst=max(Config.SEND_BURST // workers, 1),
+            private_chat_interval=Config.SEND_PRIVATE_CHAT_INTERVAL,
+            group_chat_interval=Config.SEND_GROUP_CHAT_INTERVAL,
+            low_priority_chats=(Config.ADMIN_ID, Config.ADMIN_CHANNEL_ID)
+        )
+        self.scheduler = JobScheduler(Config.SCHEDULER_LOCK_KEY, leader_check_interval=Config.SCHEDULER_LEADER_CHECK_INTERVAL)
+        self._membership_cache = TTLCache(maxsize=Config.MEMBERSHIP_CACHE_SIZE, ttl=Config.MEMBERSHIP_CACHE_POSITIVE_TTL)
+        # payment_id -> invoice details of invoices sent by this process, for the pre-checkout fast path
+        self._pending_invoices = TTLCache(maxsize=Config.PENDING_INVOICE_CACHE_SIZE, ttl=Config.REQUEST_EXPIRY_HOURS * 3600)
 
     async def check_network_stability(self):
         """Properly await all async operations with better timeout handling"""
         tests = [
             {
                 "name": "DNS Resolution",
-                "test": lambda: socket.gethostbyname('api.telegram.org'),
+                "test": lambda: socket.gethostbyname(urlparse(Config.TELEGRAM_API_URL).hostname),
                 "error_message": "DNS resolution failed. Check internet connection or DNS settings."
             },
             {
@@ -153,7 +191,7 @@ class MovieBot:
         timeout = aiohttp.ClientTimeout(total=10)
         async with aiohttp.ClientSession(timeout=timeout) as session:
             # Test Telegram API endpoint (without authentication)
-            async with session.get("https://api.telegram.org") as response:
+            async with session.get(Config.TELEGRAM_API_URL) as response:
                 # Telegram returns 404 for root, but connection is successful
                 if response.status in [200, 404]:
                     return True
@@ -161,20 +199,27 @@ class MovieBot:
                     response.raise_for_status()
         return True
 
-    async def initialize(self):
+    async def initialize(self, run_migrations: bool = True):
         """Initialize the bot components."""
         logger.info("Initializing bot components...")
         try:
             # Database connection pool setup
             Database.pool = await Database.get_connection()
-            await Database.init_db()
+            if run_migrations:
+                await Database.init_db()
             logger.info("Database initialized.")
             
             # Google Drive API service client setup
             await self._initialize_google_drive_service()
            
             # Application builder
-            self.app = Application.builder().token(Config.TOKEN).build()
+            self.app = Application.builder().token(Config.TOKEN).base_url(
+                f"{Config.TELEGRAM_API_URL}/bot"
+            ).base_file_url(
+                f"{Config.TELEGRAM_API_URL}/file/bot"
+            ).concurrent_updates(
+                UserOrderedUpdateProcessor(Config.CONCURRENT_UPDATES)
+            ).rate_limiter(self.rate_limiter).build()
             self.initialized = True # Mark as initialized after app is built
 
             # Handlers
@@ -183,11 +228,21 @@ class MovieBot:
             self.app.add_handler(CommandHandler("support", self.handle_support))
             self.app.add_handler(CommandHandler("addcontent", self.handle_add_content)) # Admin command
             self.app.add_handler(CommandHandler("deliver", self.deliver_content_admin)) # Admin command
+            self.app.add_handler(CommandHandler("syncdrive", self.handle_sync_drive)) # Admin command
             self.app.add_handler(CommandHandler("stats", self.get_bot_stats)) # Admin command
+            self.app.add_handler(CommandHandler("dbpool", self.handle_db_pool)) # Admin command
+            self.app.add_handler(CommandHandler("jobs", self.handle_jobs)) # Admin command
+            self.app.add_handler(CommandHandler("broadcast", self.handle_broadcast)) # Admin command
+            self.app.add_handler(CommandHandler("broadcaststatus", self.handle_broadcast_status)) # Admin command
+            self.app.add_handler(CommandHandler("cancelbroadcast", self.handle_cancel_broadcast)) # Admin command
+            self.app.add_handler(CommandHandler("memtrace", self.handle_memtrace)) # Admin command
+            self.app.add_handler(CommandHandler("profile", self.handle_profile)) # Admin command
             self.app.add_handler(CallbackQueryHandler(self.button_handler))
             self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_message))
             self.app.add_handler(PreCheckoutQueryHandler(self.pre_checkout_callback))
+            self.app.add_handler(InlineQueryHandler(self.handle_inline_query))
             self.app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, self.successful_payment_callback))
+            self.app.add_handler(ChatMemberHandler(self.handle_chat_member_update, ChatMemberHandler.CHAT_MEMBER))
 
             # --- ADDED HANDLERS FROM JoeMovieBot.py ---
             self.app.add_handler(CommandHandler("mystatus", self.handle_mystatus))
@@ -201,6 +256,11 @@ class MovieBot:
             self.app.add_handler(CallbackQueryHandler(self.show_help_callback, pattern="show_help"))
             # --- END ADDED HANDLERS ---
 
+            # Record latency and failures of every handler under its callback name
+            for handlers in self.app.handlers.values():
+                for handler in handlers:
+                    handler.callback = metrics.track_handler(handler.callback)
+
             logger.info("Bot initialization completed successfully.")
 
         except NetworkError as e:
@@ -218,23 +278,44 @@ class MovieBot:
             await self._notify_admin(f"🚨 Critical: Bot initialization failed unexpectedly: {e}")
             raise # Re-raise the exception
 
+    async def enqueue_update(self, data: dict):
+        """Decodes a raw update (from the webhook or the supervisor) and queues it for processing."""
+        await self.app.update_queue.put(Update.de_json(data, self.app.bot))
+
     async def start_background_tasks(self):
         """Start background tasks after the application is running."""
         if not self._is_shutting_down:
-            self._bg_tasks.append(asyncio.create_task(self.periodically_cleanup_requests()))
-            self._bg_tasks.append(asyncio.create_task(self.periodically_check_membership()))
+            self.scheduler.add_job("cleanup_expired_payments", Config.CLEANUP_INTERVAL, self.cleanup_requests_job)
+            self.scheduler.add_job("check_membership", Config.MEMBERSHIP_CHECK_INTERVAL, self.check_membership_job)
+            self.scheduler.add_job("reconcile_stats", Config.STATS_RECONCILE_INTERVAL, self.reconcile_stats_job)
+            self.scheduler.add_job("fold_stats_deltas", Config.STATS_FOLD_INTERVAL, self.fold_stats_job)
+            if self.drive_sync and Config.DRIVE_SYNC_INTERVAL > 0:
+                self.scheduler.add_job("drive_sync", Config.DRIVE_SYNC_INTERVAL, self.drive_sync_job)
+            self._bg_tasks.append(asyncio.create_task(self.scheduler.run(self._shutdown_event)))
+            self._bg_tasks.append(asyncio.create_task(self.broadcast_watcher()))
+            self._bg_tasks.append(asyncio.create_task(self._user_buffer.run(self._shutdown_event)))
+            for worker_id in range(Config.DELIVERY_WORKERS):
+                self._bg_tasks.append(asyncio.create_task(self.delivery_worker(worker_id)))
+            if self.metrics_port:
+                try:
+                    self.metrics_server = MetricsServer(Config.METRICS_LISTEN, self.metrics_port)
+                    await self.metrics_server.start()
+                except OSError as e:
+                    self.metrics_server = None
+                    logger.error(f"Could not start metrics server on port {self.metrics_port}: {e}")
             logger.info("Background tasks started.")
         
     async def _initialize_google_drive_service(self):
-        """Initialize the Google Drive API service client."""
+        """Initialize the async Google Drive API client."""
         try:
-            scopes = ['https://www.googleapis.com/auth/drive']
-            creds = service_account.Credentials.from_service_account_file(
-                Config.GOOGLE_DRIVE_CREDENTIALS_PATH, scopes=scopes
-
+            self.drive_client = AsyncDriveClient(
+                Config.GOOGLE_DRIVE_CREDENTIALS_PATH, pool_size=Config.DRIVE_POOL_SIZE, api_url=Config.DRIVE_API_URL
             )
-            self.google_drive_service = build('drive', 'v3', credentials=creds, cache_discovery=False)
-            logger.info("Google Drive API service client initialized.")
+            logger.info("Google Drive API client initialized.")
+            if Config.GOOGLE_DRIVE_CONTENT_FOLDER_ID:
+                self.drive_sync = DriveFolderSync(
+                    self.drive_client, Config.GOOGLE_DRIVE_CONTENT_FOLDER_ID, page_size=Config.DRIVE_SYNC_PAGE_SIZE
+                )
         except Exception as e:
             logger.error(f"Failed to initialize Google Drive API service client: {e}")
             await self._notify_admin(f"🚨 Critical: Failed to initialize Google Drive API service client: {e}")
@@ -262,11 +343,25 @@ class MovieBot:
             await asyncio.gather(*self._bg_tasks, return_exceptions=True)
             logger.info("Background tasks stopped.")
 
+        if self.metrics_server:
+            await self.metrics_server.stop()
+
+        # Write out buffered user updates before the pool goes away
+        try:
+            await self._user_buffer.flush()
+        except Exception as e:
+            logger.error(f"Error flushing buffered user updates: {e}")
+
+        # Close the shared HTTP session and the Drive client's connection pool
+        if self._http_session and not self._http_session.closed:
+            await self._http_session.close()
+        if self.drive_client:
+            await self.drive_client.close()
+
         # Close database connection pool
         if hasattr(Database, 'pool') and Database.pool:
             try:
-                Database.pool.close()
-                await Database.pool.wait_closed()
+                await Database.close()
                 logger.info("Database connection pool closed.")
             except Exception as e:
                 logger.error(f"Error closing database pool: {e}")
@@ -274,13 +369,37 @@ class MovieBot:
         logger.info("Cleanup completed.")
 
     async def is_user_in_channel(self, user_id: int, bot) -> bool:
-        """Check if user is a member of the required channel."""
+        """
+        Check if user is a member of the required channel.
+        Results are cached (separate TTLs for members and non-members) and kept current by
+        chat_member updates from the advertising channel.
+        """
+        cached = self._membership_cache.get(user_id)
+        if cached is not None:
+            return cached
+
         try:
             member = await bot.get_chat_member(Config.ADVERTISING_CHANNEL_ID, user_id)
-            return member.status in ['member', 'administrator', 'creator']
+            is_member = member.status in self.MEMBER_STATUSES
         except Exception as e:
             logger.error(f"Error checking channel membership for user {user_id}: {e}")
-            return False
+            return False # Errors are not cached
+
+        ttl = Config.MEMBERSHIP_CACHE_POSITIVE_TTL if is_member else Config.MEMBERSHIP_CACHE_NEGATIVE_TTL
+        self._membership_cache.set(user_id, is_member, ttl=ttl)
+        return is_member
+
+    async def handle_chat_member_update(self, update, context):
+        """Keeps the membership cache in sync with joins and leaves in the advertising channel."""
+        chat_member = update.chat_member
+        if str(chat_member.chat.id) != str(Config.ADVERTISING_CHANNEL_ID):
+            return
+
+        user_id = chat_member.new_chat_member.user.id
+        is_member = chat_member.new_chat_member.status in self.MEMBER_STATUSES
+        ttl = Config.MEMBERSHIP_CACHE_POSITIVE_TTL if is_member else Config.MEMBERSHIP_CACHE_NEGATIVE_TTL
+        self._membership_cache.set(user_id, is_member, ttl=ttl)
+        logger.debug(f"Membership cache updated for user {user_id}: {'member' if is_member else 'not a member'}.")
 
     async def start(self, update, context):
         user_id = update.effective_user.id
@@ -288,7 +407,11 @@ class MovieBot:
         username = update.effective_user.username
         last_name = update.effective_user.last_name
 
-        await Database.add_or_update_user(user_id, username, first_name, last_name)
+        self._user_buffer.add(user_id, username, first_name, last_name)
+
+        # Deep link from an inline search result: t.me/<bot>?start=buy_<content_id>
+        if context.args and context.args[0].startswith("buy_"):
+            return await self._start_catalog_purchase(update, context, context.args[0][4:])
 
         keyboard = [
             [InlineKeyboardButton("Request Content", callback_data="request_content")],
@@ -322,24 +445,137 @@ class MovieBot:
                 )
              return
 
-            keyboard = [
-            [InlineKeyboardButton("Proceed to Payment", callback_data="proceed_payment")]
-        ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            try:
+                text, reply_markup = await self._catalog_page(0)
+            except Exception as e:
+                logger.error(f"Failed to load the content catalog: {e}")
+                text, reply_markup = self._manual_request_prompt()
 
         # Determine the target for the reply based on the update type
             if update.message:
-               await update.message.reply_text(
-                f"To request exclusive content, a payment of {Config.PRICE_AMOUNT / 100:.2f} {Config.CURRENCY} is required.\n\n"
-                "Click 'Proceed to Payment' to continue.",
-                reply_markup=reply_markup
-            )
+                await update.message.reply_text(text, reply_markup=reply_markup)
             elif update.callback_query and update.callback_query.message:
-                await update.callback_query.message.reply_text(
-                f"To request exclusive content, a payment of {Config.PRICE_AMOUNT / 100:.2f} {Config.CURRENCY} is required.\n\n"
-                "Click 'Proceed to Payment' to continue.",
-                reply_markup=reply_markup
+                await update.callback_query.message.reply_text(text, reply_markup=reply_markup)
+
+    def _manual_request_prompt(self):
+        keyboard = [
+            [InlineKeyboardButton("Proceed to Payment", callback_data="proceed_payment")]
+        ]
+        text = (
+            f"To request exclusive content, a payment of {Config.PRICE_AMOUNT / 100:.2f} {Config.CURRENCY} is required.\n\n"
+            "Click 'Proceed to Payment' to continue."
+        )
+        return text, InlineKeyboardMarkup(keyboard)
+
+    async def _catalog_page(self, page: int):
+        """
+        Builds one page of the content catalog (callback data buy:<content_id> and cat:<page>).
+        Catalog purchases are delivered automatically once paid; 'Something else' keeps the
+        manual request flow. Falls back to the manual prompt when the catalog is empty.
+        """
+        rows, has_more = await Database.get_catalog_page(Config.CATALOG_PAGE_SIZE, offset=page * Config.CATALOG_PAGE_SIZE)
+        if not rows and page == 0:
+            return self._manual_request_prompt()
+
+        keyboard = [[InlineKeyboardButton(f"🎬 {row['title']}", callback_data=f"buy:{row['content_id']}")] for row in rows]
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"cat:{page - 1}"))
+        if has_more:
+            navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f"cat:{page + 1}"))
+        if navigation:
+            keyboard.append(navigation)
+        keyboard.append([InlineKeyboardButton("🔍 Search the catalog", switch_inline_query_current_chat="")])
+        keyboard.append([InlineKeyboardButton("Something else (manual request)", callback_data="proceed_payment")])
+
+        text = (
+            f"Pick a title from the catalog. Each item costs {Config.PRICE_AMOUNT / 100:.2f} {Config.CURRENCY} "
+            "and is sent to you as soon as the payment goes through.\n\n"
+            "Looking for something that is not listed? Choose 'Something else' and an admin will deliver it."
+        )
+        return text, InlineKeyboardMarkup(keyboard)
+
+    async def _start_catalog_purchase(self, update, context, content_id: str):
+        """Sends the invoice for a catalog title opened from an inline search result."""
+        user_id = update.effective_user.id
+        if not await self.is_user_in_channel(user_id, context.bot):
+            return await update.message.reply_text(
+                f"🚨 To request content, you must first join our channel: {Config.ADVERTISING_CHANNEL_INVITE_LINK}"
             )
+        try:
+            content_info = await Database.get_content_from_cms_library(str(uuid.UUID(content_id)))
+        except ValueError:
+            content_info = None
+        except Exception as e:
+            logger.error(f"Error loading catalog item {content_id} for user {user_id}: {e}")
+            return await update.message.reply_text("⚠️ The catalog is unavailable right now. Please try again later.")
+
+        if not content_info or content_info['removed_at']:
+            return await update.message.reply_text("❌ This title is no longer available. Use /request to browse the catalog.")
+        await self.send_invoice(update.effective_chat.id, context, content=content_info)
+
+    async def handle_inline_query(self, update, context):
+        """
+        Inline catalog search (@bot <title>). Results are the same for every user, so Telegram
+        may cache them for INLINE_CACHE_TIME seconds, which also absorbs most per-keystroke queries.
+        Each result carries a deep link that opens the bot and sends the invoice for that title.
+        """
+        query = update.inline_query
+        text = query.query.strip()
+        try:
+            offset = max(int(query.offset or 0), 0)
+        except ValueError:
+            offset = 0
+        if offset >= Config.INLINE_MAX_RESULTS:
+            return await query.answer([], cache_time=Config.INLINE_CACHE_TIME, next_offset="")
+
+        try:
+            if text:
+                rows, has_more = await Database.search_catalog(text, Config.INLINE_PAGE_SIZE, offset)
+            else:
+                rows, has_more = await Database.get_catalog_page(Config.INLINE_PAGE_SIZE, offset)
+        except Exception as e:
+            logger.error(f"Inline catalog search for {text!r} failed: {e}")
+            return await query.answer([], cache_time=0) # Do not let Telegram cache the failure
+
+        price = f"{Config.PRICE_AMOUNT / 100:.2f} {Config.CURRENCY}"
+        results = [
+            InlineQueryResultArticle(
+                id=row['content_id'],
+                title=row['title'],
+                description=f"Exclusive content · {price}",
+                input_message_content=InputTextMessageContent(f"🎬 {row['title']}\nAvailable from @{context.bot.username} for {price}."),
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                    f"Buy for {price}", url=f"https://t.me/{context.bot.username}?start=buy_{row['content_id']}"
+                )]])
+            )
+            for row in rows
+        ]
+        await query.answer(
+            results,
+            cache_time=Config.INLINE_CACHE_TIME,
+            is_personal=False,
+            next_offset=str(offset + len(rows)) if has_more else ""
+        )
+
+    async def handle_catalog_callback(self, update, context):
+        """Handles catalog paging (cat:<page>) and item selection (buy:<content_id>)."""
+        query = update.callback_query
+        action, value = query.data.split(":", 1)
+        try:
+            if action == "cat":
+                text, reply_markup = await self._catalog_page(max(int(value), 0))
+                await query.edit_message_text(text, reply_markup=reply_markup)
+                return
+
+            content_info = await Database.get_content_from_cms_library(value)
+        except Exception as e:
+            logger.error(f"Error handling catalog callback {query.data}: {e}")
+            return await query.message.reply_text("⚠️ The catalog is unavailable right now. Please try again later.")
+
+        if not content_info or content_info['removed_at']:
+            return await query.message.reply_text("❌ This title is no longer available. Please pick another one.")
+        await self.send_invoice(query.message.chat.id, context, content=content_info)
 
     async def button_handler(self, update: Update, context):
         query = update.callback_query
@@ -355,44 +591,47 @@ class MovieBot:
             await self.handle_help(update, context)
         elif query.data.startswith("retry:"): # Added from JoeMovieBot.py
             await self.handle_retry_request(update, context)
+        elif query.data.startswith("pg:"):
+            await self.handle_payment_page_callback(update, context)
+        elif query.data.startswith(("cat:", "buy:")):
+            await self.handle_catalog_callback(update, context)
 
 
-    async def send_invoice(self, chat_id: int, context):
-        title = "Exclusive Content Access"
-        description = f"One-time payment for exclusive cybersecurity content access. Amount: {Config.PRICE_AMOUNT / 100:.2f} {Config.CURRENCY}"
+    async def send_invoice(self, chat_id: int, context, content: dict = None):
+        """
+        Sends a payment invoice. With `content` (a content_library row picked from the catalog)
+        the payment carries its content_id and is delivered automatically once paid.
+        """
+        if content:
+            # Telegram limits invoice titles to 32 characters
+            title = content['title'] if len(content['title']) <= 32 else content['title'][:31] + "…"
+            description = f"One-time payment for '{content['title'][:180]}', delivered right after payment. Amount: {Config.PRICE_AMOUNT / 100:.2f} {Config.CURRENCY}"
+            content_id = str(content['content_id'])
+        else:
+            title = "Exclusive Content Access"
+            description = f"One-time payment for exclusive cybersecurity content access. Amount: {Config.PRICE_AMOUNT / 100:.2f} {Config.CURRENCY}"
+            content_id = None
         payload = f"content_access_user_{chat_id}" # Unique payload for this invoice
         provider_token = Config.PAYMENT_PROVIDER_TOKEN
         currency = Config.CURRENCY
         prices = [LabeledPrice("Content Access", Config.PRICE_AMOUNT)]
 
         try:
-            # Create a pending payment record in DB
+            # The pending payment row needs the user row for its foreign key
+            await self._user_buffer.ensure_flushed(chat_id)
             payment_id = str(uuid.uuid4()) # Generate a unique payment ID
-            await Database.add_pending_payment(
-                payment_id=payment_id,
-                user_id=chat_id,
-                amount=Config.PRICE_AMOUNT,
-                currency=Config.CURRENCY
-            )
 
-            await context.bot.send_invoice(
-                chat_id=chat_id,
-                title=title,
-                description=description,
-                payload=payment_id, # Use our generated payment_id as payload
-                provider_token=provider_token,
-                currency=currency,
-                prices=prices,
-                start_parameter="start_param", # Can be any string, required
-                need_name=False,
-                need_phone_number=False,
-                need_email=False,
-                need_shipping_address=False,
-                is_flexible=False,
-                disable_notification=False,
-                send_email_to_provider=False,
-                send_phone_number_to_provider=False
+            # The pending row and the invoice are independent until the user pays, so create them concurrently
+            insert_result, invoice_result = await asyncio.gather(
+                self._add_pending_invoice(payment_id, chat_id, content_id),
+                self._send_invoice_message(context, chat_id, title, description, payment_id, provider_token, currency, prices),
+                return_exceptions=True
             )
+            if isinstance(insert_result, Exception) or isinstance(invoice_result, Exception):
+                # Forget the invoice so a pre-checkout for it is rejected rather than paid without a row
+                self._pending_invoices.pop(payment_id)
+                raise insert_result if isinstance(insert_result, Exception) else invoice_result
+
             logger.info(f"Invoice sent to user {chat_id} with payload {payment_id}. Awaiting payment.")
             # Admin notification about pending request will now be sent AFTER successful payment.
 
@@ -403,33 +642,105 @@ class MovieBot:
                 text="⚠️ Failed to create payment invoice. Please try again later or contact support."
             )
 
+    async def _add_pending_invoice(self, payment_id: str, user_id: int, content_id: str = None):
+        """
+        Inserts the pending payment row, then caches the invoice so pre-checkout can be answered
+        without the database. Caching only after the insert has committed means pre-checkout can
+        never approve a payment that has no row.
+        """
+        await Database.add_pending_payment(
+            payment_id=payment_id,
+            user_id=user_id,
+            amount=Config.PRICE_AMOUNT,
+            currency=Config.CURRENCY,
+            requested_content_id=content_id
+        )
+        self._pending_invoices.set(payment_id, {
+            'user_id': user_id,
+            'amount': Config.PRICE_AMOUNT,
+            'currency': Config.CURRENCY
+        })
+
+    async def _send_invoice_message(self, context, chat_id: int, title: str, description: str, payment_id: str,
+                                    provider_token: str, currency: str, prices):
+        await context.bot.send_invoice(
+            chat_id=chat_id,
+            title=title,
+            description=description,
+            payload=payment_id, # Use our generated payment_id as payload
+            provider_token=provider_token,
+            currency=currency,
+            prices=prices,
+            start_parameter="start_param", # Can be any string, required
+            need_name=False,
+            need_phone_number=False,
+            need_email=False,
+            need_shipping_address=False,
+            is_flexible=False,
+            disable_notification=False,
+            send_email_to_provider=False,
+            send_phone_number_to_provider=False
+        )
+
     async def pre_checkout_callback(self, update, context):
+        """
+        Validates a pre-checkout query, which Telegram allows only 10 seconds to answer.
+        Invoices sent by this process are checked against the in-memory pending-invoice cache;
+        others (e.g. sent before a restart) are looked up in the database with a timeout.
+        """
         query = update.pre_checkout_query
         payment_id = query.invoice_payload # Our custom payment_id
         user_id = query.from_user.id
 
+        invoice = self._pending_invoices.get(payment_id)
+        if invoice is not None:
+            is_valid = (invoice['user_id'] == user_id and invoice['amount'] == query.total_amount
+                        and invoice['currency'] == query.currency)
+            details = invoice
+        else:
+            try:
+                details = await asyncio.wait_for(Database.get_payment_details(payment_id), timeout=Config.PRE_CHECKOUT_DB_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Pre-checkout lookup of payment {payment_id} failed: {e!r}")
+                details = None
+            is_valid = bool(details) and details['status'] == 'pending' and details['user_id'] == user_id
+
         # Verify the payment ID and ensure it's a valid pending payment
-        is_valid_payment = await Database.get_payment_details(payment_id)
-        if is_valid_payment and is_valid_payment['status'] == 'pending' and is_valid_payment['user_id'] == user_id:
-            await context.bot.answer_pre_checkout_query(query.id, ok=True)
+        if is_valid:
+            await context.bot.answer_pre_checkout_query(query.id, ok=True, rate_limit_args={'priority': PRIORITY_HIGH})
             logger.info(f"Pre-checkout query answered OK for payment {payment_id}")
         else:
-            await context.bot.answer_pre_checkout_query(query.id, ok=False, error_message="Invalid or expired payment request.")
-            logger.warning(f"Pre-checkout query answered NOT OK for payment {payment_id} from user {user_id}. Details: {is_valid_payment}")
+            await context.bot.answer_pre_checkout_query(
+                query.id, ok=False, error_message="Invalid or expired payment request.",
+                rate_limit_args={'priority': PRIORITY_HIGH}
+            )
+            logger.warning(f"Pre-checkout query answered NOT OK for payment {payment_id} from user {user_id}. Details: {details}")
 
     async def successful_payment_callback(self, update, context):
         payment_info = update.message.successful_payment
         payment_id = payment_info.invoice_payload # Our custom payment_id
         user_id = update.message.from_user.id
 
+        self._pending_invoices.pop(payment_id) # Paid; the database is authoritative from here on
         try:
             # Update payment status in database
-            await Database.update_payment_status(payment_id, 'completed', payment_info.provider_payment_charge_id)
+            content_id = await Database.update_payment_status(payment_id, 'completed', payment_info.provider_payment_charge_id)
             logger.info(f"Payment {payment_id} successfully completed for user {user_id}. Charge ID: {payment_info.provider_payment_charge_id}")
 
-            await update.message.reply_text(
-                "✅ Payment successful! Thank you for your purchase.\n\n"
-                "Your content request has been approved. An admin will deliver the content shortly."
+            if content_id and await self._auto_deliver(payment_id, content_id, user_id):
+                await context.bot.send_message(
+                    chat_id=update.message.chat_id,
+                    text="✅ Payment successful! Thank you for your purchase.\n\n"
+                         "Your content is on its way and will arrive in a moment.",
+                    rate_limit_args={'priority': PRIORITY_HIGH}
+                )
+                return
+
+            await context.bot.send_message(
+                chat_id=update.message.chat_id,
+                text="✅ Payment successful! Thank you for your purchase.\n\n"
+                     "Your content request has been approved. An admin will deliver the content shortly.",
+                rate_limit_args={'priority': PRIORITY_HIGH}
             )
             # Notify admin about new content request after payment completion
             # This notification now also serves as the "pending request" notification
@@ -446,6 +757,27 @@ class MovieBot:
                 "⚠️ There was an issue processing your payment completion. Please contact support."
             )
 
+    async def _auto_deliver(self, payment_id: str, content_id: str, user_id: int) -> bool:
+        """
+        Queues delivery of a catalog purchase through the delivery workers. Returns False if it
+        could not be queued, in which case the admin is asked to run /deliver instead.
+        """
+        try:
+            delivery_id = await Database.enqueue_delivery(payment_id, content_id, user_id)
+        except Exception as e:
+            logger.error(f"Failed to queue automatic delivery for payment {payment_id}: {e}")
+            delivery_id = None
+        if delivery_id is None:
+            await self._notify_admin(
+                f"⚠️ Automatic delivery for payment `{payment_id}` (user `{user_id}`) could not be queued.\n"
+                f"Please use `/deliver {payment_id} {content_id}` to send the content."
+            )
+            return False
+
+        self._delivery_wakeup.set()
+        logger.info(f"Queued automatic delivery #{delivery_id} of content {content_id} to user {user_id} for payment {payment_id}.")
+        return True
+
     async def handle_text_message(self, update, context):
         # This handler can be used for general chat or future keyword-based interactions
         # For now, it just informs the user to use commands.
@@ -458,35 +790,173 @@ class MovieBot:
             logger.info(f"Received message in admin channel: {update.message.text}")
             # Admin channel might receive various messages, log them but don't necessarily respond
 
-    async def periodically_cleanup_requests(self):
+    # --- BROADCASTS ---
+
+    async def handle_broadcast(self, update, context):
+        """
+        Admin command to message every user who has not blocked the bot.
+        Usage: /broadcast <message text>
+        """
+        if update.message.from_user.id != Config.ADMIN_ID:
+            return await update.message.reply_text("❌ Admin only!")
+
+        parts = update.message.text.split(maxsplit=1)
+        if len(parts) < 2 or not parts[1].strip():
+            return await update.message.reply_text("Usage: /broadcast <message text>")
+
+        try:
+            broadcast_id = await Database.create_broadcast(parts[1].strip(), update.message.from_user.id)
+            self._broadcast_wakeup.set()
+            await update.message.reply_text(
+                f"📣 Broadcast #{broadcast_id} queued at {Config.BROADCAST_RATE:g} msg/s.\n"
+                f"Use /broadcaststatus {broadcast_id} to follow progress or /cancelbroadcast {broadcast_id} to stop it."
+            )
+            logger.info(f"Admin queued broadcast #{broadcast_id}.")
+        except Exception as e:
+            logger.error(f"Error creating broadcast: {e}")
+            await update.message.reply_text(f"⚠️ Error: {e}")
+
+    async def handle_broadcast_status(self, update, context):
+        """Usage: /broadcaststatus [broadcast_id] (defaults to the latest broadcast)"""
+        if update.message.from_user.id != Config.ADMIN_ID:
+            return await update.message.reply_text("❌ Admin only!")
+
+        try:
+            broadcast_id = int(context.args[0]) if context.args else None
+            broadcast = await Database.get_broadcast(broadcast_id)
+            if not broadcast:
+                return await update.message.reply_text("No broadcast found.")
+            await update.message.reply_text(
+                f"📣 Broadcast #{broadcast['broadcast_id']} - {broadcast['status']}\n\n"
+                f"• Delivered: {broadcast['delivered_count']}\n"
+                f"• Blocked: {broadcast['blocked_count']}\n"
+                f"• Failed: {broadcast['failed_count']}\n"
+                f"• Started: {broadcast['created_at'].strftime('%Y-%m-%d %H:%M')}"
+                + (f"\n• Finished: {broadcast['finished_at'].strftime('%Y-%m-%d %H:%M')}" if broadcast['finished_at'] else "")
+            )
+        except ValueError:
+            await update.message.reply_text("Usage: /broadcaststatus [broadcast_id]")
+        except Exception as e:
+            logger.error(f"Error in handle_broadcast_status: {e}")
+            await update.message.reply_text(f"⚠️ Error: {e}")
+
+    async def handle_cancel_broadcast(self, update, context):
+        """Usage: /cancelbroadcast <broadcast_id>"""
+        if update.message.from_user.id != Config.ADMIN_ID:
+            return await update.message.reply_text("❌ Admin only!")
+
+        try:
+            broadcast_id = int(context.args[0])
+        except (IndexError, ValueError):
+            return await update.message.reply_text("Usage: /cancelbroadcast <broadcast_id>")
+
+        if await Database.cancel_broadcast(broadcast_id):
+            await update.message.reply_text(f"🛑 Broadcast #{broadcast_id} cancelled. Sending stops at the next checkpoint.")
+        else:
+            await update.message.reply_text(f"❌ Broadcast #{broadcast_id} is not running.")
+
+    async def broadcast_watcher(self):
+        """Claims and runs broadcasts, including ones left unfinished by a crashed or stopped process."""
         while not self._shutdown_event.is_set():
             try:
-                await Database.cleanup_expired_pending_payments()
-                logger.info("Expired pending payments cleaned up.")
+                broadcast = await Database.claim_broadcast(self.scheduler.runner_id, Config.BROADCAST_LEASE_SECONDS)
+                if broadcast:
+                    await self._run_broadcast(broadcast)
+                    continue
             except Exception as e:
-                logger.error(f"Error during periodic cleanup: {e}")
-            finally:
-                # Sleep for cleanup interval, but wake up if shutdown is requested
-                try:
-                    await asyncio.wait_for(self._shutdown_event.wait(), timeout=Config.CLEANUP_INTERVAL)
-                    break  # Shutdown requested
-                except asyncio.TimeoutError:
-                    continue  # Continue the loop
+                logger.error(f"Broadcast watcher error: {e}")
 
-    async def periodically_check_membership(self):
-        while not self._shutdown_event.is_set():
+            self._broadcast_wakeup.clear()
             try:
-                # This function might be extended to revoke access if user leaves channel after content delivery
-                # For now, it only checks at the point of request.
-                logger.debug("Running periodic membership check (placeholder for future logic).")
-            except Exception as e:
-                logger.error(f"Error during periodic membership check: {e}")
-            finally:
+                await asyncio.wait_for(self._broadcast_wakeup.wait(), timeout=Config.BROADCAST_LEASE_SECONDS / 2)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_broadcast(self, broadcast: dict):
+        """
+        Sends a broadcast at Config.BROADCAST_RATE, reading recipients in user_id batches and
+        checkpointing after each batch so a restarted process resumes where this one stopped.
+        """
+        broadcast_id = broadcast['broadcast_id']
+        runner = self.scheduler.runner_id
+        text = broadcast['message_text']
+        last_user_id = broadcast['last_user_id']
+        interval = 1.0 / Config.BROADCAST_RATE
+        semaphore = asyncio.Semaphore(Config.BROADCAST_CONCURRENCY)
+        logger.info(f"Running broadcast #{broadcast_id} from user_id > {last_user_id}.")
+
+        async def send(user_id):
+            async with semaphore:
                 try:
-                    await asyncio.wait_for(self._shutdown_event.wait(), timeout=Config.MEMBERSHIP_CHECK_INTERVAL)
-                    break  # Shutdown requested
-                except asyncio.TimeoutError:
-                    continue  # Continue the loop
+                    await self.app.bot.send_message(chat_id=user_id, text=text, rate_limit_args={'priority': PRIORITY_BULK})
+                    return 'delivered'
+                except Forbidden:
+                    return 'blocked'
+                except Exception as e:
+                    logger.debug(f"Broadcast #{broadcast_id} to {user_id} failed: {e}")
+                    return 'failed'
+
+        while not self._shutdown_event.is_set():
+            recipients = await Database.get_broadcast_recipients(last_user_id, Config.BROADCAST_BATCH_SIZE)
+            if not recipients:
+                await Database.finish_broadcast(broadcast_id, runner)
+                result = await Database.get_broadcast(broadcast_id)
+                logger.info(f"Broadcast #{broadcast_id} finished.")
+                await self._notify_admin(
+                    f"📣 Broadcast #{broadcast_id} finished: {result['delivered_count']} delivered, "
+                    f"{result['blocked_count']} blocked, {result['failed_count']} failed."
+                )
+                return
+
+            tasks = []
+            next_send = time.monotonic()
+            for user_id in recipients:
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_send += interval
+                tasks.append(asyncio.create_task(send(user_id)))
+            outcomes = await asyncio.gather(*tasks)
+
+            blocked_users = [user_id for user_id, outcome in zip(recipients, outcomes) if outcome == 'blocked']
+            await Database.mark_users_blocked(blocked_users)
+            last_user_id = recipients[-1]
+            still_ours = await Database.checkpoint_broadcast(
+                broadcast_id, runner, last_user_id,
+                delivered=outcomes.count('delivered'), blocked=len(blocked_users), failed=outcomes.count('failed')
+            )
+            if not still_ours:
+                logger.info(f"Broadcast #{broadcast_id} was cancelled or taken over; stopping.")
+                return
+
+    # --- SCHEDULED JOBS (run on the scheduler leader only) ---
+
+    async def cleanup_requests_job(self):
+        await Database.cleanup_expired_pending_payments()
+        logger.info("Expired pending payments cleaned up.")
+
+    async def reconcile_stats_job(self):
+        await Database.reconcile_stats()
+        logger.info("Statistics rollup reconciled.")
+
+    async def fold_stats_job(self):
+        folded = await Database.fold_stats_deltas()
+        if folded:
+            logger.debug(f"Folded {folded} statistics deltas into the rollup.")
+
+    async def drive_sync_job(self):
+        try:
+            stats = await self.drive_sync.run()
+        except SyncBusy:
+            logger.info("Drive folder sync skipped: another sync is running.")
+            return
+        if stats['upserted'] or stats['removed']:
+            logger.info(f"Drive folder sync: {stats['upserted']} files imported or updated, {stats['removed']} flagged removed.")
+
+    async def check_membership_job(self):
+        # This function might be extended to revoke access if user leaves channel after content delivery
+        # For now, it only checks at the point of request.
+        logger.debug("Running periodic membership check (placeholder for future logic).")
 
     # --- ADMIN FUNCTIONS (CMS Integration) ---
 
@@ -524,14 +994,54 @@ class MovieBot:
                 f"Google Drive File ID: `{google_drive_file_id}`\n"               
             )
             logger.info(f"Admin {user_id} added content '{content_title}' (ID: {new_content_id}) to CMS library.")
+
+            if Config.STORAGE_CHANNEL_ID:
+                cached_file_id = await self._cache_content_in_storage_channel(
+                    new_content_id, google_drive_file_id, file_type, content_title
+                )
+                if cached_file_id:
+                    await update.message.reply_text("📦 Content pre-uploaded to storage channel. Deliveries will skip Google Drive.")
+                else:
+                    await update.message.reply_text("⚠️ Pre-upload to storage channel failed. Content will be cached on first delivery.")
         except Exception as e:
             logger.error(f"Error adding content to CMS library: {e}")
             await update.message.reply_text(f"⚠️ Failed to add content. Error: {e}")
 
+    async def handle_sync_drive(self, update, context):
+        """
+        Admin command to sync the Google Drive content folder into the CMS library now.
+        Usage: /syncdrive [full]
+        Without arguments only changes since the last sync are applied; 'full' re-lists the whole folder.
+        """
+        if update.effective_user.id != Config.ADMIN_ID:
+            await update.message.reply_text("🚫 You are not authorized to use this command.")
+            return
+        if not self.drive_sync:
+            await update.message.reply_text("⚠️ GOOGLE_DRIVE_CONTENT_FOLDER_ID is not configured.")
+            return
+
+        full = bool(context.args) and context.args[0].lower() == "full"
+        await update.message.reply_text("🔄 Syncing the Google Drive content folder...")
+        try:
+            stats = await self.drive_sync.run(full=full)
+        except SyncBusy:
+            await update.message.reply_text("⏳ A Drive sync is already running. Try again when it has finished.")
+            return
+        except Exception as e:
+            logger.error(f"Drive folder sync failed: {e}")
+            await update.message.reply_text(f"⚠️ Drive sync failed. Error: {e}")
+            return
+        await update.message.reply_text(
+            f"✅ Drive sync ({stats['mode']}) finished.\n"
+            f"• Imported or updated: {stats['upserted']}\n"
+            f"• Flagged as removed: {stats['removed']}\n"
+            f"• Skipped (folders, Google Docs): {stats['skipped']}"
+        )
+
     async def deliver_content_admin(self, update, context):
         """
         Admin command to deliver content to a user after successful payment.
-        Usage: /deliver <payment_id> <content_id>
+        Usage: /deliver <payment_id> [content_id] (content_id defaults to the catalog item the user paid for)
         Example: /deliver a1b2c3d4-e5f6-7890-1234-567890abcdef content_abc-123
         """
         user_id = update.effective_user.id
@@ -540,15 +1050,16 @@ class MovieBot:
             return
 
         args = context.args
-        if len(args) != 2:
+        if len(args) not in (1, 2):
             await update.message.reply_text(
-                "Usage: `/deliver <payment_id> <content_id>`\n"
-                "Example: `/deliver a1b2c3d4-e5f6-7890-1234-567890abcdef content_abc-123`"
+                "Usage: `/deliver <payment_id> [content_id]`\n"
+                "Example: `/deliver a1b2c3d4-e5f6-7890-1234-567890abcdef content_abc-123`\n"
+                "The content ID can be left out for catalog purchases."
             )
             return
 
         payment_id = args[0]
-        content_id = args[1]
+        content_id = args[1] if len(args) == 2 else None
 
         try:
             payment_details = await Database.get_payment_details(payment_id)
@@ -563,36 +1074,64 @@ class MovieBot:
                 )
                 return
 
+            if content_id is None:
+                if not payment_details['requested_content_id']:
+                    await update.message.reply_text(f"⚠️ Payment ID `{payment_id}` is not a catalog purchase; please give a content ID.")
+                    return
+                content_id = str(payment_details['requested_content_id'])
+
             content_info = await Database.get_content_from_cms_library(content_id)
             if not content_info:
                 await update.message.reply_text(f"❌ Content ID `{content_id}` not found in CMS library.")
                 return
 
             recipient_user_id = payment_details['user_id']
-            file_path = content_info['file_path']
-            file_type = content_info['file_type']
 
-            # Update payment record to link content_id
-            await Database.link_content_to_payment(payment_id, content_id)
-
-            # Attempt to deliver the content
-            await self._send_content_to_user(recipient_user_id, file_path, file_type, content_info['title'])
+            # Queue the delivery; a background worker downloads and uploads the content
+            delivery_id = await Database.enqueue_delivery(payment_id, content_id, recipient_user_id, requested_by=user_id)
+            if delivery_id is None:
+                await update.message.reply_text(f"⏳ A delivery for payment `{payment_id}` is already in progress.")
+                return
+            self._delivery_wakeup.set()
 
             await update.message.reply_text(
-                f"✅ Content '{content_info['title']}' delivered to user `{recipient_user_id}` for payment `{payment_id}`."
+                f"📥 Delivery #{delivery_id} of '{content_info['title']}' to user `{recipient_user_id}` queued for payment `{payment_id}`. "
+                "You will be notified when it completes."
             )
-            logger.info(f"Admin {user_id} delivered content '{content_id}' to user {recipient_user_id} for payment {payment_id}.")
+            logger.info(f"Admin {user_id} queued delivery #{delivery_id} of content '{content_id}' to user {recipient_user_id} for payment {payment_id}.")
 
         except Exception as e:
             logger.error(f"Error delivering content for payment {payment_id}, content {content_id}: {e}")
             await update.message.reply_text(f"⚠️ Failed to deliver content. Error: {e}")
 
-    async def _send_content_to_user(self, user_id: int, google_drive_file_id: str, file_type: str, title: str):
+    async def _send_content_to_user(self, user_id: int, google_drive_file_id: str, file_type: str, title: str,
+                                    content_id: str = None, telegram_file_id: str = None, raise_on_error: bool = False):
         """
-        Downloads content from Google Drive and sends it to the user via Telegram.
+        Sends content to the user via Telegram.
+        If the content already has a cached Telegram file_id it is sent by reference without touching
+        Google Drive; otherwise it is downloaded from Google Drive, uploaded, and the resulting file_id
+        is stored on the content_library row for next time.
+        With raise_on_error=True failures are re-raised instead of being reported to the user,
+        so the delivery worker can retry them.
+        Returns the Telegram file_id the content was sent with, if known.
         """
-        if not self.google_drive_service:
+        caption = f"Here is your requested content: *{escape_markdown(title, version=2)}*"
+
+        if telegram_file_id:
+            try:
+                await self._send_media(user_id, file_type, telegram_file_id, caption)
+                logger.info(f"Sent cached content '{title}' (file_id) to user {user_id}.")
+                return telegram_file_id
+            except BadRequest as e:
+                # The cached file_id is no longer accepted; forget it and fall back to Google Drive
+                logger.warning(f"Cached file_id for content {content_id} rejected by Telegram: {e}. Re-uploading from Google Drive.")
+                if content_id:
+                    await Database.clear_content_telegram_file_id(content_id)
+
+        if not self.drive_client:
             logger.error("Google Drive service not initialized. Cannot send content.")
+            if raise_on_error:
+                raise RuntimeError("Google Drive service not initialized")
             await self.app.bot.send_message(
                 chat_id=user_id,
                 text="⚠️ Content delivery service not available. Please contact support"
@@ -600,59 +1139,278 @@ class MovieBot:
             return
 
         try:
-            
-            logger.info(f"Attempting to download file {google_drive_file_id} from Google Drive.")
-
-            # Request the file metadata to get its actual name (optional, but good for saving)
-            file_metadata = self.google_drive_service.files().get(fileId=google_drive_file_id, fields='name').execute()
-            actual_file_name = file_metadata.get('name', f"{title}.{file_type.lower() if file_type else 'file'}")
-
-            # Download the file content
-            request = self.google_drive_service.files().get_media(fileId=google_drive_file_id)
-            file_stream = io.BytesIO()
-            downloader = MediaIoBaseDownload(file_stream, request)
-            done = False
-            while done is False:
-                status, done = await asyncio.to_thread(downloader.next_chunk) # Use asyncio.to_thread for blocking IO
-                logger.debug(f"Download progress: {int(status.progress() * 100)}%.")
-
-            file_stream.seek(0) # Rewind the stream to the beginning
-
-            caption = f"Here is your requested content: *{escape_markdown(title, version=2)}*"
-
-            if file_type.lower() == "video":
-                await self.app.bot.send_video(
-                    chat_id=user_id,
-                    video=file_stream,
-                    caption=caption,
-                    parse_mode='MarkdownV2',
-                    filename=actual_file_name # Use the actual file name
-                )
-            elif file_type.lower() == "document":
-                await self.app.bot.send_document(
-                    chat_id=user_id,
-                    document=file_stream,
-                    caption=caption,
-                    parse_mode='MarkdownV2',
-                    filename=actual_file_name # Use the actual file name
-                )
-            else:
-                # Default to document if type is unknown or not video
-                await self.app.bot.send_document(
-                    chat_id=user_id,
-                    document=file_stream,
-                    caption=caption,
-                    parse_mode='MarkdownV2',
-                    filename=actual_file_name
-                )
+            file_stream, actual_file_name = await self._download_from_drive(google_drive_file_id, file_type, title)
+            try:
+                message = await self._send_media(user_id, file_type, file_stream, caption, filename=actual_file_name)
+            finally:
+                file_stream.close() # Releases the spool (memory buffer or temp file)
             logger.info(f"Successfully sent content '{title}' (GD ID: {google_drive_file_id}) to user {user_id}.")
 
+            new_file_id = self._extract_file_id(message)
+            if content_id and new_file_id:
+                try:
+                    await Database.set_content_telegram_file_id(content_id, new_file_id)
+                    logger.info(f"Cached Telegram file_id for content {content_id}.")
+                except Exception as e:
+                    # The user already has the file; failing here would make the delivery send it again
+                    logger.warning(f"Failed to cache Telegram file_id for content {content_id}: {e}")
+            return new_file_id
+
         except Exception as e:
             logger.error(f"Failed to send content (GD ID: {google_drive_file_id}) to user {user_id}: {e}")
+            if raise_on_error:
+                raise
             await self.app.bot.send_message(
                 chat_id=user_id,
                 text="⚠️ An error occurred while delivering your content from Google Drive. Please contact support."
             )
+
+    async def delivery_worker(self, worker_id: int):
+        """Claims and processes queued deliveries until shutdown."""
+        logger.info(f"Delivery worker {worker_id} started.")
+        while not self._shutdown_event.is_set():
+            try:
+                job = await Database.claim_delivery(Config.DELIVERY_LOCK_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Delivery worker {worker_id} failed to claim a job: {e}")
+                job = None
+
+            if job:
+                try:
+                    await self._process_delivery(job)
+                except Exception as e:
+                    # The job stays locked and is reclaimed after DELIVERY_LOCK_TIMEOUT
+                    logger.error(f"Delivery worker {worker_id} failed to record result of delivery #{job['delivery_id']}: {e}")
+                continue
+
+            # Nothing due; sleep until woken by a new job, the poll interval, or shutdown
+            self._delivery_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._delivery_wakeup.wait(), timeout=Config.DELIVERY_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process_delivery(self, job: dict):
+        """
+        Runs one delivery job, scheduling a retry with exponential backoff on failure.
+        The job's lease is renewed while it runs, so long downloads or uploads are not
+        reclaimed (and sent a second time) by another worker after DELIVERY_LOCK_TIMEOUT.
+        If the content was sent but the job could not be completed, the retry records that it was
+        sent, and the next attempt only completes the job instead of sending the content again.
+        """
+        delivery_id = job['delivery_id']
+        attempt = job['attempts'] # Identifies this claim's lease
+        payment_id = job['payment_id']
+        content_id = str(job['content_id'])
+        sent, sent_file_id = job.get('sent_at') is not None, job.get('telegram_file_id')
+        heartbeat = asyncio.create_task(self._delivery_heartbeat(delivery_id, attempt))
+        try:
+            try:
+                content_info = await Database.get_content_from_cms_library(content_id)
+                if not content_info:
+                    raise ValueError(f"Content ID {content_id} not found in CMS library")
+
+                if sent:
+                    logger.info(f"Delivery #{delivery_id} was already sent to user {job['user_id']}; completing it without resending.")
+                else:
+                    sent_file_id = await self._send_content_to_user(
+                        job['user_id'], content_info['file_path'], content_info['file_type'], content_info['title'],
+                        content_id=content_id, telegram_file_id=content_info.get('telegram_file_id'), raise_on_error=True
+                    )
+                    sent = True
+                if not await Database.complete_delivery(delivery_id, attempt, sent_file_id):
+                    logger.warning(f"Delivery #{delivery_id} completed after its lease was taken over by another worker.")
+                    return
+                logger.info(f"Delivery #{delivery_id} of content {content_id} to user {job['user_id']} completed.")
+                await self._notify_admin(
+                    f"✅ Delivery #{delivery_id}: '{content_info['title']}' delivered to user {job['user_id']} for payment {payment_id}."
+                )
+
+            except Exception as e:
+                error = str(e)[:1000]
+                if attempt < Config.DELIVERY_MAX_ATTEMPTS and not isinstance(e, DownloadTooLarge): # Too large stays too large
+                    delay = min(Config.DELIVERY_RETRY_BASE_DELAY * (2 ** (attempt - 1)) + random.uniform(0, 5), 3600)
+                    logger.warning(f"Delivery #{delivery_id} attempt {attempt} failed: {e}. Retrying in {delay:.0f} seconds.")
+                    if not await Database.retry_delivery(delivery_id, attempt, error, delay, sent, sent_file_id):
+                        logger.warning(f"Delivery #{delivery_id} was taken over by another worker; not rescheduling.")
+                else:
+                    logger.error(f"Delivery #{delivery_id} failed permanently after {attempt} attempts: {e}")
+                    if not await Database.fail_delivery(delivery_id, attempt, error):
+                        logger.warning(f"Delivery #{delivery_id} was taken over by another worker; not marking it failed.")
+                        return
+                    await self._notify_admin(
+                        f"🚨 Delivery #{delivery_id} for payment {payment_id} failed after {attempt} attempts: {error}"
+                    )
+                    if sent:
+                        return # The user has the content; only the bookkeeping failed
+                    try:
+                        await self.app.bot.send_message(
+                            chat_id=job['user_id'],
+                            text="⚠️ An error occurred while delivering your content from Google Drive. Please contact support."
+                        )
+                    except Exception as notify_error:
+                        logger.error(f"Failed to notify user {job['user_id']} about failed delivery: {notify_error}")
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+    async def _delivery_heartbeat(self, delivery_id: int, attempt: int):
+        """Renews a running delivery's lease every third of DELIVERY_LOCK_TIMEOUT until cancelled."""
+        interval = max(Config.DELIVERY_LOCK_TIMEOUT / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not await Database.heartbeat_delivery(delivery_id, attempt):
+                    logger.warning(f"Delivery #{delivery_id} lost its lease (attempt {attempt}); it may be sent twice.")
+                    return
+            except Exception as e:
+                logger.warning(f"Failed to renew the lease of delivery #{delivery_id}: {e}")
+
+    async def _download_from_drive(self, google_drive_file_id: str, file_type: str, title: str):
+        """
+        Downloads a file from Google Drive and returns (stream, file_name). The caller must close the stream.
+        Files up to Config.DELIVERY_SPOOL_MAX_MEMORY are buffered in memory; larger (or unknown-size)
+        files are spooled to an anonymous temp file so memory use does not grow with file size.
+        Files above Config.DELIVERY_SPOOL_MAX_BYTES raise DownloadTooLarge, and a spool that would
+        not fit in the temp directory's free space raises OSError, before the disk fills up.
+        """
+        logger.info(f"Attempting to download file {google_drive_file_id} from Google Drive.")
+
+        # Request the file metadata to get its actual name and size
+        file_metadata = await self.drive_client.get_metadata(google_drive_file_id, fields='name,size')
+        actual_file_name = file_metadata.get('name', f"{title}.{file_type.lower() if file_type else 'file'}")
+        file_size = int(file_metadata.get('size') or 0)
+
+        if file_size > Config.DELIVERY_SPOOL_MAX_BYTES:
+            raise DownloadTooLarge(f"Drive file {google_drive_file_id} is {file_size} bytes, over DELIVERY_SPOOL_MAX_BYTES")
+
+        max_bytes = Config.DELIVERY_SPOOL_MAX_BYTES # Enforced while downloading too, as the size may be unknown
+        if Config.DELIVERY_STREAMING and (file_size == 0 or file_size > Config.DELIVERY_SPOOL_MAX_MEMORY):
+            free = shutil.disk_usage(tempfile.gettempdir()).free
+            if file_size > free:
+                raise OSError(f"Not enough free space in {tempfile.gettempdir()} to spool {file_size} bytes ({free} free)")
+            max_bytes = min(max_bytes, free)
+            file_stream = tempfile.TemporaryFile()
+        else:
+            file_stream = io.BytesIO()
+
+        # Download the file content
+        try:
+            await self.drive_client.download(google_drive_file_id, file_stream, chunk_size=Config.DRIVE_DOWNLOAD_CHUNK_SIZE,
+                                             max_bytes=max_bytes)
+        except DownloadTooLarge as e:
+            file_stream.close()
+            if max_bytes < Config.DELIVERY_SPOOL_MAX_BYTES:
+                # Limited by free disk space, which a later retry may have
+                raise OSError(f"Ran out of free space in {tempfile.gettempdir()} while spooling: {e}") from e
+            raise
+        except Exception:
+            file_stream.close()
+            raise
+
+        file_stream.seek(0) # Rewind the stream to the beginning
+        return file_stream, actual_file_name
+
+    async def _send_media(self, chat_id, file_type: str, media, caption: str = None, filename: str = None):
+        """
+        Sends a video or document. `media` may be a file-like object or a Telegram file_id.
+        Unknown file types are sent as documents.
+        """
+        if Config.DELIVERY_STREAMING and not isinstance(media, str):
+            return await self._stream_upload(chat_id, file_type, media, caption, filename)
+
+        if file_type and file_type.lower() == "video":
+            return await self.app.bot.send_video(
+                chat_id=chat_id,
+                video=media,
+                caption=caption,
+                parse_mode='MarkdownV2' if caption else None,
+                filename=filename
+            )
+        return await self.app.bot.send_document(
+            chat_id=chat_id,
+            document=media,
+            caption=caption,
+            parse_mode='MarkdownV2' if caption else None,
+            filename=filename
+        )
+
+    async def _stream_upload(self, chat_id, file_type: str, file_stream, caption: str = None, filename: str = None):
+        """
+        Uploads a file-like object straight to the Bot API as a streamed multipart body.
+        python-telegram-bot reads the whole file into memory before uploading; aiohttp instead
+        reads the stream in small chunks, so peak memory stays flat regardless of file size.
+        """
+        is_video = bool(file_type) and file_type.lower() == "video"
+        method = "sendVideo" if is_video else "sendDocument"
+        field = "video" if is_video else "document"
+
+        form = aiohttp.FormData()
+        form.add_field("chat_id", str(chat_id))
+        if caption:
+            form.add_field("caption", caption)
+            form.add_field("parse_mode", "MarkdownV2")
+        form.add_field(field, file_stream, filename=filename or "file")
+
+        # This bypasses the bot, so go through the outbound scheduler explicitly
+        await self.rate_limiter.acquire(chat_id, PRIORITY_HIGH)
+        session = await self._get_http_session()
+        url = f"{Config.TELEGRAM_API_URL}/bot{Config.TOKEN}/{method}"
+        with metrics.BOT_API_SECONDS.time(endpoint=method):
+            async with session.post(url, data=form) as response:
+                data = await response.json()
+
+        if not data.get("ok"):
+            description = data.get("description", "Unknown error")
+            metrics.BOT_API_ERRORS.inc(endpoint=method, error=f"http_{response.status}")
+            if response.status == 429:
+                retry_after = data.get("parameters", {}).get("retry_after", 5)
+                self.rate_limiter.pause(retry_after, chat_id) # Later sends to this chat must back off too
+                logger.warning(f"Flood limit hit on streamed {method} (chat {chat_id}); pausing the chat for {retry_after}s.")
+                raise RetryAfter(retry_after)
+            if response.status == 400:
+                raise BadRequest(description)
+            raise TelegramError(f"{method} failed ({response.status}): {description}")
+        return Message.de_json(data["result"], self.app.bot)
+
+    async def _get_http_session(self):
+        """Returns the shared aiohttp session used for streamed uploads, creating it on first use."""
+        if self._http_session is None or self._http_session.closed:
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300)
+            self._http_session = aiohttp.ClientSession(timeout=timeout)
+        return self._http_session
+
+    @staticmethod
+    def _extract_file_id(message):
+        """Returns the file_id of the media attached to a sent message, if any."""
+        if message is None:
+            return None
+        media = message.video or message.document or message.animation
+        return media.file_id if media else None
+
+    async def _cache_content_in_storage_channel(self, content_id: str, google_drive_file_id: str, file_type: str, title: str):
+        """
+        Pre-uploads content to the private storage channel so the first buyer is also served by file_id.
+        Returns the cached file_id, or None if no storage channel is configured or the upload failed.
+        """
+        if not Config.STORAGE_CHANNEL_ID or not self.drive_client:
+            return None
+
+        try:
+            file_stream, actual_file_name = await self._download_from_drive(google_drive_file_id, file_type, title)
+            try:
+                message = await self._send_media(int(Config.STORAGE_CHANNEL_ID), file_type, file_stream, filename=actual_file_name)
+            finally:
+                file_stream.close()
+            new_file_id = self._extract_file_id(message)
+            if new_file_id:
+                await Database.set_content_telegram_file_id(content_id, new_file_id)
+                logger.info(f"Pre-uploaded content {content_id} to storage channel and cached its file_id.")
+            return new_file_id
+        except Exception as e:
+            logger.error(f"Failed to pre-upload content {content_id} to storage channel: {e}")
+            return None
+
     async def get_bot_stats(self, update, context):
         user_id = update.effective_user.id
         if user_id != Config.ADMIN_ID:
@@ -679,6 +1437,124 @@ class MovieBot:
             logger.error(f"Error fetching bot stats: {e}")
             await update.message.reply_text("⚠️ An error occurred while fetching bot statistics.")
 
+    async def handle_db_pool(self, update, context):
+        """Admin command showing live database connection pool counters."""
+        if update.message.from_user.id != Config.ADMIN_ID:
+            return await update.message.reply_text("❌ Admin only!")
+
+        stats = Database.get_pool_stats()
+        response = (
+            "🗄 Database Pool:\n\n"
+            f"• Size: {stats['size']} (min {stats['min_size']}, max {stats['max_size']})\n"
+            f"• In use: {stats['in_use']}\n"
+            f"• Idle: {stats['idle']}\n"
+            f"• Waiters: {stats['waiters']}\n"
+            f"• Acquired total: {stats['acquired_total']}\n"
+            f"• Slow acquires: {stats['slow_acquires']}\n"
+            f"• Acquire timeouts: {stats['acquire_timeouts']}\n"
+            f"• Max acquire wait: {stats['max_acquire_seconds']:.3f}s"
+        )
+        await update.message.reply_text(response)
+
+    async def handle_jobs(self, update, context):
+        """Admin command showing scheduled job leadership and run-time metrics."""
+        if update.message.from_user.id != Config.ADMIN_ID:
+            return await update.message.reply_text("❌ Admin only!")
+
+        try:
+            runs = await Database.get_job_runs()
+            role = "leader" if self.scheduler.is_leader else "follower"
+            response = f"⏱ Scheduled Jobs (this process: {role}):\n\n"
+            for name, job in self.scheduler.jobs.items():
+                run = runs.get(name)
+                if not run:
+                    response += f"• {name}: every {job.interval}s, never run\n"
+                    continue
+                status_emoji = "✅" if run['last_status'] == 'ok' else "❌"
+                response += (
+                    f"• {name}: every {job.interval}s {status_emoji}\n"
+                    f"   last {run['last_run_at'].strftime('%Y-%m-%d %H:%M:%S')} on {run['last_runner']}, "
+                    f"{run['last_duration_ms']:.0f} ms (avg {run['avg_duration_ms']:.0f}, max {run['max_duration_ms']:.0f})\n"
+                    f"   runs {run['run_count']}, failures {run['failure_count']}\n"
+                )
+            await update.message.reply_text(response)
+        except Exception as e:
+            logger.error(f"Error in handle_jobs: {e}")
+            await update.message.reply_text(f"⚠️ Error: {e}")
+
+    async def handle_memtrace(self, update, context):
+        """
+        Admin command controlling on-demand memory tracing.
+        Usage: /memtrace start [frames] | stop | top [N] | diff [N]
+        """
+        if update.message.from_user.id != Config.ADMIN_ID:
+            return await update.message.reply_text("❌ Admin only!")
+
+        usage = "Usage: /memtrace start [frames] | stop | top [N] | diff [N] (frames 1-65535, N at least 1)"
+        action = context.args[0].lower() if context.args else None
+        try:
+            number = int(context.args[1]) if len(context.args) > 1 else None
+        except ValueError:
+            return await update.message.reply_text(usage)
+        # tracemalloc.start() raises ValueError outside 1..65535 frames
+        max_number = 65535 if action == 'start' else None
+        if number is not None and (number < 1 or (max_number and number > max_number)):
+            return await update.message.reply_text(usage)
+
+        tracer = self.memory_tracer
+        if action == 'start':
+            if tracer.is_tracing:
+                return await update.message.reply_text("tracemalloc is already running.")
+            tracer.start(frames=number or 1)
+            logger.info("tracemalloc started by admin.")
+            await update.message.reply_text("🧠 tracemalloc started. Use /memtrace top or /memtrace diff, and /memtrace stop when done.")
+        elif action == 'stop':
+            if not tracer.is_tracing:
+                return await update.message.reply_text("tracemalloc is not running.")
+            tracer.stop()
+            logger.info("tracemalloc stopped by admin.")
+            await update.message.reply_text("🧠 tracemalloc stopped.")
+        elif action in ('top', 'diff'):
+            if not tracer.is_tracing:
+                return await update.message.reply_text("tracemalloc is not running. Start it with /memtrace start.")
+            report = tracer.top(number or 25) if action == 'top' else tracer.diff(number or 25)
+            await self._send_report(update, report, f"memtrace-{action}")
+        else:
+            await update.message.reply_text(usage)
+
+    async def handle_profile(self, update, context):
+        """
+        Admin command running a time-limited CPU profile of the event loop.
+        Usage: /profile [seconds] [sample|cprofile] (defaults: 30, sample)
+        """
+        if update.message.from_user.id != Config.ADMIN_ID:
+            return await update.message.reply_text("❌ Admin only!")
+
+        try:
+            seconds = float(context.args[0]) if context.args else 30.0
+        except ValueError:
+            return await update.message.reply_text("Usage: /profile [seconds] [sample|cprofile]")
+        mode = context.args[1].lower() if len(context.args) > 1 else 'sample'
+        if mode not in ('sample', 'cprofile') or not 0 < seconds <= Config.PROFILE_MAX_SECONDS:
+            return await update.message.reply_text(
+                f"Usage: /profile [seconds] [sample|cprofile] (at most {Config.PROFILE_MAX_SECONDS}s)"
+            )
+
+        await update.message.reply_text(f"⏱ Profiling the event loop for {seconds:g}s ({mode})...")
+        try:
+            if mode == 'cprofile':
+                report = await self.cpu_profiler.cprofile(seconds)
+            else:
+                report = await self.cpu_profiler.sample(seconds)
+        except ProfilerBusy:
+            return await update.message.reply_text("A profile is already running.")
+        await self._send_report(update, report, f"profile-{mode}")
+
+    async def _send_report(self, update, report: str, name: str):
+        """Sends a text report to the admin as a document."""
+        filename = f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+        await update.message.reply_document(document=io.BytesIO(report.encode()), filename=filename)
+
     async def handle_support(self, update, context):
         # Determine the target message to reply to
         if hasattr(update, 'message') and update.message:
@@ -736,73 +1612,132 @@ class MovieBot:
             await update.message.reply_text("❌ Access denied!")
 
     async def handle_get_payments(self, update, context):
-        """List all payment IDs with statuses"""
+        """
+        List payment IDs with statuses, one page at a time.
+        Usage: /getpayments [status] [from YYYY-MM-DD] [to YYYY-MM-DD]
+        """
         if update.message.from_user.id != Config.ADMIN_ID:
             return await update.message.reply_text("❌ Admin only!")
-        
-        try:
-            payments = await Database.get_all_payment_ids() # Assuming this method exists in Database
-            if not payments:
-                return await update.message.reply_text("No payments found in the database.")
-            
-            response = "📋 All Payment IDs:\n\n"
-            for payment_id, status in payments:
-                status_emoji = "✅" if status == "completed" else "⏳"
-                response += f"{status_emoji} `{payment_id}` - {status}\n"
-            
-            if len(response) > 4000:
-                parts = [response[i:i+4000] for i in range(0, len(response), 4000)]
-                for part in parts:
-                    await update.message.reply_text(part, parse_mode='Markdown')
-            else:
-                await update.message.reply_text(response, parse_mode='Markdown')
-                
-        except Exception as e:
-            logger.error(f"Error in handle_get_payments: {e}")
-            await update.message.reply_text(f"⚠️ Error: {e}")
+        await self._open_payments_view(update, context, view='all')
 
     async def handle_pending_payments(self, update, context):
-        """Show admin all pending payments (without file info)"""
+        """
+        Show admin completed payments that still need content delivered, one page at a time.
+        Usage: /pending [from YYYY-MM-DD] [to YYYY-MM-DD]
+        """
         if update.message.from_user.id != Config.ADMIN_ID:
             return await update.message.reply_text("❌ Admin only!")
-        
+        await self._open_payments_view(update, context, view='pending')
+
+    @staticmethod
+    def _parse_payment_filters(args, allow_status: bool):
+        """Parses optional [status] [from date] [to date] arguments. Raises ValueError on bad input."""
+        status, dates = None, []
+        for arg in args or []:
+            try:
+                dates.append(datetime.strptime(arg, '%Y-%m-%d'))
+            except ValueError:
+                if not allow_status or status or dates:
+                    raise ValueError(f"Unexpected argument: {arg}")
+                status = arg.lower()
+        if len(dates) > 2:
+            raise ValueError("At most two dates can be given")
+        since = dates[0] if dates else None
+        until = dates[1] + timedelta(days=1) if len(dates) > 1 else None # 'to' date is inclusive
+        return {'status': status, 'since': since, 'until': until}
+
+    async def _open_payments_view(self, update, context, view: str):
         try:
-            pending_payments = await Database.get_pending_payments_for_admin() # Assuming this method exists in Database
-            
-            if not pending_payments:
-                return await update.message.reply_text("✅ No pending payments - all caught up!")
-            
-            response = "📋 Pending Payments (need content files):\n\n"
-            for payment in pending_payments:
-                # Assuming payment is a dict or tuple with payment_id, user_id, amount, currency, request_timestamp
-                # and that get_user_info returns a dict or tuple with username
-                user_info = await Database.get_user_info(payment['user_id']) if isinstance(payment, dict) else await Database.get_user_info(payment[1])
-                username = f"@{user_info['username']}" if user_info and user_info.get('username') else "No username"
-                
-                payment_id = payment.get('payment_id') if isinstance(payment, dict) else payment[0]
-                amount = payment.get('amount') if isinstance(payment, dict) else payment[2]
-                currency = payment.get('currency') if isinstance(payment, dict) else payment[3]
-                request_timestamp = payment.get('request_timestamp') if isinstance(payment, dict) else payment[4]
+            filters_ = self._parse_payment_filters(context.args, allow_status=(view == 'all'))
+        except ValueError as e:
+            usage = "/getpayments [status] [YYYY-MM-DD] [YYYY-MM-DD]" if view == 'all' else "/pending [YYYY-MM-DD] [YYYY-MM-DD]"
+            return await update.message.reply_text(f"⚠️ {e}\nUsage: {usage}")
+
+        # Page state lives in user_data under a short token so it fits in callback_data
+        views = context.user_data.setdefault('payment_views', {})
+        while len(views) >= 20:
+            views.pop(next(iter(views))) # Drop the oldest view
+        token = uuid.uuid4().hex[:8]
+        views[token] = {'view': view, **filters_, 'page': 0, 'first': None, 'last': None}
 
-                response += (
-                    f"🆔 Payment ID: `{payment_id}`\n"
-                    f"👤 User: {username} ({payment.get('user_id') if isinstance(payment, dict) else payment[1]})\n"
-                    f"💰 Amount: {amount/100} {currency}\n"
-                    f"⏰ Requested: {request_timestamp.strftime('%Y-%m-%d %H:%M')}\n"
-                    f"🔗 To process: `/deliver {payment_id} <content_id>`\n\n" # Changed to /deliver
-                )
-            
-            if len(response) > 4000:
-                parts = [response[i:i+4000] for i in range(0, len(response), 4000)]
-                for part in parts:
-                    await update.message.reply_text(part, parse_mode='Markdown')
-            else:
-                await update.message.reply_text(response, parse_mode='Markdown')
-                
+        try:
+            await self._render_payments_page(context, token, 'next', message=update.message)
         except Exception as e:
-            logger.error(f"Error in handle_pending_payments: {e}")
+            logger.error(f"Error in payments view '{view}': {e}")
             await update.message.reply_text(f"⚠️ Error: {e}")
 
+    async def handle_payment_page_callback(self, update, context):
+        """Handles Next/Prev buttons of the admin payment views (callback data pg:<token>:<n|p>)."""
+        query = update.callback_query
+        if query.from_user.id != Config.ADMIN_ID:
+            return
+        _, token, direction = query.data.split(":")
+        if token not in context.user_data.get('payment_views', {}):
+            return await query.edit_message_text("⌛ This list has expired. Please run the command again.")
+        try:
+            await self._render_payments_page(context, token, 'next' if direction == 'n' else 'prev', query=query)
+        except Exception as e:
+            logger.error(f"Error paging payments view: {e}")
+            await query.message.reply_text(f"⚠️ Error: {e}")
+
+    async def _render_payments_page(self, context, token: str, direction: str, message=None, query=None):
+        """Fetches one page for the view stored under token and sends it (message) or edits it in place (query)."""
+        state = context.user_data['payment_views'][token]
+        cursor = state['last'] if direction == 'next' else state['first']
+        rows, has_more = await Database.get_payments_page(
+            Config.ADMIN_PAGE_SIZE,
+            status=state['status'],
+            awaiting_delivery=(state['view'] == 'pending'),
+            since=state['since'],
+            until=state['until'],
+            cursor=cursor,
+            direction=direction
+        )
+
+        if not rows:
+            if state['page'] == 0:
+                text = "No payments found in the database." if state['view'] == 'all' else "✅ No pending payments - all caught up!"
+                return await (message.reply_text(text) if message else query.edit_message_text(text))
+            return # Rows vanished since the last page; keep showing the current one
+
+        state['page'] += 1 if direction == 'next' else -1
+        state['first'] = (rows[0]['request_timestamp'], rows[0]['payment_id'])
+        state['last'] = (rows[-1]['request_timestamp'], rows[-1]['payment_id'])
+        has_next = has_more if direction == 'next' else True
+        has_prev = state['page'] > 1
+
+        if state['view'] == 'all':
+            response = f"📋 Payment IDs (page {state['page']}):\n\n"
+            for payment in rows:
+                status_emoji = "✅" if payment['status'] == "completed" else "⏳"
+                response += f"{status_emoji} `{payment['payment_id']}` - {payment['status']}\n"
+        else:
+            # Resolve all users on the page with a single batched query
+            users = await Database.get_users_by_ids({payment['user_id'] for payment in rows})
+            user_infos = [users.get(payment['user_id']) for payment in rows]
+            response = f"📋 Pending Payments (need content files, page {state['page']}):\n\n"
+            for payment, user_info in zip(rows, user_infos):
+                username = f"@{escape_markdown(user_info['username'], version=1)}" if user_info and user_info.get('username') else "No username"
+                response += (
+                    f"🆔 Payment ID: `{payment['payment_id']}`\n"
+                    f"👤 User: {username} ({payment['user_id']})\n"
+                    f"💰 Amount: {payment['amount']/100} {payment['currency']}\n"
+                    f"⏰ Requested: {payment['request_timestamp'].strftime('%Y-%m-%d %H:%M')}\n"
+                    f"🔗 To process: `/deliver {payment['payment_id']} <content_id>`\n\n"
+                )
+
+        buttons = []
+        if has_prev:
+            buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"pg:{token}:p"))
+        if has_next:
+            buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"pg:{token}:n"))
+        reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+
+        if message:
+            await message.reply_text(response, parse_mode='Markdown', reply_markup=reply_markup)
+        else:
+            await query.edit_message_text(response, parse_mode='Markdown', reply_markup=reply_markup)
+
     async def handle_retry_request(self, update, context):
         # Determine the target message to reply to
         if hasattr(update, 'message') and update.message:
@@ -913,13 +1848,13 @@ class MovieBot:
     async def _show_payment_details(self, message, payment_id):
         """Show details of a specific payment"""
         try:
-            payment = await Database.get_payment_details(payment_id) # Assuming this method exists and returns a dict
+            # Payment, user and content in one joined query
+            payment = await Database.get_payment_admin_view(payment_id)
             
             if not payment:
                 return await message.reply_text("❌ Payment ID not found")
             
-            user_info = await Database.get_user_info(payment['user_id'])
-            username = f"@{user_info['username']}" if user_info and user_info.get('username') else f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip()
+            username = f"@{payment['username']}" if payment.get('username') else f"{payment.get('first_name') or ''} {payment.get('last_name') or ''}".strip()
             status_emoji = "✅" if payment['status'] == "completed" else "⏳"
             
             response = (
@@ -935,8 +1870,7 @@ class MovieBot:
                 response += f"✅ Completed: {payment['completion_timestamp'].strftime('%Y-%m-%d %H:%M')}\n"
             
             if payment['content_id']: # Using 'content_id' from bot1.py's schema
-                content_info = await Database.get_content_from_cms_library(payment['content_id'])
-                content_title = content_info['title'] if content_info else "Unknown Content"
+                content_title = payment['content_title'] or "Unknown Content"
                 response += (
                     f"\n🎬 Content Info:\n"
                     f"📁 Content Title: {content_title}\n"
@@ -995,15 +1929,26 @@ class MovieBot:
 *Admin Commands* (Admin only):
 /addcontent - Add a content to the CMS library
 /deliver - Deliver content to a user
+/syncdrive - Sync the Google Drive content folder
 /checkpayment - Check payment details
-/pending - List pending payments
+/pending - List payments awaiting delivery
 /stats - View bot statistics
+/dbpool - Database connection pool status
+/jobs - Scheduled job status
+/broadcast - Message all users
+/broadcaststatus - Broadcast progress
+/cancelbroadcast - Stop a broadcast
+/memtrace - Memory tracing (start, stop, top, diff)
+/profile - Profile the event loop
 /panel - Admin control panel
 /getpayments - List all payment IDs
 
 Click buttons or type commands to interact with me!
 """
-        await target_message.reply_text(help_text, parse_mode='Markdown')
+        await context.bot.send_message(
+            chat_id=target_message.chat_id, text=help_text, parse_mode='Markdown',
+            rate_limit_args={'priority': PRIORITY_LOW}
+        )
 
     # --- END NEW HANDLER METHODS ---
 
@@ -1035,7 +1980,7 @@ async def main():
             logger.info(f"Starting bot initialization attempt {attempt + 1}/{max_startup_retries}")
             
             # Check network stability first
-            network_ok = await bot.check_network_stability()
+            network_ok = await bot.check_network_stability() if Config.STARTUP_NETWORK_CHECK else True
             if not network_ok:
                 logger.error("Network stability check failed, skipping this attempt")
                 if attempt < max_startup_retries - 1:
@@ -1072,23 +2017,45 @@ async def main():
             # Start background tasks after the app is running
             await bot.start_background_tasks()
             
-            logger.info("Bot started successfully, beginning to poll for updates...")
-            
-            # Start polling with error handling
-            try:
-                await bot.app.updater.start_polling(
+            if Config.BOT_MODE == 'webhook':
+                logger.info("Bot started successfully, starting webhook server...")
+                bot.webhook_server = WebhookServer(
+                    bot.enqueue_update,
+                    listen=Config.WEBHOOK_LISTEN,
+                    port=Config.WEBHOOK_PORT,
+                    path=Config.WEBHOOK_PATH,
+                    secret_token=Config.WEBHOOK_SECRET_TOKEN
+                )
+                await bot.webhook_server.start()
+                await bot.app.bot.set_webhook(
+                    url=f"{Config.WEBHOOK_URL.rstrip('/')}{Config.WEBHOOK_PATH}",
+                    secret_token=Config.WEBHOOK_SECRET_TOKEN,
                     allowed_updates=Update.ALL_TYPES,
-                    drop_pending_updates=True,  # Skip old updates
-                    timeout=30,  # 30 second timeout for getting updates
-                    bootstrap_retries=3,  # Retry connection 3 times
+                    drop_pending_updates=Config.WEBHOOK_DROP_PENDING_UPDATES,
+                    max_connections=Config.WEBHOOK_MAX_CONNECTIONS
                 )
-                
+                logger.info("Webhook registered with Telegram.")
+
                 # Keep the bot running
                 await asyncio.Event().wait()
-                
-            except Exception as polling_error:
-                logger.error(f"Error during polling: {polling_error}")
-                raise
+            else:
+                logger.info("Bot started successfully, beginning to poll for updates...")
+
+                # Start polling with error handling
+                try:
+                    await bot.app.updater.start_polling(
+                        allowed_updates=Update.ALL_TYPES,
+                        drop_pending_updates=True,  # Skip old updates
+                        timeout=30,  # 30 second timeout for getting updates
+                        bootstrap_retries=3,  # Retry connection 3 times
+                    )
+
+                    # Keep the bot running
+                    await asyncio.Event().wait()
+
+                except Exception as polling_error:
+                    logger.error(f"Error during polling: {polling_error}")
+                    raise
                 
             # If we reach here, the bot started successfully
             break
@@ -1128,7 +2095,9 @@ async def main():
     finally:
         logger.info("Starting shutdown sequence...")
         try:
-            # Stop the updater first
+            # Stop receiving updates first
+            if bot.webhook_server:
+                await bot.webhook_server.stop()
             if bot.app and hasattr(bot.app, 'updater') and bot.app.updater and bot.app.updater.running:
                 logger.info("Stopping updater...")
                 await bot.app.updater.stop()
@@ -1150,16 +2119,18 @@ async def main():
 # Add a function to test network connectivity before starting
 async def test_connectivity():
     """Test basic network connectivity before starting the bot"""
+    if not Config.STARTUP_NETWORK_CHECK:
+        return True
     logger.info("Testing network connectivity...")
     
     try:
         # Test DNS resolution
-        socket.gethostbyname('api.telegram.org')
+        socket.gethostbyname(urlparse(Config.TELEGRAM_API_URL).hostname)
         logger.info("DNS resolution test passed")
         
         # Test HTTP connectivity
         async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-            async with session.get("https://api.telegram.org") as response:
+            async with session.get(Config.TELEGRAM_API_URL) as response:
                 logger.info(f"HTTP connectivity test passed (status: {response.status})")
         
         return True
@@ -1173,8 +2144,12 @@ if __name__ == "__main__":
     try:
         # Test connectivity first
         if asyncio.run(test_connectivity()):
-            logger.info("Network connectivity tests passed, starting bot...")
-            asyncio.run(main())
+            if Config.WORKER_PROCESSES > 1:
+                logger.info("Network connectivity tests passed, starting supervisor...")
+                asyncio.run(run_supervisor())
+            else:
+                logger.info("Network connectivity tests passed, starting bot...")
+                asyncio.run(main())
         else:
             logger.critical("Network connectivity tests failed. Please check your internet connection.")
             sys.exit(1)
@@ -0,0 +1,403 @@
+"""
+Database benchmark suite.
+
+Seeds a scratch PostgreSQL database with realistic volumes of users, content and payments,
+then times every Database method sequentially (p50/p95/p99) and under N concurrent callers
+(throughput), and captures EXPLAIN (ANALYZE, BUFFERS) for each query a method issues.
+
+Exits non-zero if a method's p95 regressed against a saved baseline, or if a hot-path query
+plans a sequential scan over a large table.
+
+The database is taken from the usual DB_* settings. Seeding truncates the bot's tables, so it
+refuses to run against a database whose name does not contain "bench" unless --force is given.
+
+    python -m benchmarks.db_benchmark --seed --users 200000 --payments 2000000
+    python -m benchmarks.db_benchmark --save-baseline bench-baseline.json
+    python -m benchmarks.db_benchmark --baseline bench-baseline.json --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# Only the DB_* settings matter here; fill the other required ones so Config.validate() passes
+for _name, _value in {'TOKEN': 'benchmark', 'ADMIN_ID': '1', 'ADMIN_CHANNEL_ID': '1', 'ADVERTISING_CHANNEL': 'benchmark',
+                      'ADVERTISING_CHANNEL_INVITE_LINK': 'benchmark', 'PAYMENT_PROVIDER_TOKEN': 'benchmark'}.items():
+    os.environ.setdefault(_name, _value)
+
+from config import Config # noqa: E402
+from database import Database # noqa: E402
+
+# Tables whose full scan is always the right plan (single-row or tiny by design)
+SMALL_TABLES = {'payment_stats', 'scheduled_jobs', 'schema_version', 'broadcasts'}
+
+
+def percentile(sorted_values, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class BenchCase:
+    def __init__(self, name: str, func, hot: bool = True):
+        self.name = name
+        self.func = func # async callable taking a random.Random, issuing one Database call
+        self.hot = hot # Hot-path methods must not plan sequential scans over large tables
+
+
+class Fixture:
+    """Ids of seeded rows, sampled by the benchmark cases."""
+
+    def __init__(self):
+        self.max_user_id = 0
+        self.payment_count = 0
+        self.content_ids = []
+        self.deep_cursor = None # A (request_timestamp, payment_id) far down the payments list
+
+    async def load(self):
+        result = await Database.execute_query("SELECT COALESCE(MAX(user_id), 0) FROM users", fetch=True)
+        self.max_user_id = result[0][0]
+        result = await Database.execute_query("SELECT COUNT(*) FROM payments WHERE payment_id ~ '^bench-[0-9]+$'", fetch=True)
+        self.payment_count = result[0][0]
+        result = await Database.execute_query("SELECT content_id FROM content_library LIMIT 1000", fetch=True) or []
+        self.content_ids = [str(row[0]) for row in result]
+        result = await Database.execute_query("""
+            SELECT request_timestamp, payment_id FROM payments
+            ORDER BY request_timestamp DESC, payment_id DESC OFFSET %s LIMIT 1
+        """, (self.payment_count // 2,), fetch=True)
+        self.deep_cursor = tuple(result[0]) if result else None
+        if not (self.max_user_id and self.payment_count and self.content_ids):
+            raise SystemExit("The database has no benchmark data; run with --seed first.")
+
+    def user_id(self, rng) -> int:
+        return rng.randint(1, self.max_user_id)
+
+    def payment_id(self, rng) -> str:
+        return f"bench-{rng.randint(1, self.payment_count)}"
+
+    def content_id(self, rng) -> str:
+        return rng.choice(self.content_ids)
+
+    @staticmethod
+    def fresh_payment_id() -> str:
+        return f"bench-new-{uuid.uuid4().hex}"
+
+
+async def seed(users: int, content: int, payments: int, deliveries: int):
+    """Fills the schema with synthetic data using server-side generate_series."""
+    started = time.monotonic()
+    print(f"Seeding {users} users, {content} content items, {payments} payments, {deliveries} queued deliveries...")
+    await Database.execute_query("""
+        TRUNCATE deliveries, payments, content_library, users, payment_user_counts, payment_stats_deltas, broadcasts, drive_sync_state RESTART IDENTITY
+    """)
+    await Database.execute_query("""
+        INSERT INTO users (user_id, username, first_name, last_name, last_active)
+        SELECT g, 'user' || g, 'First' || g, 'Last' || g, NOW() - random() * INTERVAL '365 days'
+        FROM generate_series(1, %s) g
+    """, (users,))
+    await Database.execute_query("""
+        INSERT INTO content_library (title, file_path, file_type, uploaded_at)
+        SELECT 'Title ' || g, md5(g::TEXT), CASE WHEN g %% 3 = 0 THEN 'video' ELSE 'document' END,
+               NOW() - random() * INTERVAL '365 days'
+        FROM generate_series(1, %s) g
+    """, (content,))
+
+    # The stats trigger writes a delta row per insert; bulk-load without it and reconcile after
+    await Database.execute_query("ALTER TABLE payments DISABLE TRIGGER payments_stats_trigger")
+    try:
+        await Database.execute_query("""
+            WITH c AS (SELECT array_agg(content_id) AS ids FROM content_library)
+            INSERT INTO payments (payment_id, user_id, amount, currency, status, request_timestamp,
+                                  completion_timestamp, content_id)
+            SELECT 'bench-' || g,
+                   1 + (random() * (%s - 1))::BIGINT,
+                   100 + (random() * 900)::INT,
+                   'USD',
+                   s.status,
+                   s.ts,
+                   CASE WHEN s.status IN ('completed', 'delivered') THEN s.ts + INTERVAL '2 minutes' END,
+                   CASE WHEN s.status = 'delivered' THEN c.ids[1 + (g %% array_length(c.ids, 1))] END
+            FROM generate_series(1, %s) g
+            CROSS JOIN c
+            CROSS JOIN LATERAL (
+                SELECT NOW() - random() * INTERVAL '365 days' AS ts,
+                       CASE
+                           WHEN g %% 100 < 70 THEN 'delivered'
+                           WHEN g %% 100 < 75 THEN 'completed'
+                           WHEN g %% 100 < 80 THEN 'pending'
+                           ELSE 'expired'
+                       END AS status
+            ) s
+        """, (users, payments))
+    finally:
+        await Database.execute_query("ALTER TABLE payments ENABLE TRIGGER payments_stats_trigger")
+
+    await Database.execute_query("""
+        WITH c AS (SELECT array_agg(content_id) AS ids FROM (SELECT content_id FROM content_library LIMIT 100) x)
+        INSERT INTO deliveries (payment_id, content_id, user_id)
+        SELECT p.payment_id, c.ids[1 + (row_number() OVER () %% array_length(c.ids, 1))], p.user_id
+        FROM (SELECT payment_id, user_id FROM payments WHERE status = 'completed' LIMIT %s) p
+        CROSS JOIN c
+    """, (deliveries,))
+    await Database.reconcile_stats()
+    await Database.execute_query("VACUUM ANALYZE")
+    print(f"Seeded in {time.monotonic() - started:.1f}s.")
+
+
+def build_cases(fx: Fixture):
+    """One case per Database method, with arguments drawn from the seeded data."""
+    statuses = ('pending', 'completed', 'delivered', 'expired')
+    cases = [
+        BenchCase('add_or_update_user', lambda rng: Database.add_or_update_user(
+            fx.user_id(rng), 'bench', 'Bench', 'User')),
+        BenchCase('bulk_upsert_users[100]', lambda rng: Database.bulk_upsert_users(
+            [(user_id, 'bench', 'Bench', 'User', datetime.now())
+             for user_id in set(fx.user_id(rng) for _ in range(100))])),
+        BenchCase('get_user_info', lambda rng: Database.get_user_info(fx.user_id(rng))),
+        BenchCase('get_users_by_ids[10]', lambda rng: Database.get_users_by_ids(
+            [fx.user_id(rng) for _ in range(10)])),
+        BenchCase('add_pending_payment', lambda rng: Database.add_pending_payment(
+            fx.fresh_payment_id(), fx.user_id(rng), 500, 'USD')),
+        BenchCase('add_pending_payment[catalog]', lambda rng: Database.add_pending_payment(
+            fx.fresh_payment_id(), fx.user_id(rng), 500, 'USD', requested_content_id=fx.content_id(rng))),
+        BenchCase('update_payment_status', lambda rng: Database.update_payment_status(
+            fx.payment_id(rng), rng.choice(('completed', 'delivered')), 'bench-charge')),
+        BenchCase('get_payment_details', lambda rng: Database.get_payment_details(fx.payment_id(rng))),
+        BenchCase('get_payment_admin_view', lambda rng: Database.get_payment_admin_view(fx.payment_id(rng))),
+        BenchCase('get_payments_page[first]', lambda rng: Database.get_payments_page(Config.ADMIN_PAGE_SIZE)),
+        BenchCase('get_payments_page[status]', lambda rng: Database.get_payments_page(
+            Config.ADMIN_PAGE_SIZE, status=rng.choice(statuses))),
+        BenchCase('get_payments_page[awaiting]', lambda rng: Database.get_payments_page(
+            Config.ADMIN_PAGE_SIZE, awaiting_delivery=True)),
+        BenchCase('get_payments_page[deep]', lambda rng: Database.get_payments_page(
+            Config.ADMIN_PAGE_SIZE, cursor=fx.deep_cursor)),
+        BenchCase('get_payments_page[range]', lambda rng: Database.get_payments_page(
+            Config.ADMIN_PAGE_SIZE, since=datetime.now() - timedelta(days=30), until=datetime.now() - timedelta(days=7))),
+        BenchCase('get_content_from_cms_library', lambda rng: Database.get_content_from_cms_library(fx.content_id(rng))),
+        BenchCase('get_catalog_page[first]', lambda rng: Database.get_catalog_page(Config.CATALOG_PAGE_SIZE)),
+        BenchCase('get_catalog_page[deep]', lambda rng: Database.get_catalog_page(Config.CATALOG_PAGE_SIZE, offset=800)),
+        BenchCase('search_catalog[prefix]', lambda rng: Database.search_catalog(
+            rng.choice(('t', 'ti', 'x')), Config.INLINE_PAGE_SIZE)),
+        BenchCase('search_catalog[substring]', lambda rng: Database.search_catalog(
+            f"tle {rng.randint(1, 9999)}", Config.INLINE_PAGE_SIZE)),
+        BenchCase('search_catalog[fuzzy]', lambda rng: Database.search_catalog(
+            f"Titel {rng.randint(1, 9999)}", Config.INLINE_PAGE_SIZE)),
+        BenchCase('bulk_upsert_drive_content[100]', lambda rng: Database.bulk_upsert_drive_content(
+            [(f"bench-drive-{n}", f"Drive file {n}", 'video', datetime.now()) for n in rng.sample(range(1, 5001), 100)])),
+        BenchCase('flag_drive_content_removed[10]', lambda rng: Database.flag_drive_content_removed(
+            [f"bench-drive-{rng.randint(1, 5000)}" for _ in range(10)])),
+        BenchCase('set_content_telegram_file_id', lambda rng: Database.set_content_telegram_file_id(
+            fx.content_id(rng), 'bench-file-id')),
+        BenchCase('link_content_to_payment', lambda rng: Database.link_content_to_payment(
+            fx.payment_id(rng), fx.content_id(rng))),
+        BenchCase('enqueue_delivery', lambda rng: Database.enqueue_delivery(
+            fx.payment_id(rng), fx.content_id(rng), fx.user_id(rng))),
+        BenchCase('claim_and_complete_delivery', lambda rng: _claim_and_complete()),
+        BenchCase('get_broadcast_recipients', lambda rng: Database.get_broadcast_recipients(
+            fx.user_id(rng), Config.BROADCAST_BATCH_SIZE)),
+        BenchCase('get_stats', lambda rng: Database.get_stats()),
+        BenchCase('get_job_runs', lambda rng: Database.get_job_runs()),
+        BenchCase('cleanup_expired_pending_payments', lambda rng: Database.cleanup_expired_pending_payments()),
+        # Periodic full recompute: scans are expected
+        BenchCase('reconcile_stats', lambda rng: Database.reconcile_stats(), hot=False),
+    ]
+    return cases
+
+
+async def _claim_and_complete():
+    job = await Database.claim_delivery(Config.DELIVERY_LOCK_TIMEOUT)
+    if job:
+        await Database.complete_delivery(job['delivery_id'], job['attempts'])
+
+
+async def time_sequential(case: BenchCase, iterations: int, rng) -> list:
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await case.func(rng)
+        latencies.append(time.perf_counter() - started)
+    return sorted(latencies)
+
+
+async def time_concurrent(case: BenchCase, concurrency: int, iterations: int, seed_value: int):
+    """Runs `iterations` calls spread over `concurrency` callers; returns (ops/s, sorted latencies)."""
+    latencies = []
+
+    async def caller(index):
+        rng = random.Random(seed_value + index)
+        for _ in range(max(1, iterations // concurrency)):
+            started = time.perf_counter()
+            await case.func(rng)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(caller(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return len(latencies) / elapsed if elapsed else 0.0, sorted(latencies)
+
+
+async def capture_queries(case: BenchCase, rng) -> list:
+    """Runs the case once and returns every (query, params) it sent through execute_query."""
+    captured = []
+    original = Database.execute_query
+
+    async def recorder(query, params=None, fetch=False, name=None):
+        captured.append((query, params))
+        return await original(query, params, fetch, name or sys._getframe(1).f_code.co_name)
+
+    Database.execute_query = recorder
+    try:
+        await case.func(rng)
+    finally:
+        Database.execute_query = original
+    return captured
+
+
+async def explain(conn, query: str, params) -> dict:
+    """EXPLAIN (ANALYZE, BUFFERS) inside a rolled-back transaction, so writes leave no trace."""
+    await Database.execute_on(conn, "BEGIN")
+    try:
+        result = await Database.execute_on(conn, "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query,
+                                           params, fetch=True)
+    finally:
+        await Database.execute_on(conn, "ROLLBACK")
+    plan = result[0][0]
+    if isinstance(plan, str): # asyncpg returns json as text
+        plan = json.loads(plan)
+    return plan[0]
+
+
+def seq_scans(node: dict, found=None) -> list:
+    found = [] if found is None else found
+    if node.get('Node Type') == 'Seq Scan':
+        found.append(node.get('Relation Name'))
+    for child in node.get('Plans', ()):
+        seq_scans(child, found)
+    return found
+
+
+async def table_sizes() -> dict:
+    result = await Database.execute_query("""
+        SELECT c.relname, c.reltuples::BIGINT
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relkind = 'r'
+    """, fetch=True) or []
+    return {name: rows for name, rows in result}
+
+
+async def run(args):
+    await Database.get_connection()
+    try:
+        if args.seed:
+            if 'bench' not in (Config.DB_NAME or '') and not args.force:
+                raise SystemExit(f"Refusing to seed database '{Config.DB_NAME}': its name does not contain "
+                                 "'bench'. Use --force if it really is a scratch database.")
+            await Database.init_db()
+            await seed(args.users, args.content, args.payments, args.deliveries)
+            if args.seed_only:
+                return 0
+
+        fx = Fixture()
+        await fx.load()
+        sizes = await table_sizes()
+        cases = [case for case in build_cases(fx) if not args.only or any(o in case.name for o in args.only)]
+        baseline = {}
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        conn = await Database.connect_dedicated()
+        report, failures = {}, []
+
+        print(f"{'method':36} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ops/s@' + str(args.concurrency):>12} "
+              f"{'p95@N ms':>9}  plan")
+        try:
+            for case in cases:
+                rng = random.Random(args.random_seed)
+                for _ in range(args.warmup):
+                    await case.func(rng)
+                latencies = await time_sequential(case, args.iterations, rng)
+                throughput, concurrent = await time_concurrent(case, args.concurrency, args.iterations, args.random_seed)
+
+                plans, problems = [], []
+                for query, params in await capture_queries(case, rng):
+                    plan = await explain(conn, query, params)
+                    plans.append({'query': ' '.join(query.split()), 'plan': plan})
+                    for relation in seq_scans(plan['Plan']):
+                        if case.hot and relation not in SMALL_TABLES and sizes.get(relation, 0) >= args.seqscan_min_rows:
+                            problems.append(f"seq scan on {relation} ({sizes[relation]} rows)")
+
+                result = {
+                    'p50_ms': percentile(latencies, 50) * 1000,
+                    'p95_ms': percentile(latencies, 95) * 1000,
+                    'p99_ms': percentile(latencies, 99) * 1000,
+                    'throughput': throughput,
+                    'concurrent_p95_ms': percentile(concurrent, 95) * 1000,
+                    'concurrency': args.concurrency,
+                    'plans': plans,
+                }
+                previous = baseline.get(case.name)
+                if previous and result['p95_ms'] > previous['p95_ms'] * (1 + args.tolerance) \
+                        and result['p95_ms'] - previous['p95_ms'] > args.min_regression_ms:
+                    problems.append(f"p95 regressed {previous['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms")
+                result['problems'] = problems
+                report[case.name] = result
+                failures.extend(f"{case.name}: {problem}" for problem in problems)
+
+                plan_note = "; ".join(problems) if problems else "ok"
+                print(f"{case.name:36} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} {result['p99_ms']:8.2f} "
+                      f"{throughput:12.0f} {result['concurrent_p95_ms']:9.2f}  {plan_note}")
+        finally:
+            await Database.close_dedicated(conn)
+
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2, default=str)
+            print(f"Full report with EXPLAIN plans written to {args.report}")
+        if args.save_baseline:
+            with open(args.save_baseline, 'w') as f:
+                json.dump({name: {key: value for key, value in result.items() if key != 'plans'}
+                           for name, result in report.items()}, f, indent=2)
+            print(f"Baseline saved to {args.save_baseline}")
+
+        if failures:
+            print("\nFAILED:\n" + "\n".join(f"  {failure}" for failure in failures))
+            return 1
+        print("\nAll benchmarks passed.")
+        return 0
+    finally:
+        await Database.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Database methods against a seeded PostgreSQL.")
+    parser.add_argument('--seed', action='store_true', help="truncate and seed the database first")
+    parser.add_argument('--seed-only', action='store_true', help="seed and exit")
+    parser.add_argument('--force', action='store_true', help="allow seeding a database not named *bench*")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--content', type=int, default=5000)
+    parser.add_argument('--payments', type=int, default=1000000)
+    parser.add_argument('--deliveries', type=int, default=20000, help="queued delivery jobs to seed")
+    parser.add_argument('--iterations', type=int, default=200, help="calls per method for the timings")
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=10, help="concurrent callers for the throughput run")
+    parser.add_argument('--only', nargs='*', help="run only methods whose name contains one of these")
+    parser.add_argument('--baseline', help="baseline JSON to compare p95 against")
+    parser.add_argument('--save-baseline', help="write this run's timings as a baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed p95 growth over baseline (0.25 = 25%%)")
+    parser.add_argument('--min-regression-ms', type=float, default=0.5, help="ignore p95 growth smaller than this")
+    parser.add_argument('--seqscan-min-rows', type=int, default=10000,
+                        help="flag hot-path seq scans only on tables at least this large")
+    parser.add_argument('--report', help="write the full JSON report (including plans) here")
+    parser.add_argument('--random-seed', type=int, default=42)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(run(parse_args())))
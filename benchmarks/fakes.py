@@ -0,0 +1,191 @@
+"""
+Local stand-ins for the Telegram Bot API and Google Drive, used by the load harness.
+Both are plain aiohttp servers that answer the calls MovieBot makes with well-formed
+responses, optionally after an artificial latency, and let the harness wait for the bot's
+outbound calls to measure end-to-end latency.
+"""
+import asyncio
+import collections
+import json
+import re
+import time
+
+from aiohttp import web
+
+CHUNK = b'\0' * (256 * 1024)
+
+
+async def start_site(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+class FakeBotAPI:
+    """
+    Answers Bot API methods at /bot<token>/<method>. Every call is counted, and callers of
+    expect() are woken when the bot makes a matching call (FIFO per key).
+    With cache_file_ids=False uploaded media comes back without a file_id, so the bot cannot
+    cache it and every delivery goes through Google Drive.
+    """
+
+    def __init__(self, latency: float = 0.0, cache_file_ids: bool = True):
+        self.latency = latency
+        self.cache_file_ids = cache_file_ids
+        self.calls = collections.Counter()
+        self.upload_bytes = 0
+        self._message_id = 0
+        self._waiters = collections.defaultdict(list) # (method, key) -> [(predicate, future)]
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=0)
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        app.router.add_get('/', lambda request: web.Response(status=404)) # Connectivity probe
+        return app
+
+    def expect(self, method: str, key, predicate=None) -> asyncio.Future:
+        """
+        Returns a future resolved with the parameters of the next `method` call for `key`
+        (chat_id, or pre_checkout_query_id for answerPreCheckoutQuery) accepted by `predicate`.
+        'media' matches sendDocument and sendVideo.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[(method, str(key))].append((predicate, future))
+        return future
+
+    def _resolve(self, method: str, key, params: dict):
+        waiters = self._waiters.get((method, str(key)))
+        if not waiters:
+            return
+        for index, (predicate, future) in enumerate(waiters):
+            if future.done():
+                continue
+            if predicate is None or predicate(params):
+                future.set_result(params)
+                del waiters[index]
+                return
+
+    async def _read_params(self, request) -> dict:
+        if request.content_type == 'application/json':
+            return await request.json()
+        if request.content_type.startswith('multipart/'):
+            params = {}
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename:
+                    while True:
+                        chunk = await part.read_chunk(256 * 1024)
+                        if not chunk:
+                            break
+                        self.upload_bytes += len(chunk)
+                    params[part.name] = f"<upload {part.filename}>"
+                else:
+                    params[part.name] = await part.text()
+            return params
+        return dict(await request.post())
+
+    def _message(self, chat_id, **extra) -> dict:
+        self._message_id += 1
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        chat_type = 'private' if isinstance(chat_id, int) and chat_id > 0 else 'channel'
+        return {'message_id': self._message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': chat_type}, **extra}
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        params = await self._read_params(request)
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = params.get('chat_id')
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot',
+                      'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': True}
+        elif method == 'getChatMember':
+            result = {'status': 'member', 'user': {'id': int(params['user_id']), 'is_bot': False, 'first_name': 'Load'}}
+        elif method in ('sendMessage', 'editMessageText'):
+            result = self._message(chat_id, text=params.get('text', ''))
+        elif method == 'sendInvoice':
+            result = self._message(chat_id, invoice={
+                'title': params.get('title', ''), 'description': params.get('description', ''),
+                'start_parameter': params.get('start_parameter', ''), 'currency': params.get('currency', 'USD'),
+                'total_amount': sum(price['amount'] for price in json.loads(params.get('prices', '[]'))),
+            })
+        elif method in ('sendDocument', 'sendVideo'):
+            field = 'video' if method == 'sendVideo' else 'document'
+            media = {'file_id': f"fake-{self._message_id + 1}", 'file_unique_id': f"u{self._message_id + 1}"}
+            if field == 'video':
+                media.update(width=1280, height=720, duration=60)
+            uploaded = str(params.get(field, '')).startswith('<upload')
+            result = self._message(chat_id, **({field: media} if self.cache_file_ids or not uploaded else {}))
+        elif method == 'getUpdates':
+            result = []
+        else: # answerCallbackQuery, answerPreCheckoutQuery, setWebhook, deleteWebhook, ...
+            result = True
+
+        if method == 'answerPreCheckoutQuery':
+            self._resolve(method, params.get('pre_checkout_query_id'), params)
+        elif method in ('sendDocument', 'sendVideo'):
+            self._resolve('media', chat_id, params)
+        elif chat_id is not None:
+            self._resolve(method, chat_id, params)
+        elif method == 'setWebhook':
+            self._resolve(method, '', params)
+        return web.json_response({'ok': True, 'result': result})
+
+
+class FakeDrive:
+    """
+    Google Drive v3 stand-in serving synthetic files. A file id of the form
+    'synthetic-<bytes>-<anything>' has that size; other ids get default_size.
+    Also answers the service-account token exchange at /token.
+    """
+
+    def __init__(self, default_size: int = 5 * 1024 * 1024, latency: float = 0.0):
+        self.default_size = default_size
+        self.latency = latency
+        self.bytes_served = 0
+        self.requests = collections.Counter()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/token', self._handle_token)
+        app.router.add_get('/drive/v3/files/{file_id}', self._handle_file)
+        return app
+
+    def size_of(self, file_id: str) -> int:
+        match = re.match(r'synthetic-(\d+)-', file_id)
+        return int(match.group(1)) if match else self.default_size
+
+    async def _handle_token(self, request):
+        self.requests['token'] += 1
+        return web.json_response({'access_token': 'fake-token', 'expires_in': 3600, 'token_type': 'Bearer'})
+
+    async def _handle_file(self, request):
+        file_id = request.match_info['file_id']
+        size = self.size_of(file_id)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if request.query.get('alt') != 'media':
+            self.requests['metadata'] += 1
+            return web.json_response({'id': file_id, 'name': f"{file_id}.bin", 'size': str(size),
+                                      'mimeType': 'application/octet-stream'})
+
+        self.requests['download'] += 1
+        response = web.StreamResponse(headers={'Content-Type': 'application/octet-stream'})
+        response.content_length = size
+        await response.prepare(request)
+        remaining = size
+        while remaining > 0:
+            chunk = CHUNK[:min(remaining, len(CHUNK))]
+            await response.write(chunk)
+            remaining -= len(chunk)
+            self.bytes_served += len(chunk)
+        await response.write_eof()
+        return response
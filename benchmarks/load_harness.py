@@ -0,0 +1,444 @@
+"""
+End-to-end load harness.
+
+Runs MovieBot (webhook mode, as a subprocess) against local stand-ins for the Telegram Bot API
+and Google Drive (benchmarks/fakes.py) and a local PostgreSQL (the usual DB_* settings), then
+drives it with a mix of realistic update flows:
+
+    start    - a /start from a new or returning user
+    funnel   - /request button -> invoice -> pre-checkout -> successful_payment
+    deliver  - an admin /deliver of a paid request, through the delivery queue, Drive and upload
+
+Each step is timed from posting the update to the bot's matching outbound Bot API call.
+The report shows throughput, per-step latency percentiles, error rates and the bot's RSS.
+Everything runs offline.
+
+    python -m benchmarks.load_harness --duration 60 --concurrency 50 --mix start=60,funnel=35,deliver=5
+    python -m benchmarks.load_harness --file-size 50MB --uncached-deliveries --bot-env SEND_RATE_PER_SECOND=1000
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import re
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.fakes import FakeBotAPI, FakeDrive, start_site
+
+ADMIN_ID = 999000001
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import psutil
+except ImportError: # RSS falls back to /proc on Linux
+    psutil = None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def parse_size(value: str) -> int:
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([KMG]?)B?', value.strip().upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[match.group(2)])
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in ('start', 'funnel', 'deliver'):
+            raise argparse.ArgumentTypeError(f"Unknown scenario: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def read_rss(pid: int):
+    """Resident set size of a process in bytes, or None if it cannot be read."""
+    if psutil:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def write_credentials(path: str, token_uri: str):
+    """Writes a throwaway service-account file whose token_uri points at the fake Drive."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption()).decode()
+    with open(path, 'w') as f:
+        json.dump({'type': 'service_account', 'client_email': 'loadtest@example.invalid',
+                   'private_key': pem, 'private_key_id': 'loadtest', 'token_uri': token_uri}, f)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = collections.defaultdict(list) # step -> seconds
+        self.errors = collections.Counter() # step -> count
+        self.error_samples = collections.defaultdict(list)
+        self.scenarios = collections.Counter()
+        self.updates_sent = 0
+
+    def ok(self, step: str, seconds: float):
+        self.latencies[step].append(seconds)
+
+    def error(self, step: str, reason: str):
+        self.errors[step] += 1
+        if len(self.error_samples[step]) < 5:
+            self.error_samples[step].append(reason)
+
+
+class LoadHarness:
+    def __init__(self, args):
+        self.args = args
+        self.api = FakeBotAPI(latency=args.api_latency_ms / 1000, cache_file_ids=not args.uncached_deliveries)
+        self.drive = FakeDrive(default_size=args.file_size, latency=args.drive_latency_ms / 1000)
+        self.stats = Stats()
+        self.rss_samples = []
+        self._update_ids = itertools.count(1)
+        self._user_ids = itertools.count(700000000)
+        self._returning_users = []
+        self._paid = [] # (user_id, payment_id) awaiting delivery
+        self.content_ids = []
+        self.secret = secrets.token_hex(16)
+        self.webhook_port = free_port()
+        self.bot_process = None
+        self.session = None
+
+    # --- Update builders ---
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"Load{user_id}", 'username': f"load{user_id}"}
+
+    def _message(self, user_id: int, **fields) -> dict:
+        return {'message_id': next(self._update_ids), 'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private', 'first_name': f"Load{user_id}"},
+                'from': self._user(user_id), **fields}
+
+    def command(self, user_id: int, text: str) -> dict:
+        command = text.split()[0]
+        return {'update_id': next(self._update_ids), 'message': self._message(
+            user_id, text=text, entities=[{'type': 'bot_command', 'offset': 0, 'length': len(command)}])}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        return {'update_id': next(self._update_ids), 'callback_query': {
+            'id': str(next(self._update_ids)), 'from': self._user(user_id), 'chat_instance': str(user_id),
+            'data': data, 'message': {
+                'message_id': next(self._update_ids), 'date': int(time.time()), 'text': 'menu',
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot'}}}}
+
+    def pre_checkout(self, user_id: int, query_id: str, payment_id: str) -> dict:
+        return {'update_id': next(self._update_ids), 'pre_checkout_query': {
+            'id': query_id, 'from': self._user(user_id), 'currency': 'USD', 'total_amount': 1,
+            'invoice_payload': payment_id}}
+
+    def successful_payment(self, user_id: int, payment_id: str) -> dict:
+        return {'update_id': next(self._update_ids), 'message': self._message(user_id, successful_payment={
+            'currency': 'USD', 'total_amount': 1, 'invoice_payload': payment_id,
+            'telegram_payment_charge_id': f"tg-{payment_id}", 'provider_payment_charge_id': f"pr-{payment_id}"})}
+
+    # --- Driving the bot ---
+
+    async def post(self, update: dict):
+        self.stats.updates_sent += 1
+        async with self.session.post(f"http://127.0.0.1:{self.webhook_port}/telegram", json=update,
+                                     headers={'X-Telegram-Bot-Api-Secret-Token': self.secret}) as response:
+            if response.status != 200:
+                raise RuntimeError(f"webhook returned {response.status}")
+
+    async def step(self, name: str, update: dict, expected: asyncio.Future, timeout: float = None):
+        """Posts an update and waits for the bot's matching outbound call. Returns its params or None."""
+        started = time.perf_counter()
+        try:
+            await self.post(update)
+            params = await asyncio.wait_for(expected, timeout or self.args.step_timeout)
+        except asyncio.TimeoutError:
+            self.stats.error(name, 'timeout')
+            return None
+        except Exception as e:
+            expected.cancel()
+            self.stats.error(name, str(e))
+            return None
+        self.stats.ok(name, time.perf_counter() - started)
+        return params
+
+    async def scenario_start(self):
+        if self._returning_users and random.random() < 0.5:
+            user_id = random.choice(self._returning_users)
+        else:
+            user_id = next(self._user_ids)
+            self._returning_users.append(user_id)
+        await self.step('start', self.command(user_id, '/start'), self.api.expect('sendMessage', user_id))
+
+    async def scenario_funnel(self):
+        user_id = next(self._user_ids)
+        # Users reach the request button from /start, which also creates their users row
+        if not await self.step('start', self.command(user_id, '/start'), self.api.expect('sendMessage', user_id)):
+            return
+        if not await self.step('request', self.callback(user_id, 'request_content'),
+                               self.api.expect('sendMessage', user_id)):
+            return
+        invoice = await self.step('invoice', self.callback(user_id, 'proceed_payment'),
+                                  self.api.expect('sendInvoice', user_id))
+        if not invoice:
+            return
+        payment_id = invoice['payload']
+        query_id = f"pcq-{next(self._update_ids)}"
+        answer = await self.step('pre_checkout', self.pre_checkout(user_id, query_id, payment_id),
+                                 self.api.expect('answerPreCheckoutQuery', query_id))
+        if not answer:
+            return
+        if answer.get('ok') not in ('true', 'True', True):
+            self.stats.error('pre_checkout', f"rejected: {answer.get('error_message')}")
+            return
+        confirmed = await self.step('payment', self.successful_payment(user_id, payment_id),
+                                    self.api.expect('sendMessage', user_id, lambda p: p.get('text', '').startswith('✅')))
+        if confirmed:
+            self._paid.append((user_id, payment_id))
+
+    async def scenario_deliver(self):
+        if not self._paid:
+            return await self.scenario_funnel()
+        user_id, payment_id = self._paid.pop(0)
+        content_id = random.choice(self.content_ids)
+        delivered = self.api.expect('media', user_id)
+        queued = await self.step('deliver_command', self.command(ADMIN_ID, f"/deliver {payment_id} {content_id}"),
+                                 self.api.expect('sendMessage', ADMIN_ID, lambda p: payment_id in p.get('text', '')
+                                                 and p.get('text', '').startswith('📥')))
+        if not queued:
+            delivered.cancel()
+            return
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(delivered, self.args.delivery_timeout)
+            self.stats.ok('delivery', time.perf_counter() - started)
+        except asyncio.TimeoutError:
+            self.stats.error('delivery', 'timeout')
+
+    async def virtual_user(self, deadline: float):
+        scenarios = {'start': self.scenario_start, 'funnel': self.scenario_funnel, 'deliver': self.scenario_deliver}
+        names = list(self.args.mix)
+        weights = [self.args.mix[name] for name in names]
+        while time.monotonic() < deadline:
+            name = random.choices(names, weights)[0]
+            await scenarios[name]()
+            self.stats.scenarios[name] += 1
+
+    async def add_content(self):
+        """Registers synthetic content through the admin /addcontent command."""
+        for index in range(self.args.content_items):
+            file_id = f"synthetic-{self.args.file_size}-{index}"
+            file_type = 'video' if index % 3 == 0 else 'document'
+            reply = await self.step('addcontent', self.command(
+                ADMIN_ID, f"/addcontent loadtest-{self.secret[:8]}-{index} {file_id} {file_type}"),
+                self.api.expect('sendMessage', ADMIN_ID, lambda p: 'added to CMS library' in p.get('text', '')))
+            match = re.search(r'ID: `([0-9a-f-]{36})`', reply.get('text', '')) if reply else None
+            if not match:
+                raise RuntimeError("Could not register synthetic content; see the bot log")
+            self.content_ids.append(match.group(1))
+
+    async def sample_rss(self, stop: asyncio.Event):
+        while not stop.is_set():
+            rss = read_rss(self.bot_process.pid)
+            if rss:
+                self.rss_samples.append(rss)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- Lifecycle ---
+
+    def bot_env(self, api_port: int, drive_port: int, credentials_path: str) -> dict:
+        env = dict(os.environ)
+        env.update({
+            'TOKEN': '123456:LOADTEST',
+            'ADMIN_ID': str(ADMIN_ID),
+            'ADMIN_CHANNEL_ID': '-1001',
+            'ADVERTISING_CHANNEL': '@loadtest',
+            'ADVERTISING_CHANNEL_ID': '-1002',
+            'ADVERTISING_CHANNEL_INVITE_LINK': 'https://t.me/loadtest',
+            'PAYMENT_PROVIDER_TOKEN': 'loadtest',
+            'CURRENCY': 'USD',
+            'BOT_MODE': 'webhook',
+            'WEBHOOK_URL': f"http://127.0.0.1:{self.webhook_port}",
+            'WEBHOOK_LISTEN': '127.0.0.1',
+            'WEBHOOK_PORT': str(self.webhook_port),
+            'WEBHOOK_PATH': '/telegram',
+            'WEBHOOK_SECRET_TOKEN': self.secret,
+            'TELEGRAM_API_URL': f"http://127.0.0.1:{api_port}",
+            'DRIVE_API_URL': f"http://127.0.0.1:{drive_port}/drive/v3",
+            'GOOGLE_DRIVE_CREDENTIALS_PATH': credentials_path,
+            'STARTUP_NETWORK_CHECK': 'false',
+            'STORAGE_CHANNEL_ID': '',
+            'METRICS_PORT': env.get('METRICS_PORT', '0'),
+        })
+        for item in self.args.bot_env:
+            key, _, value = item.partition('=')
+            env[key] = value
+        return env
+
+    async def run(self) -> int:
+        api_port, drive_port = free_port(), free_port()
+        runners = [await start_site(self.api.app(), '127.0.0.1', api_port),
+                   await start_site(self.drive.app(), '127.0.0.1', drive_port)]
+        workdir = tempfile.mkdtemp(prefix='moviebot-load-')
+        credentials_path = os.path.join(workdir, 'credentials.json')
+        write_credentials(credentials_path, f"http://127.0.0.1:{drive_port}/token")
+
+        webhook_set = self.api.expect('setWebhook', '')
+        log = open(self.args.bot_log, 'w')
+        self.bot_process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'JoeMovieBot.py')], cwd=ROOT,
+                                            env=self.bot_env(api_port, drive_port, credentials_path),
+                                            stdout=log, stderr=subprocess.STDOUT)
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        stop_sampling = asyncio.Event()
+        sampler = None
+        try:
+            print(f"Starting bot (log: {self.args.bot_log})...")
+            try:
+                await asyncio.wait_for(webhook_set, self.args.startup_timeout)
+            except asyncio.TimeoutError:
+                print("Bot did not register its webhook in time; see the bot log.")
+                return 2
+            sampler = asyncio.create_task(self.sample_rss(stop_sampling))
+            await self.add_content()
+
+            print(f"Running {self.args.concurrency} virtual users for {self.args.duration}s, mix {self.args.mix}...")
+            started = time.monotonic()
+            deadline = started + self.args.duration
+            await asyncio.gather(*(self.virtual_user(deadline) for _ in range(self.args.concurrency)))
+            elapsed = time.monotonic() - started
+            return self.report(elapsed)
+        finally:
+            stop_sampling.set()
+            if sampler:
+                await sampler
+            await self.session.close()
+            await self.stop_bot()
+            log.close()
+            for runner in runners:
+                await runner.cleanup()
+
+    async def stop_bot(self):
+        if self.bot_process.poll() is not None:
+            return
+        self.bot_process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.to_thread(self.bot_process.wait, 15)
+        except subprocess.TimeoutExpired:
+            self.bot_process.kill()
+            await asyncio.to_thread(self.bot_process.wait)
+
+    def report(self, elapsed: float) -> int:
+        stats = self.stats
+        steps = ['start', 'request', 'invoice', 'pre_checkout', 'payment', 'deliver_command', 'delivery']
+        total_ok = sum(len(stats.latencies[step]) for step in steps)
+        total_errors = sum(stats.errors[step] for step in steps)
+        result = {
+            'duration_s': elapsed,
+            'concurrency': self.args.concurrency,
+            'scenarios': dict(stats.scenarios),
+            'scenarios_per_s': sum(stats.scenarios.values()) / elapsed,
+            'updates_per_s': stats.updates_sent / elapsed,
+            'error_rate': total_errors / max(1, total_ok + total_errors),
+            'steps': {},
+            'bot_api_calls': dict(self.api.calls),
+            'drive_bytes_served': self.drive.bytes_served,
+            'upload_bytes_received': self.api.upload_bytes,
+            'rss_mb': {
+                'min': min(self.rss_samples) / 1024 ** 2 if self.rss_samples else None,
+                'avg': sum(self.rss_samples) / len(self.rss_samples) / 1024 ** 2 if self.rss_samples else None,
+                'max': max(self.rss_samples) / 1024 ** 2 if self.rss_samples else None,
+            },
+            'error_samples': dict(stats.error_samples),
+        }
+
+        print(f"\n{'step':16} {'ok':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for step in steps:
+            latencies = sorted(stats.latencies[step])
+            if not latencies and not stats.errors[step]:
+                continue
+            row = {'ok': len(latencies), 'errors': stats.errors[step],
+                   'p50_ms': percentile(latencies, 50) * 1000, 'p95_ms': percentile(latencies, 95) * 1000,
+                   'p99_ms': percentile(latencies, 99) * 1000}
+            result['steps'][step] = row
+            print(f"{step:16} {row['ok']:7} {row['errors']:7} {row['p50_ms']:9.1f} {row['p95_ms']:9.1f} {row['p99_ms']:9.1f}")
+
+        rss = result['rss_mb']
+        print(f"\nThroughput: {result['scenarios_per_s']:.1f} scenarios/s, {result['updates_per_s']:.1f} updates/s")
+        print(f"Error rate: {result['error_rate'] * 100:.2f}%")
+        if rss['max'] is not None:
+            print(f"Bot RSS: min {rss['min']:.0f} MB, avg {rss['avg']:.0f} MB, max {rss['max']:.0f} MB")
+        print(f"Drive served {self.drive.bytes_served / 1024 ** 2:.0f} MB; "
+              f"Bot API received {self.api.upload_bytes / 1024 ** 2:.0f} MB of uploads")
+        print("Bot API calls: " + ", ".join(f"{method}={count}" for method, count in self.api.calls.most_common()))
+        for step, samples in stats.error_samples.items():
+            print(f"  {step} errors, e.g.: {samples}")
+
+        if self.args.report:
+            with open(self.args.report, 'w') as f:
+                json.dump(result, f, indent=2)
+            print(f"Report written to {self.args.report}")
+        return 1 if result['error_rate'] > self.args.max_error_rate else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test MovieBot against local Bot API and Drive stand-ins.")
+    parser.add_argument('--duration', type=float, default=60, help="seconds of load")
+    parser.add_argument('--concurrency', type=int, default=20, help="concurrent virtual users")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('start=60,funnel=35,deliver=5'),
+                        help="scenario weights, e.g. start=60,funnel=35,deliver=5")
+    parser.add_argument('--file-size', type=parse_size, default=parse_size('5MB'), help="synthetic Drive file size")
+    parser.add_argument('--content-items', type=int, default=10, help="synthetic content items to register")
+    parser.add_argument('--uncached-deliveries', action='store_true',
+                        help="withhold file_ids so every delivery downloads from Drive and re-uploads")
+    parser.add_argument('--api-latency-ms', type=float, default=30, help="simulated Bot API round trip")
+    parser.add_argument('--drive-latency-ms', type=float, default=50, help="simulated Drive time to first byte")
+    parser.add_argument('--step-timeout', type=float, default=30)
+    parser.add_argument('--delivery-timeout', type=float, default=120)
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help="exit non-zero above this error rate")
+    parser.add_argument('--bot-env', action='append', default=[], metavar='KEY=VALUE',
+                        help="extra environment for the bot, e.g. SEND_RATE_PER_SECOND=1000")
+    parser.add_argument('--bot-log', default='loadtest-bot.log')
+    parser.add_argument('--report', help="write the JSON report here")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(LoadHarness(parse_args()).run()))
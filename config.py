@@ -12,6 +12,46 @@ class Config:
     ADVERTISING_CHANNEL = os.getenv('ADVERTISING_CHANNEL')
     ADVERTISING_CHANNEL_INVITE_LINK = os.getenv('ADVERTISING_CHANNEL_INVITE_LINK')
     ADVERTISING_CHANNEL_ID = os.getenv('ADVERTISING_CHANNEL_ID')
+
+    # Bot API server (override to point at a local Bot API server or a test stand-in)
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+    STARTUP_NETWORK_CHECK = os.getenv('STARTUP_NETWORK_CHECK', 'true').lower() == 'true' # Connectivity tests before start
+
+    # Update delivery: 'polling' (default) or 'webhook' (embedded aiohttp server)
+    BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+    CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 8)) # Updates processed in parallel
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL') # Public base URL Telegram posts to, e.g. https://bot.example.com
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+    WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+    # Discards updates queued at Telegram when the webhook is (re)registered. Off by default: with several
+    # replicas, any restart would drop every queued update, including payments
+    WEBHOOK_DROP_PENDING_UPDATES = os.getenv('WEBHOOK_DROP_PENDING_UPDATES', 'false').lower() == 'true'
+
+    # Outbound sending limits (Telegram: ~30 msg/s overall, ~1 msg/s per chat, ~20 msg/min per group)
+    SEND_RATE_PER_SECOND = float(os.getenv('SEND_RATE_PER_SECOND', 30))
+    SEND_BURST = int(os.getenv('SEND_BURST', 30))
+    SEND_PRIVATE_CHAT_INTERVAL = float(os.getenv('SEND_PRIVATE_CHAT_INTERVAL', 1.0))
+    SEND_GROUP_CHAT_INTERVAL = float(os.getenv('SEND_GROUP_CHAT_INTERVAL', 3.0))
+
+    # Broadcasts
+    BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20)) # Messages per second, below the global limit
+    BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 10)) # Sends in flight at once
+    BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', 100)) # Recipients per checkpoint
+    BROADCAST_LEASE_SECONDS = int(os.getenv('BROADCAST_LEASE_SECONDS', 120)) # Stale lease => another process resumes
+
+    # Prometheus metrics on http://METRICS_LISTEN:METRICS_PORT/metrics (0 disables). In supervisor
+    # mode worker N serves on METRICS_PORT + N.
+    METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+
+    PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', 300)) # Longest /profile run allowed
+
+    # Scale-out: with more than one process, a supervisor receives updates and routes each one
+    # to a worker process by user id. Every worker has its own DB pool of DB_POOL_MAX_SIZE.
+    WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 1))
     
     # Database
     DB_NAME = os.getenv('DB_NAME')
@@ -20,6 +60,19 @@ class Config:
     DB_HOST = os.getenv('DB_HOST')
     DB_PORT = os.getenv('DB_PORT')
     
+    # 'aiopg' (default) or 'asyncpg' (prepared statements, binary protocol; requires the asyncpg package)
+    DB_BACKEND = os.getenv('DB_BACKEND', 'aiopg').lower()
+    DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 100)) # asyncpg only
+
+    # Connection pool sizing and timeouts
+    DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+    DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', 10)) # Seconds before giving up on a free connection
+    DB_POOL_SLOW_ACQUIRE_SECONDS = float(os.getenv('DB_POOL_SLOW_ACQUIRE_SECONDS', 0.5)) # Log a warning above this wait
+    DB_POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', 300)) # Seconds before an idle connection is recycled
+    DB_POOL_HEALTH_CHECK = os.getenv('DB_POOL_HEALTH_CHECK', 'false').lower() == 'true' # Ping connections on acquire
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000)) # Server-side statement_timeout
+
     DATABASE = f"dbname='{DB_NAME}' user='{DB_USER}' " \
                f"password='{DB_PASSWORD}' host='{DB_HOST}' " \
                f"port='{DB_PORT}'"
@@ -33,9 +86,62 @@ class Config:
     REQUEST_EXPIRY_HOURS = int(os.getenv('REQUEST_EXPIRY_HOURS', 24))
     MEMBERSHIP_CHECK_INTERVAL = int(os.getenv('MEMBERSHIP_CHECK_INTERVAL', 86400))
     CLEANUP_INTERVAL = int(os.getenv('CLEANUP_INTERVAL', 3600))
+    STATS_RECONCILE_INTERVAL = int(os.getenv('STATS_RECONCILE_INTERVAL', 3600)) # Seconds between full stats recomputes
+    STATS_FOLD_INTERVAL = int(os.getenv('STATS_FOLD_INTERVAL', 10)) # Seconds between folding stats deltas into the rollup
+
+    # Periodic jobs run only on the replica holding this Postgres advisory lock
+    SCHEDULER_LOCK_KEY = int(os.getenv('SCHEDULER_LOCK_KEY', 7316190))
+    MIGRATION_LOCK_KEY = int(os.getenv('MIGRATION_LOCK_KEY', 7316191)) # Serializes schema migrations across replicas
+    DRIVE_SYNC_LOCK_KEY = int(os.getenv('DRIVE_SYNC_LOCK_KEY', 7316192)) # Serializes Drive folder syncs across replicas
+    SCHEDULER_LEADER_CHECK_INTERVAL = int(os.getenv('SCHEDULER_LEADER_CHECK_INTERVAL', 15)) # Seconds
+
+    ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', 10)) # Payments per page in /getpayments and /pending
+    CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', 8)) # Catalog items per page when requesting content
+    INLINE_PAGE_SIZE = min(int(os.getenv('INLINE_PAGE_SIZE', 20)), 50) # Inline search results per page (Telegram allows 50)
+    INLINE_MAX_RESULTS = int(os.getenv('INLINE_MAX_RESULTS', 200)) # Deepest offset served while scrolling inline results
+    INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 300)) # Seconds Telegram may cache inline results
+
+    # Write-behind buffer for user upserts from /start
+    USER_BUFFER_MAX_SIZE = int(os.getenv('USER_BUFFER_MAX_SIZE', 500)) # Flush when this many users are pending
+    USER_BUFFER_FLUSH_INTERVAL = int(os.getenv('USER_BUFFER_FLUSH_INTERVAL', 5)) # Seconds
+    USER_LAST_ACTIVE_RESOLUTION = int(os.getenv('USER_LAST_ACTIVE_RESOLUTION', 300)) # Skip unchanged users seen this recently
+
+    # Pending-invoice cache: pre-checkout queries are validated from memory, falling back to the
+    # database (with a timeout, since Telegram allows only 10 seconds) for invoices not in the cache
+    PENDING_INVOICE_CACHE_SIZE = int(os.getenv('PENDING_INVOICE_CACHE_SIZE', 100000))
+    PRE_CHECKOUT_DB_TIMEOUT = float(os.getenv('PRE_CHECKOUT_DB_TIMEOUT', 3)) # Seconds
+
+    # Channel membership cache (seconds). Non-members are re-checked sooner so a fresh join is seen quickly
+    # even if the chat_member update is missed.
+    MEMBERSHIP_CACHE_POSITIVE_TTL = int(os.getenv('MEMBERSHIP_CACHE_POSITIVE_TTL', 3600))
+    MEMBERSHIP_CACHE_NEGATIVE_TTL = int(os.getenv('MEMBERSHIP_CACHE_NEGATIVE_TTL', 60))
+    MEMBERSHIP_CACHE_SIZE = int(os.getenv('MEMBERSHIP_CACHE_SIZE', 50000))
     
     GOOGLE_DRIVE_CREDENTIALS_PATH = os.getenv('GOOGLE_DRIVE_CREDENTIALS_PATH')
     GOOGLE_DRIVE_CONTENT_FOLDER_ID = os.getenv('GOOGLE_DRIVE_CONTENT_FOLDER_ID')
+    DRIVE_POOL_SIZE = int(os.getenv('DRIVE_POOL_SIZE', 20)) # Max pooled connections to the Drive API
+    DRIVE_API_URL = os.getenv('DRIVE_API_URL', 'https://www.googleapis.com/drive/v3').rstrip('/')
+    DRIVE_SYNC_INTERVAL = int(os.getenv('DRIVE_SYNC_INTERVAL', 900)) # Seconds between content folder syncs; 0 disables the job
+    DRIVE_SYNC_PAGE_SIZE = min(int(os.getenv('DRIVE_SYNC_PAGE_SIZE', 1000)), 1000) # Files per files.list / changes.list page
+
+    # Delivery queue: worker pool size, retry policy and how long an in-progress job may stay
+    # locked before another worker reclaims it (crash recovery)
+    DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', 4))
+    DELIVERY_MAX_ATTEMPTS = int(os.getenv('DELIVERY_MAX_ATTEMPTS', 5))
+    DELIVERY_RETRY_BASE_DELAY = int(os.getenv('DELIVERY_RETRY_BASE_DELAY', 30))
+    DELIVERY_POLL_INTERVAL = int(os.getenv('DELIVERY_POLL_INTERVAL', 5))
+    DELIVERY_LOCK_TIMEOUT = int(os.getenv('DELIVERY_LOCK_TIMEOUT', 900))
+
+    # Delivery streaming: files larger than DELIVERY_SPOOL_MAX_MEMORY (bytes) are spooled to a temp
+    # file and uploaded as a streamed body, so memory stays flat regardless of file size.
+    DELIVERY_STREAMING = os.getenv('DELIVERY_STREAMING', 'true').lower() == 'true'
+    DELIVERY_SPOOL_MAX_MEMORY = int(os.getenv('DELIVERY_SPOOL_MAX_MEMORY', 8 * 1024 * 1024))
+    DELIVERY_SPOOL_MAX_BYTES = int(os.getenv('DELIVERY_SPOOL_MAX_BYTES', 2000 * 1024 * 1024)) # Larger files are not delivered (Telegram's upload limit with a local Bot API server)
+    DRIVE_DOWNLOAD_CHUNK_SIZE = int(os.getenv('DRIVE_DOWNLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+
+    # Optional private channel used to pre-upload content so Telegram issues a file_id
+    # before the first buyer asks for it. Leave empty to cache on first delivery instead.
+    STORAGE_CHANNEL_ID = os.getenv('STORAGE_CHANNEL_ID')
     
     @staticmethod
     def validate():
@@ -44,6 +150,8 @@ class Config:
             'Database': ['DB_NAME', 'DB_USER', 'DB_PASSWORD', 'DB_HOST', 'DB_PORT'],
             'Payments': ['PAYMENT_PROVIDER_TOKEN']
         }
+        if Config.BOT_MODE == 'webhook':
+            required['Webhook'] = ['WEBHOOK_URL', 'WEBHOOK_SECRET_TOKEN']
         
         errors = []
         for category, vars in required.items():
@@ -1,98 +1,482 @@
 import aiopg
 from aiopg import create_pool
 from config import Config
+import asyncio
 import logging
+import re
+import sys
+import time
+import metrics
+from migrations import MIGRATIONS
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from datetime import datetime, timedelta
 
+try:
+    import asyncpg
+except ImportError: # Only required when DB_BACKEND=asyncpg
+    asyncpg = None
+
 logger = logging.getLogger(__name__)
 
+
+@lru_cache(maxsize=512)
+def _to_asyncpg_query(query: str) -> str:
+    """
+    Converts a psycopg-style query (%s placeholders, %% escapes) to asyncpg's $1..$n style.
+    Cached per query text, so each fixed query is converted once.
+    """
+    counter = 0
+
+    def replace(match):
+        nonlocal counter
+        if match.group(0) == '%%':
+            return '%'
+        counter += 1
+        return f"${counter}"
+
+    return re.sub(r'%%|%s', replace, query)
+
+
+# Index name of a CREATE [UNIQUE] INDEX CONCURRENTLY IF NOT EXISTS statement (after leading comments)
+_CONCURRENT_INDEX_RE = re.compile(
+    r'\s*(?:--[^\n]*\n\s*)*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)', re.IGNORECASE
+)
+
+
 class Database:
     pool = None # Class variable to hold the connection pool
+    pool_stats = {
+        'in_use': 0,
+        'waiters': 0,
+        'acquired_total': 0,
+        'acquire_timeouts': 0,
+        'slow_acquires': 0,
+        'max_acquire_seconds': 0.0,
+    }
 
     @staticmethod
     async def get_connection():
-        """Creates and returns the database connection pool."""
+        """Creates and returns the database connection pool for the configured backend."""
         if Database.pool is None:
-            Database.pool = await create_pool(Config.DATABASE)
+            if Config.DB_BACKEND == 'asyncpg':
+                if asyncpg is None:
+                    raise RuntimeError("DB_BACKEND is 'asyncpg' but the asyncpg package is not installed")
+                # asyncpg prepares each distinct query once per connection and reuses it
+                # (binary protocol, no re-parsing), up to statement_cache_size statements
+                Database.pool = await asyncpg.create_pool(
+                    host=Config.DB_HOST,
+                    port=Config.DB_PORT,
+                    user=Config.DB_USER,
+                    password=Config.DB_PASSWORD,
+                    database=Config.DB_NAME,
+                    statement_cache_size=Config.DB_STATEMENT_CACHE_SIZE,
+                    min_size=Config.DB_POOL_MIN_SIZE,
+                    max_size=Config.DB_POOL_MAX_SIZE,
+                    max_inactive_connection_lifetime=Config.DB_POOL_RECYCLE,
+                    server_settings={'statement_timeout': str(Config.DB_STATEMENT_TIMEOUT_MS)}
+                )
+            else:
+                Database.pool = await create_pool(
+                    Config.DATABASE,
+                    minsize=Config.DB_POOL_MIN_SIZE,
+                    maxsize=Config.DB_POOL_MAX_SIZE,
+                    pool_recycle=Config.DB_POOL_RECYCLE,
+                    options=f"-c statement_timeout={Config.DB_STATEMENT_TIMEOUT_MS}"
+                )
         return Database.pool
 
+    @staticmethod
+    @asynccontextmanager
+    async def acquire():
+        """
+        Acquires a pooled connection with a timeout, tracking waiters/in-use counters and
+        warning about slow acquires. With DB_POOL_HEALTH_CHECK enabled, each connection is
+        pinged before use and replaced if it turns out to be broken.
+        """
+        stats = Database.pool_stats
+        stats['waiters'] += 1
+        started = time.monotonic()
+        try:
+            conn = await asyncio.wait_for(Database.pool.acquire(), timeout=Config.DB_POOL_ACQUIRE_TIMEOUT)
+            if Config.DB_POOL_HEALTH_CHECK and not await Database._is_healthy(conn):
+                logger.warning("Discarding unhealthy database connection from pool.")
+                await Database._discard(conn)
+                conn = await asyncio.wait_for(Database.pool.acquire(), timeout=Config.DB_POOL_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            stats['acquire_timeouts'] += 1
+            logger.error(f"Timed out after {Config.DB_POOL_ACQUIRE_TIMEOUT}s waiting for a database connection "
+                         f"({stats['in_use']} in use, {stats['waiters'] - 1} other waiters).")
+            raise
+        finally:
+            stats['waiters'] -= 1
+
+        waited = time.monotonic() - started
+        metrics.DB_POOL_ACQUIRE_SECONDS.observe(waited)
+        stats['acquired_total'] += 1
+        stats['max_acquire_seconds'] = max(stats['max_acquire_seconds'], waited)
+        if waited > Config.DB_POOL_SLOW_ACQUIRE_SECONDS:
+            stats['slow_acquires'] += 1
+            logger.warning(f"Slow database connection acquire: {waited:.3f}s ({stats['in_use']} in use, {stats['waiters']} waiting).")
+
+        stats['in_use'] += 1
+        try:
+            yield conn
+        finally:
+            stats['in_use'] -= 1
+            await Database.pool.release(conn)
+
+    @staticmethod
+    async def _is_healthy(conn) -> bool:
+        try:
+            if Config.DB_BACKEND == 'asyncpg':
+                await conn.execute("SELECT 1")
+            else:
+                async with conn.cursor() as cur:
+                    await cur.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    async def _discard(conn):
+        """Closes a broken connection and hands it back so the pool drops it."""
+        try:
+            if Config.DB_BACKEND == 'asyncpg':
+                conn.terminate()
+            else:
+                conn.close()
+        finally:
+            await Database.pool.release(conn)
+
+    @staticmethod
+    def get_pool_stats() -> dict:
+        """Returns live pool counters: size, idle, in use, waiters and acquire statistics."""
+        pool = Database.pool
+        if pool is None:
+            size = idle = 0
+        elif Config.DB_BACKEND == 'asyncpg':
+            size, idle = pool.get_size(), pool.get_idle_size()
+        else:
+            size, idle = pool.size, pool.freesize
+        return {
+            'size': size,
+            'idle': idle,
+            'min_size': Config.DB_POOL_MIN_SIZE,
+            'max_size': Config.DB_POOL_MAX_SIZE,
+            **Database.pool_stats
+        }
+
+    @staticmethod
+    async def close():
+        """Closes the connection pool."""
+        if Database.pool is None:
+            return
+        if Config.DB_BACKEND == 'asyncpg':
+            await Database.pool.close()
+        else:
+            Database.pool.close()
+            await Database.pool.wait_closed()
+        Database.pool = None
+
     @staticmethod
     async def init_db():
-        """Initialize database with all required tables and extensions."""
-        commands = (
-            # Enable uuid-ossp extension
-            "CREATE EXTENSION IF NOT EXISTS \"uuid-ossp\";",
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                username VARCHAR(32),
-                first_name VARCHAR(64),
-                last_name VARCHAR(64),
-                last_active TIMESTAMP DEFAULT NOW()
-            )
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS payments (
-                payment_id VARCHAR(128) PRIMARY KEY,
-                user_id BIGINT REFERENCES users(user_id),
-                amount INTEGER NOT NULL,
-                currency VARCHAR(3) NOT NULL,
-                status VARCHAR(16) DEFAULT 'pending',
-                request_timestamp TIMESTAMP DEFAULT NOW(),
-                completion_timestamp TIMESTAMP,
-                expiry_timestamp TIMESTAMP GENERATED ALWAYS AS 
-                    (request_timestamp + INTERVAL '%s HOURS') STORED,
-                content_id UUID -- Changed from file_id, file_name, file_type
-            )
-            """ % Config.REQUEST_EXPIRY_HOURS,
-            """
-            -- Create content_library table
-            CREATE TABLE IF NOT EXISTS content_library (
-                content_id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-                title VARCHAR(255) NOT NULL UNIQUE,
-                file_path TEXT NOT NULL, -- This will store Google Drive File ID or CMS URL
-                file_type VARCHAR(50) DEFAULT 'document',
-                uploaded_at TIMESTAMP DEFAULT NOW(),
-                admin_id BIGINT
-            )
-            """,
-            """
-            -- Add foreign key constraint to payments table (if not already added)
-            DO $$
-            BEGIN
-                IF NOT EXISTS (
-                    SELECT 1
-                    FROM pg_constraint
-                    WHERE conname = 'fk_content'
-                ) THEN
-                    ALTER TABLE payments
-                    ADD CONSTRAINT fk_content
-                    FOREIGN KEY (content_id) REFERENCES content_library(content_id)
-                    ON DELETE SET NULL;
-                END IF;
-            END
-            $$;
-            """
+        """
+        Brings the schema up to date by applying pending migrations from migrations.MIGRATIONS.
+        Applied versions are recorded in schema_version, so a normal start only reads one row.
+        Replicas starting together take turns: the migration runs under an advisory lock held on
+        a dedicated connection (MIGRATION_LOCK_KEY). Every statement runs on that same connection
+        with statement_timeout lifted, since index builds on large tables outlast the pooled
+        connections' DB_STATEMENT_TIMEOUT_MS.
+        """
+        lock_conn = await Database.connect_dedicated()
+        try:
+            await Database.execute_on(lock_conn, "SET statement_timeout = 0")
+            await Database.execute_on(lock_conn, "SELECT pg_advisory_lock(%s)", (Config.MIGRATION_LOCK_KEY,), fetch=True)
+            await Database._apply_migrations(lock_conn)
+        finally:
+            # Closing the session releases the lock even if the unlock is never sent
+            await Database.close_dedicated(lock_conn)
+
+    @staticmethod
+    async def _drop_invalid_index(conn, statement: str):
+        """Drops the INVALID leftover of an interrupted CREATE INDEX CONCURRENTLY so the statement can rebuild it."""
+        match = _CONCURRENT_INDEX_RE.match(statement)
+        if not match:
+            return
+        name = match.group(1)
+        result = await Database.execute_on(
+            conn, "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(%s) AND NOT indisvalid", (name,), fetch=True
         )
-        for command in commands:
-            logger.info(f"Executing DB command: {command.splitlines()[0]}...") # Log only first line of command
-            await Database.execute_query(command)
+        if result:
+            logger.warning(f"Dropping invalid index {name} left by an interrupted migration.")
+            await Database.execute_on(conn, f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+    @staticmethod
+    async def _apply_migrations(conn):
+        await Database.execute_on(conn, """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT NOW()
+        )
+        """)
+        result = await Database.execute_on(conn, "SELECT COALESCE(MAX(version), 0) FROM schema_version", fetch=True)
+        current_version = result[0][0] if result else 0
+
+        for version, description, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+            logger.info(f"Applying schema migration {version}: {description}")
+            for statement in statements:
+                logger.info(f"Executing DB command: {statement.strip().splitlines()[0]}...") # Log only first line of command
+                await Database._drop_invalid_index(conn, statement)
+                await Database.execute_on(conn, statement)
+            await Database.execute_on(
+                conn,
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s) ON CONFLICT (version) DO NOTHING",
+                (version, description)
+            )
+            current_version = version
+
+        # Backfill the statistics rollup the first time it is created
+        result = await Database.execute_on(conn, "SELECT reconciled_at FROM payment_stats", fetch=True)
+        if result and result[0][0] is None:
+            await Database.reconcile_stats(conn)
         logger.info("Database initialized with tables.")
 
     @staticmethod
-    async def execute_query(query, params=None, fetch=False):
+    async def execute_query(query, params=None, fetch=False, name=None):
         """
         Executes a database query.
         Relies on aiopg's context manager for transaction handling.
+        With the asyncpg backend, queries are sent as cached prepared statements; result rows are
+        asyncpg Records, which index and unpack like the tuples aiopg returns.
+        Execution time is recorded under `name`, which defaults to the calling function's name
+        (e.g. 'get_payment_details').
+        """
+        name = name or sys._getframe(1).f_code.co_name
+        async with Database.acquire() as conn:
+            started = time.perf_counter()
+            try:
+                return await Database.execute_on(conn, query, params, fetch)
+            except Exception:
+                metrics.DB_QUERY_ERRORS.inc(query=name)
+                raise
+            finally:
+                metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - started, query=name)
+
+    @staticmethod
+    async def execute_on(conn, query, params=None, fetch=False):
+        """Executes a query on a specific connection (pooled or dedicated) for either backend."""
+        if Config.DB_BACKEND == 'asyncpg':
+            args = tuple(params) if params else ()
+            if fetch:
+                return await conn.fetch(_to_asyncpg_query(query), *args)
+            await conn.execute(_to_asyncpg_query(query), *args)
+            return None
+
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            if fetch:
+                return await cur.fetchall()
+            # Removed explicit await conn.commit()
+            # aiopg's 'async with conn:' context manager handles commit/rollback automatically.
+
+    @staticmethod
+    async def connect_dedicated():
+        """
+        Opens a connection outside the pool, for session-scoped state such as advisory locks
+        that must stay on one connection for as long as they are held.
+        """
+        if Config.DB_BACKEND == 'asyncpg':
+            return await asyncpg.connect(
+                host=Config.DB_HOST,
+                port=Config.DB_PORT,
+                user=Config.DB_USER,
+                password=Config.DB_PASSWORD,
+                database=Config.DB_NAME
+            )
+        return await aiopg.connect(Config.DATABASE)
+
+    @staticmethod
+    async def close_dedicated(conn):
+        if conn is None:
+            return
+        try:
+            await conn.close()
+        except Exception as e:
+            logger.warning(f"Error closing dedicated connection: {e}")
+
+    @staticmethod
+    async def try_advisory_lock(conn, key: int) -> bool:
+        """Tries to take a session-level advisory lock on the given dedicated connection."""
+        result = await Database.execute_on(conn, "SELECT pg_try_advisory_lock(%s)", (key,), fetch=True)
+        return bool(result and result[0][0])
+
+    # --- Broadcast Methods ---
+
+    @staticmethod
+    async def create_broadcast(message_text: str, created_by: int):
+        query = """
+        INSERT INTO broadcasts (message_text, created_by)
+        VALUES (%s, %s)
+        RETURNING broadcast_id;
+        """
+        result = await Database.execute_query(query, (message_text, created_by), fetch=True)
+        return result[0][0]
+
+    @staticmethod
+    async def claim_broadcast(runner: str, lease_seconds: int):
+        """
+        Takes the lease on a running broadcast that nobody holds (new, or its runner stopped
+        heartbeating), so exactly one process sends each broadcast and crashed ones are resumed.
+        """
+        query = """
+        UPDATE broadcasts
+        SET runner = %s,
+            heartbeat_at = NOW()
+        WHERE broadcast_id = (
+            SELECT broadcast_id
+            FROM broadcasts
+            WHERE status = 'running'
+              AND (heartbeat_at IS NULL OR heartbeat_at < NOW() - make_interval(secs => %s))
+            ORDER BY broadcast_id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING broadcast_id, message_text, last_user_id, created_by;
         """
-        async with Database.pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(query, params)
-                if fetch:
-                    return await cur.fetchall()
-                # Removed explicit await conn.commit()
-                # aiopg's 'async with conn:' context manager handles commit/rollback automatically.
+        result = await Database.execute_query(query, (runner, lease_seconds), fetch=True)
+        if result:
+            columns = ['broadcast_id', 'message_text', 'last_user_id', 'created_by']
+            return dict(zip(columns, result[0]))
+        return None
+
+    @staticmethod
+    async def get_broadcast_recipients(after_user_id: int, limit: int):
+        """Next batch of reachable user_ids after the checkpoint (keyset scan on the primary key)."""
+        query = """
+        SELECT user_id
+        FROM users
+        WHERE user_id > %s AND blocked_at IS NULL
+        ORDER BY user_id
+        LIMIT %s;
+        """
+        result = await Database.execute_query(query, (after_user_id, limit), fetch=True) or []
+        return [row[0] for row in result]
+
+    @staticmethod
+    async def checkpoint_broadcast(broadcast_id: int, runner: str, last_user_id: int,
+                                   delivered: int, blocked: int, failed: int) -> bool:
+        """
+        Records progress and renews the lease. Returns False if the broadcast was cancelled or
+        another runner took it over, in which case the caller must stop.
+        """
+        query = """
+        UPDATE broadcasts
+        SET last_user_id = %s,
+            delivered_count = delivered_count + %s,
+            blocked_count = blocked_count + %s,
+            failed_count = failed_count + %s,
+            heartbeat_at = NOW()
+        WHERE broadcast_id = %s AND runner = %s AND status = 'running'
+        RETURNING broadcast_id;
+        """
+        result = await Database.execute_query(
+            query, (last_user_id, delivered, blocked, failed, broadcast_id, runner), fetch=True
+        )
+        return bool(result)
+
+    @staticmethod
+    async def finish_broadcast(broadcast_id: int, runner: str):
+        query = """
+        UPDATE broadcasts
+        SET status = 'done',
+            finished_at = NOW()
+        WHERE broadcast_id = %s AND runner = %s AND status = 'running';
+        """
+        await Database.execute_query(query, (broadcast_id, runner))
+
+    @staticmethod
+    async def cancel_broadcast(broadcast_id: int) -> bool:
+        query = """
+        UPDATE broadcasts
+        SET status = 'cancelled',
+            finished_at = NOW()
+        WHERE broadcast_id = %s AND status = 'running'
+        RETURNING broadcast_id;
+        """
+        result = await Database.execute_query(query, (broadcast_id,), fetch=True)
+        return bool(result)
+
+    @staticmethod
+    async def get_broadcast(broadcast_id: int = None):
+        """Returns the given broadcast, or the most recent one."""
+        query = """
+        SELECT broadcast_id, status, last_user_id, delivered_count, blocked_count, failed_count,
+               created_at, finished_at
+        FROM broadcasts
+        """
+        if broadcast_id is not None:
+            result = await Database.execute_query(query + "WHERE broadcast_id = %s;", (broadcast_id,), fetch=True)
+        else:
+            result = await Database.execute_query(query + "ORDER BY broadcast_id DESC LIMIT 1;", fetch=True)
+        if result:
+            columns = ['broadcast_id', 'status', 'last_user_id', 'delivered_count', 'blocked_count',
+                       'failed_count', 'created_at', 'finished_at']
+            return dict(zip(columns, result[0]))
+        return None
+
+    @staticmethod
+    async def mark_users_blocked(user_ids):
+        """Flags users who blocked the bot so later broadcasts skip them."""
+        if not user_ids:
+            return
+        query = """
+        UPDATE users
+        SET blocked_at = NOW()
+        WHERE user_id = ANY(%s::BIGINT[]);
+        """
+        await Database.execute_query(query, (list(user_ids),))
 
+    # --- Scheduled Job Methods ---
+
+    @staticmethod
+    async def get_job_runs():
+        """Returns {job_name: row} from scheduled_jobs."""
+        query = """
+        SELECT name, last_run_at, last_duration_ms, avg_duration_ms, max_duration_ms,
+               run_count, failure_count, last_status, last_error, last_runner
+        FROM scheduled_jobs;
+        """
+        result = await Database.execute_query(query, fetch=True) or []
+        columns = ['name', 'last_run_at', 'last_duration_ms', 'avg_duration_ms', 'max_duration_ms',
+                   'run_count', 'failure_count', 'last_status', 'last_error', 'last_runner']
+        return {row[0]: dict(zip(columns, row)) for row in result}
+
+    @staticmethod
+    async def record_job_run(name: str, started_at: datetime, duration_ms: float, status: str, error: str, runner: str):
+        """Records one run of a scheduled job and updates its running duration statistics."""
+        query = """
+        INSERT INTO scheduled_jobs (name, last_run_at, last_duration_ms, avg_duration_ms, max_duration_ms,
+                                    run_count, failure_count, last_status, last_error, last_runner)
+        VALUES (%s, %s, %s, %s, %s, 1, %s, %s, %s, %s)
+        ON CONFLICT (name) DO UPDATE
+        SET last_run_at = EXCLUDED.last_run_at,
+            last_duration_ms = EXCLUDED.last_duration_ms,
+            avg_duration_ms = (scheduled_jobs.avg_duration_ms * scheduled_jobs.run_count + EXCLUDED.last_duration_ms)
+                              / (scheduled_jobs.run_count + 1),
+            max_duration_ms = GREATEST(scheduled_jobs.max_duration_ms, EXCLUDED.last_duration_ms),
+            run_count = scheduled_jobs.run_count + 1,
+            failure_count = scheduled_jobs.failure_count + EXCLUDED.failure_count,
+            last_status = EXCLUDED.last_status,
+            last_error = EXCLUDED.last_error,
+            last_runner = EXCLUDED.last_runner;
+        """
+        failed = 1 if status != 'ok' else 0
+        await Database.execute_query(query, (name, started_at, duration_ms, duration_ms, duration_ms,
+                                             failed, status, error, runner))
 
     @staticmethod
     async def add_or_update_user(user_id: int, username: str, first_name: str, last_name: str):
@@ -103,33 +487,61 @@ class Database:
         SET username = EXCLUDED.username,
             first_name = EXCLUDED.first_name,
             last_name = EXCLUDED.last_name,
-            last_active = NOW();
+            last_active = NOW(),
+            blocked_at = NULL;
         """
         await Database.execute_query(query, (user_id, username, first_name, last_name))
 
     @staticmethod
-    async def add_pending_payment(payment_id: str, user_id: int, amount: int, currency: str):
+    async def bulk_upsert_users(rows):
+        """
+        Upserts many users in one statement.
+        rows: iterable of (user_id, username, first_name, last_name, last_active) with unique user_ids.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        placeholders = ", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))
+        query = f"""
+        INSERT INTO users (user_id, username, first_name, last_name, last_active)
+        VALUES {placeholders}
+        ON CONFLICT (user_id) DO UPDATE
+        SET username = EXCLUDED.username,
+            first_name = EXCLUDED.first_name,
+            last_name = EXCLUDED.last_name,
+            last_active = GREATEST(users.last_active, EXCLUDED.last_active),
+            blocked_at = NULL; -- A user who messages the bot has unblocked it
+        """
+        params = [value for row in rows for value in row]
+        await Database.execute_query(query, params)
+
+    @staticmethod
+    async def add_pending_payment(payment_id: str, user_id: int, amount: int, currency: str,
+                                  requested_content_id: str = None):
         query = """
-        INSERT INTO payments (payment_id, user_id, amount, currency, status)
-        VALUES (%s, %s, %s, %s, 'pending');
+        INSERT INTO payments (payment_id, user_id, amount, currency, status, requested_content_id)
+        VALUES (%s, %s, %s, %s, 'pending', %s);
         """
-        await Database.execute_query(query, (payment_id, user_id, amount, currency))
+        await Database.execute_query(query, (payment_id, user_id, amount, currency, requested_content_id))
 
     @staticmethod
     async def update_payment_status(payment_id: str, status: str, provider_charge_id: str = None):
+        """Updates a payment's status and returns its requested_content_id (None for manual requests)."""
         query = """
         UPDATE payments
         SET status = %s,
             completion_timestamp = NOW(),
             provider_charge_id = %s -- Assuming you added this column for charge ID
-        WHERE payment_id = %s;
+        WHERE payment_id = %s
+        RETURNING requested_content_id;
         """
-        await Database.execute_query(query, (status, provider_charge_id, payment_id))
+        result = await Database.execute_query(query, (status, provider_charge_id, payment_id), fetch=True)
+        return str(result[0][0]) if result and result[0][0] else None
 
     @staticmethod
     async def get_payment_details(payment_id: str):
         query = """
-        SELECT payment_id, user_id, amount, currency, status, content_id
+        SELECT payment_id, user_id, amount, currency, status, content_id, requested_content_id
         FROM payments
         WHERE payment_id = %s;
         """
@@ -138,7 +550,102 @@ class Database:
             # Map the result to a dictionary for easier access
             # This assumes a specific order of columns in your SELECT statement
             # Consider fetching column names from cur.description if you want a more robust mapping
-            columns = ['payment_id', 'user_id', 'amount', 'currency', 'status', 'content_id']
+            columns = ['payment_id', 'user_id', 'amount', 'currency', 'status', 'content_id', 'requested_content_id']
+            return dict(zip(columns, result[0]))
+        return None
+
+    @staticmethod
+    async def get_payments_page(limit: int, status: str = None, awaiting_delivery: bool = False,
+                                since: datetime = None, until: datetime = None,
+                                cursor: tuple = None, direction: str = 'next'):
+        """
+        Returns one page of payments, newest first, using keyset pagination on
+        (request_timestamp, payment_id) so every page is a bounded index scan.
+        cursor is the (request_timestamp, payment_id) of the last row of the current page for
+        direction='next', or of the first row for direction='prev'.
+        Returns (rows, has_more) where has_more tells whether further rows exist in that direction.
+        """
+        conditions, params = [], []
+        if awaiting_delivery:
+            conditions.append("status = 'completed' AND content_id IS NULL")
+        elif status:
+            conditions.append("status = %s")
+            params.append(status)
+        if since:
+            conditions.append("request_timestamp >= %s")
+            params.append(since)
+        if until:
+            conditions.append("request_timestamp < %s")
+            params.append(until)
+        if cursor:
+            conditions.append(f"(request_timestamp, payment_id) {'<' if direction == 'next' else '>'} (%s, %s)")
+            params.extend(cursor)
+
+        order = 'DESC' if direction == 'next' else 'ASC'
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"""
+        SELECT payment_id, user_id, amount, currency, status, request_timestamp
+        FROM payments
+        {where}
+        ORDER BY request_timestamp {order}, payment_id {order}
+        LIMIT %s;
+        """
+        params.append(limit + 1) # One extra row tells us whether another page exists
+        result = await Database.execute_query(query, params, fetch=True) or []
+
+        columns = ['payment_id', 'user_id', 'amount', 'currency', 'status', 'request_timestamp']
+        rows = [dict(zip(columns, row)) for row in result[:limit]]
+        if direction == 'prev':
+            rows.reverse()
+        return rows, len(result) > limit
+
+    @staticmethod
+    async def get_user_info(user_id: int):
+        query = """
+        SELECT user_id, username, first_name, last_name, last_active
+        FROM users
+        WHERE user_id = %s;
+        """
+        result = await Database.execute_query(query, (user_id,), fetch=True)
+        if result:
+            columns = ['user_id', 'username', 'first_name', 'last_name', 'last_active']
+            return dict(zip(columns, result[0]))
+        return None
+
+    @staticmethod
+    async def get_users_by_ids(user_ids):
+        """Batch lookup: returns {user_id: user_info} for all given ids in a single query."""
+        if not user_ids:
+            return {}
+        query = """
+        SELECT user_id, username, first_name, last_name, last_active
+        FROM users
+        WHERE user_id = ANY(%s::BIGINT[]);
+        """
+        result = await Database.execute_query(query, (list(user_ids),), fetch=True) or []
+        columns = ['user_id', 'username', 'first_name', 'last_name', 'last_active']
+        return {row[0]: dict(zip(columns, row)) for row in result}
+
+    @staticmethod
+    async def get_payment_admin_view(payment_id: str):
+        """Returns a payment joined with its user and content, for the admin details view."""
+        query = """
+        SELECT p.payment_id, p.user_id, p.amount, p.currency, p.status, p.content_id,
+               p.request_timestamp, p.completion_timestamp,
+               u.username, u.first_name, u.last_name,
+               c.title AS content_title
+        FROM payments p
+        LEFT JOIN users u ON u.user_id = p.user_id
+        LEFT JOIN content_library c ON c.content_id = p.content_id
+        WHERE p.payment_id = %s;
+        """
+        result = await Database.execute_query(query, (payment_id,), fetch=True)
+        if result:
+            columns = [
+                'payment_id', 'user_id', 'amount', 'currency', 'status', 'content_id',
+                'request_timestamp', 'completion_timestamp',
+                'username', 'first_name', 'last_name', 'content_title'
+            ]
             return dict(zip(columns, result[0]))
         return None
 
@@ -178,16 +685,198 @@ class Database:
         Retrieves content details from the content_library based on content_id.
         """
         query = """
-        SELECT content_id, title, file_path, file_type, uploaded_at, admin_id
+        SELECT content_id, title, file_path, file_type, uploaded_at, admin_id, telegram_file_id, removed_at
         FROM content_library
         WHERE content_id = %s;
         """
         result = await Database.execute_query(query, (content_id,), fetch=True)
         if result:
-            columns = ['content_id', 'title', 'file_path', 'file_type', 'uploaded_at', 'admin_id']
+            columns = ['content_id', 'title', 'file_path', 'file_type', 'uploaded_at', 'admin_id', 'telegram_file_id', 'removed_at']
             return dict(zip(columns, result[0]))
         return None
 
+    @staticmethod
+    async def get_catalog_page(limit: int, offset: int = 0):
+        """
+        Returns (rows, has_more) for one page of the content catalog in title order.
+        The catalog is small and paged from the start, so OFFSET over the unique title index is cheap.
+        """
+        query = """
+        SELECT content_id, title
+        FROM content_library
+        WHERE removed_at IS NULL
+        ORDER BY title
+        LIMIT %s OFFSET %s;
+        """
+        result = await Database.execute_query(query, (limit + 1, offset), fetch=True) or []
+        rows = [{'content_id': str(row[0]), 'title': row[1]} for row in result[:limit]]
+        return rows, len(result) > limit
+
+    @staticmethod
+    async def search_catalog(text: str, limit: int, offset: int = 0):
+        """
+        Returns (rows, has_more) for one page of catalog titles matching `text`, for inline search.
+        Queries of 3+ characters match substrings and near-misses (pg_trgm), best match first;
+        shorter ones are too short for trigrams and match title prefixes instead. The prefix
+        range uses the text_pattern_ops operators so it stays indexable under generic plans.
+        """
+        if len(text) >= 3:
+            pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            query = """
+            SELECT content_id, title
+            FROM content_library
+            WHERE (title ILIKE %s OR title %% %s) AND removed_at IS NULL
+            ORDER BY similarity(title, %s) DESC, title
+            LIMIT %s OFFSET %s;
+            """
+            params = (pattern, text, text, limit + 1, offset)
+        else:
+            prefix = text.lower()
+            query = """
+            SELECT content_id, title
+            FROM content_library
+            WHERE lower(title) ~>=~ %s AND lower(title) ~<~ %s AND removed_at IS NULL
+            ORDER BY lower(title) USING ~<~
+            LIMIT %s OFFSET %s;
+            """
+            params = (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1), limit + 1, offset)
+        result = await Database.execute_query(query, params, fetch=True) or []
+        rows = [{'content_id': str(row[0]), 'title': row[1]} for row in result[:limit]]
+        return rows, len(result) > limit
+
+    # --- Drive Folder Sync Methods ---
+
+    @staticmethod
+    async def bulk_upsert_drive_content(rows) -> int:
+        """
+        Imports or refreshes Drive files in content_library with one multi-row upsert.
+        rows: iterable of (drive_file_id, title, file_type, modified_at).
+        Rows added by /addcontent for the same Drive file are adopted rather than duplicated (the
+        oldest one, if the file was added several times), unless the file already has a synced row
+        (e.g. it was re-added after syncing); that row is kept as is.
+        Titles are only set on import; a title already taken by another row gets the file ID
+        appended. A newer modifiedTime forgets the cached Telegram file_id so the new version is sent.
+        Returns the number of rows written.
+        """
+        unique = {}
+        for row in rows:
+            unique[row[0]] = row # Last one wins; ON CONFLICT cannot touch a row twice
+        if not unique:
+            return 0
+        taken = set()
+        rows = []
+        for drive_file_id, title, file_type, modified_at in unique.values():
+            if title in taken:
+                title = f"{title} [{drive_file_id[:8]}]"
+            taken.add(title)
+            rows.append((drive_file_id, title, file_type, modified_at))
+
+        adopt_query = """
+        UPDATE content_library
+        SET drive_file_id = file_path
+        WHERE content_id IN (
+            -- At most one row per file: /addcontent may have registered the same file more than once
+            SELECT DISTINCT ON (file_path) content_id
+            FROM content_library
+            WHERE drive_file_id IS NULL AND file_path = ANY(%s::TEXT[])
+            ORDER BY file_path, uploaded_at, content_id
+        )
+          AND NOT EXISTS (SELECT 1 FROM content_library c WHERE c.drive_file_id = content_library.file_path);
+        """
+        await Database.execute_query(adopt_query, ([row[0] for row in rows],))
+
+        placeholders = ", ".join(["(%s, %s, %s, %s::TIMESTAMP)"] * len(rows))
+        query = f"""
+        WITH incoming (drive_file_id, title, file_type, modified_at) AS (VALUES {placeholders})
+        INSERT INTO content_library (title, file_path, file_type, drive_file_id, drive_modified_at)
+        SELECT CASE WHEN EXISTS (
+                   SELECT 1 FROM content_library c
+                   WHERE c.title = i.title AND c.drive_file_id IS DISTINCT FROM i.drive_file_id
+               ) THEN i.title || ' [' || left(i.drive_file_id, 8) || ']' ELSE i.title END,
+               i.drive_file_id, i.file_type, i.drive_file_id, i.modified_at
+        FROM incoming i
+        ON CONFLICT (drive_file_id) DO UPDATE
+        SET file_path = EXCLUDED.file_path,
+            file_type = EXCLUDED.file_type,
+            drive_modified_at = EXCLUDED.drive_modified_at,
+            removed_at = NULL,
+            telegram_file_id = CASE WHEN content_library.drive_modified_at < EXCLUDED.drive_modified_at
+                                    THEN NULL ELSE content_library.telegram_file_id END
+        RETURNING content_id;
+        """
+        params = [value for row in rows for value in row]
+        result = await Database.execute_query(query, params, fetch=True) or []
+        return len(result)
+
+    @staticmethod
+    async def flag_drive_content_removed(drive_file_ids) -> int:
+        """Hides imported Drive files that were deleted, trashed or moved away. Returns the number flagged."""
+        if not drive_file_ids:
+            return 0
+        query = """
+        UPDATE content_library
+        SET removed_at = NOW()
+        WHERE drive_file_id = ANY(%s::TEXT[]) AND removed_at IS NULL
+        RETURNING content_id;
+        """
+        result = await Database.execute_query(query, (list(drive_file_ids),), fetch=True) or []
+        return len(result)
+
+    @staticmethod
+    async def flag_drive_content_removed_except(drive_file_ids) -> int:
+        """After a full folder walk, hides every imported Drive file that was not seen. Returns the number flagged."""
+        query = """
+        UPDATE content_library
+        SET removed_at = NOW()
+        WHERE drive_file_id IS NOT NULL AND removed_at IS NULL
+          AND NOT (drive_file_id = ANY(%s::TEXT[]))
+        RETURNING content_id;
+        """
+        result = await Database.execute_query(query, (list(drive_file_ids),), fetch=True) or []
+        return len(result)
+
+    @staticmethod
+    async def get_drive_sync_token(folder_id: str):
+        result = await Database.execute_query(
+            "SELECT page_token FROM drive_sync_state WHERE folder_id = %s", (folder_id,), fetch=True
+        )
+        return result[0][0] if result else None
+
+    @staticmethod
+    async def save_drive_sync_token(folder_id: str, page_token: str, full: bool = False):
+        query = """
+        INSERT INTO drive_sync_state (folder_id, page_token, last_full_sync_at, last_sync_at)
+        VALUES (%s, %s, CASE WHEN %s THEN NOW() END, NOW())
+        ON CONFLICT (folder_id) DO UPDATE
+        SET page_token = EXCLUDED.page_token,
+            last_full_sync_at = COALESCE(EXCLUDED.last_full_sync_at, drive_sync_state.last_full_sync_at),
+            last_sync_at = NOW();
+        """
+        await Database.execute_query(query, (folder_id, page_token, full))
+
+    @staticmethod
+    async def set_content_telegram_file_id(content_id: str, telegram_file_id: str):
+        """
+        Stores the Telegram file_id returned by the first successful upload of a content item.
+        Later deliveries reuse it instead of downloading the file from Google Drive again.
+        """
+        query = """
+        UPDATE content_library
+        SET telegram_file_id = %s
+        WHERE content_id = %s;
+        """
+        await Database.execute_query(query, (telegram_file_id, content_id))
+
+    @staticmethod
+    async def clear_content_telegram_file_id(content_id: str):
+        """Forgets a cached Telegram file_id (e.g. when Telegram rejects it)."""
+        query = """
+        UPDATE content_library
+        SET telegram_file_id = NULL
+        WHERE content_id = %s;
+        """
+        await Database.execute_query(query, (content_id,))
+
     @staticmethod
     async def link_content_to_payment(payment_id: str, content_id: str):
         """
@@ -202,19 +891,155 @@ class Database:
         await Database.execute_query(query, (content_id, payment_id))
 
 
+    # --- Delivery Queue Methods ---
+
+    @staticmethod
+    async def enqueue_delivery(payment_id: str, content_id: str, user_id: int, requested_by: int = None):
+        """
+        Queues a content delivery job. Returns the new delivery_id, or None if the payment
+        already has a queued or in-progress delivery.
+        """
+        query = """
+        INSERT INTO deliveries (payment_id, content_id, user_id, requested_by)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (payment_id) WHERE status IN ('queued', 'in_progress') DO NOTHING
+        RETURNING delivery_id;
+        """
+        result = await Database.execute_query(query, (payment_id, content_id, user_id, requested_by), fetch=True)
+        return result[0][0] if result else None
+
+    @staticmethod
+    async def claim_delivery(lock_timeout_seconds: int):
+        """
+        Atomically claims the next due delivery job using FOR UPDATE SKIP LOCKED, so concurrent
+        workers never pick the same row. Jobs left 'in_progress' longer than lock_timeout_seconds
+        (e.g. by a crashed process) are reclaimed as well.
+        """
+        query = """
+        UPDATE deliveries
+        SET status = 'in_progress',
+            locked_at = NOW(),
+            attempts = attempts + 1
+        WHERE delivery_id = (
+            SELECT delivery_id
+            FROM deliveries
+            WHERE (status = 'queued' AND next_attempt_at <= NOW())
+               OR (status = 'in_progress' AND locked_at < NOW() - make_interval(secs => %s))
+            ORDER BY next_attempt_at
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING delivery_id, payment_id, content_id, user_id, requested_by, attempts, sent_at, telegram_file_id;
+        """
+        result = await Database.execute_query(query, (lock_timeout_seconds,), fetch=True)
+        if result:
+            columns = ['delivery_id', 'payment_id', 'content_id', 'user_id', 'requested_by', 'attempts',
+                       'sent_at', 'telegram_file_id']
+            return dict(zip(columns, result[0]))
+        return None
+
+    @staticmethod
+    async def heartbeat_delivery(delivery_id: int, attempt: int) -> bool:
+        """
+        Extends the lease of a running job so it is not reclaimed by another worker.
+        The claim's attempt number identifies the lease; returns False if the job has been
+        reclaimed since (its attempts moved on) or is no longer in progress.
+        """
+        query = """
+        UPDATE deliveries
+        SET locked_at = NOW()
+        WHERE delivery_id = %s AND attempts = %s AND status = 'in_progress'
+        RETURNING delivery_id;
+        """
+        return bool(await Database.execute_query(query, (delivery_id, attempt), fetch=True))
+
+    @staticmethod
+    async def complete_delivery(delivery_id: int, attempt: int, telegram_file_id: str = None) -> bool:
+        """
+        Marks a sent job done and links its content to the payment, in one statement, so a
+        delivery is never left sent but not completed. Returns False if this worker no longer
+        holds its lease.
+        """
+        query = """
+        WITH done AS (
+            UPDATE deliveries
+            SET status = 'done',
+                completed_at = NOW(),
+                sent_at = COALESCE(sent_at, NOW()),
+                telegram_file_id = COALESCE(%s, telegram_file_id),
+                locked_at = NULL,
+                last_error = NULL
+            WHERE delivery_id = %s AND attempts = %s AND status = 'in_progress'
+            RETURNING delivery_id, payment_id, content_id
+        ), linked AS (
+            UPDATE payments p
+            SET content_id = done.content_id,
+                status = 'delivered'
+            FROM done
+            WHERE p.payment_id = done.payment_id
+        )
+        SELECT delivery_id FROM done;
+        """
+        return bool(await Database.execute_query(query, (telegram_file_id, delivery_id, attempt), fetch=True))
+
+    @staticmethod
+    async def retry_delivery(delivery_id: int, attempt: int, error: str, delay_seconds: float,
+                             sent: bool = False, telegram_file_id: str = None) -> bool:
+        """
+        Puts a failed job back in the queue to be retried after delay_seconds. Returns False if the lease was lost.
+        With sent=True the content already reached the user, and the retry only completes the job.
+        """
+        query = """
+        UPDATE deliveries
+        SET status = 'queued',
+            next_attempt_at = NOW() + make_interval(secs => %s),
+            locked_at = NULL,
+            last_error = %s,
+            sent_at = CASE WHEN %s THEN COALESCE(sent_at, NOW()) ELSE sent_at END,
+            telegram_file_id = COALESCE(%s, telegram_file_id)
+        WHERE delivery_id = %s AND attempts = %s AND status = 'in_progress'
+        RETURNING delivery_id;
+        """
+        params = (delay_seconds, error, sent, telegram_file_id, delivery_id, attempt)
+        return bool(await Database.execute_query(query, params, fetch=True))
+
+    @staticmethod
+    async def fail_delivery(delivery_id: int, attempt: int, error: str) -> bool:
+        """Marks a job as permanently failed after its final attempt. Returns False if the lease was lost."""
+        query = """
+        UPDATE deliveries
+        SET status = 'failed',
+            completed_at = NOW(),
+            locked_at = NULL,
+            last_error = %s
+        WHERE delivery_id = %s AND attempts = %s AND status = 'in_progress'
+        RETURNING delivery_id;
+        """
+        return bool(await Database.execute_query(query, (error, delivery_id, attempt), fetch=True))
+
     @staticmethod
     async def get_stats():
-        """Returns statistics about users and payments"""
-        query = """
-        SELECT
-            COUNT(DISTINCT p.user_id) AS total_users,
-            COUNT(DISTINCT CASE WHEN u.last_active > NOW() - INTERVAL '30 days' THEN p.user_id END) AS active_users,
-            COUNT(*) AS total_payments,
-            COUNT(CASE WHEN p.status = 'pending' THEN 1 END) AS pending_payments,
-            SUM(CASE WHEN p.status = 'completed' THEN amount ELSE 0 END) AS revenue_completed,
-            SUM(CASE WHEN p.status = 'pending' THEN amount ELSE 0 END) AS revenue_pending
-        FROM payments p
-        LEFT JOIN users u ON p.user_id = u.user_id;
+        """
+        Returns statistics about users and payments.
+        Reads the payment_stats rollup plus the trigger-recorded deltas not yet folded in by
+        fold_stats_deltas(), which runs every few seconds, so the cost does not grow with history.
+        """
+        query = """
+        SELECT s.total_users + COALESCE(d.total_users, 0),
+               s.active_users,
+               s.total_payments + COALESCE(d.total_payments, 0),
+               s.pending_payments + COALESCE(d.pending_payments, 0),
+               s.revenue_completed + COALESCE(d.revenue_completed, 0),
+               s.revenue_pending + COALESCE(d.revenue_pending, 0)
+        FROM payment_stats s
+        CROSS JOIN (
+            SELECT SUM(total_users)::BIGINT AS total_users,
+                   SUM(total_payments)::BIGINT AS total_payments,
+                   SUM(pending_payments)::BIGINT AS pending_payments,
+                   SUM(revenue_completed)::BIGINT AS revenue_completed,
+                   SUM(revenue_pending)::BIGINT AS revenue_pending
+            FROM payment_stats_deltas
+        ) d;
         """
         result = await Database.execute_query(query, fetch=True)
         if result:
@@ -225,3 +1050,111 @@ class Database:
             ]
             return dict(zip(columns, result[0]))
         return None
+
+    @staticmethod
+    async def fold_stats_deltas():
+        """
+        Adds the pending payment_stats_deltas rows to the rollup and deletes them, in one
+        statement, keeping the table /stats sums over small between reconciliations.
+        """
+        query = """
+        WITH d AS (
+            DELETE FROM payment_stats_deltas
+            RETURNING *
+        ), total AS (
+            SELECT COUNT(*) AS folded,
+                   COALESCE(SUM(total_users), 0)::BIGINT AS total_users,
+                   COALESCE(SUM(total_payments), 0)::BIGINT AS total_payments,
+                   COALESCE(SUM(pending_payments), 0)::BIGINT AS pending_payments,
+                   COALESCE(SUM(revenue_completed), 0)::BIGINT AS revenue_completed,
+                   COALESCE(SUM(revenue_pending), 0)::BIGINT AS revenue_pending
+            FROM d
+        )
+        UPDATE payment_stats s
+        SET total_users = s.total_users + total.total_users,
+            total_payments = s.total_payments + total.total_payments,
+            pending_payments = s.pending_payments + total.pending_payments,
+            revenue_completed = s.revenue_completed + total.revenue_completed,
+            revenue_pending = s.revenue_pending + total.revenue_pending
+        FROM total
+        WHERE total.folded > 0
+        RETURNING total.folded;
+        """
+        result = await Database.execute_query(query, fetch=True)
+        return result[0][0] if result else 0
+
+    @staticmethod
+    async def reconcile_stats(conn=None):
+        """
+        Recomputes the payment_stats rollup from the payments table, fixing any drift and
+        refreshing the time-dependent active_users figure. This is the full scan that /stats
+        used to run on every call; it now runs only from the periodic reconciliation job.
+        The recompute and the removal of the deltas it covers happen in one statement, i.e. one
+        snapshot, so deltas committed meanwhile are kept for the next run.
+        Both scans grow with the payments table, so they run on a connection without the pool's
+        statement_timeout: `conn` if given (init_db passes its migration connection), otherwise
+        a dedicated one.
+        """
+        rebuild_user_counts = """
+        WITH counts AS (
+            SELECT user_id, COUNT(*) AS payments
+            FROM payments
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id
+        ), removed AS (
+            DELETE FROM payment_user_counts c
+            WHERE NOT EXISTS (SELECT 1 FROM counts WHERE counts.user_id = c.user_id)
+        )
+        INSERT INTO payment_user_counts (user_id, payments)
+        SELECT user_id, payments FROM counts
+        ON CONFLICT (user_id) DO UPDATE SET payments = EXCLUDED.payments;
+        """
+        recompute = """
+        WITH fresh AS (
+            SELECT
+                COUNT(DISTINCT p.user_id) AS total_users,
+                COUNT(DISTINCT CASE WHEN u.last_active > NOW() - INTERVAL '30 days' THEN p.user_id END) AS active_users,
+                COUNT(*) AS total_payments,
+                COUNT(CASE WHEN p.status = 'pending' THEN 1 END) AS pending_payments,
+                COALESCE(SUM(CASE WHEN p.status = 'completed' THEN amount ELSE 0 END), 0) AS revenue_completed,
+                COALESCE(SUM(CASE WHEN p.status = 'pending' THEN amount ELSE 0 END), 0) AS revenue_pending
+            FROM payments p
+            LEFT JOIN users u ON p.user_id = u.user_id
+        ), folded AS (
+            DELETE FROM payment_stats_deltas
+        )
+        UPDATE payment_stats s
+        SET total_users = fresh.total_users,
+            active_users = fresh.active_users,
+            total_payments = fresh.total_payments,
+            pending_payments = fresh.pending_payments,
+            revenue_completed = fresh.revenue_completed,
+            revenue_pending = fresh.revenue_pending,
+            reconciled_at = NOW()
+        FROM fresh;
+        """
+        if conn is not None:
+            await Database.execute_on(conn, rebuild_user_counts)
+            await Database.execute_on(conn, recompute)
+            return
+
+        conn = await Database.connect_dedicated()
+        try:
+            await Database.execute_on(conn, "SET statement_timeout = 0")
+            await Database.execute_on(conn, rebuild_user_counts)
+            await Database.execute_on(conn, recompute)
+        finally:
+            await Database.close_dedicated(conn)
+
+
+def _pool_connections():
+    stats = Database.get_pool_stats()
+    return {(state,): stats[state] for state in ('size', 'idle', 'in_use', 'waiters')}
+
+
+metrics.Gauge('moviebot_db_pool_connections', 'Database pool connections by state.', ['state'],
+              function=_pool_connections)
+metrics.Counter('moviebot_db_pool_acquire_timeouts_total', 'Pool acquires that timed out.',
+                function=lambda: Database.pool_stats['acquire_timeouts'])
+metrics.Counter('moviebot_db_pool_slow_acquires_total', 'Pool acquires slower than DB_POOL_SLOW_ACQUIRE_SECONDS.',
+                function=lambda: Database.pool_stats['slow_acquires'])
@@ -0,0 +1,130 @@
+import logging
+import os
+from datetime import datetime
+
+from config import Config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+FILE_FIELDS = 'id,name,mimeType,parents,trashed,modifiedTime'
+
+
+class SyncBusy(Exception):
+    """Raised when a sync is requested while another process or task is already syncing"""
+    pass
+
+
+class DriveFolderSync:
+    """
+    Mirrors the files of one Google Drive folder into content_library.
+    The first run lists the folder with paged files.list and saves a Changes API start token;
+    later runs read only the changes since that token. Each page is written with one bulk
+    upsert, and files that were deleted, trashed or moved out of the folder are flagged with
+    removed_at so they drop out of the catalog.
+    Only files directly in the folder are synced; Google Docs editor files and folders are
+    skipped because they cannot be downloaded as-is.
+    Runs are serialized across processes by an advisory lock (DRIVE_SYNC_LOCK_KEY), so the
+    scheduled job and /syncdrive never advance the same page token concurrently.
+    """
+
+    def __init__(self, drive_client, folder_id: str, page_size: int = 1000):
+        self.drive_client = drive_client
+        self.folder_id = folder_id
+        self.page_size = page_size
+
+    async def run(self, full: bool = False) -> dict:
+        """
+        Syncs the folder and returns counters. A full walk is done on first run or when `full` is set.
+        Raises SyncBusy if another sync holds the lock.
+        """
+        lock_conn = await Database.connect_dedicated()
+        try:
+            if not await Database.try_advisory_lock(lock_conn, Config.DRIVE_SYNC_LOCK_KEY):
+                raise SyncBusy("A Drive folder sync is already running")
+            page_token = None if full else await Database.get_drive_sync_token(self.folder_id)
+            if page_token is None:
+                return await self._full_sync()
+            return await self._incremental_sync(page_token)
+        finally:
+            # Closing the session releases the lock
+            await Database.close_dedicated(lock_conn)
+
+    async def _full_sync(self) -> dict:
+        # Taken before listing, so changes made during the walk are replayed by the next run
+        start_token = await self.drive_client.get_start_page_token()
+        stats = {'mode': 'full', 'upserted': 0, 'removed': 0, 'skipped': 0}
+        seen = []
+        page_token = None
+        while True:
+            page = await self.drive_client.list_files(
+                q=f"'{self.folder_id}' in parents and trashed = false",
+                fields=f"nextPageToken, files({FILE_FIELDS})",
+                page_token=page_token,
+                page_size=self.page_size
+            )
+            rows = []
+            for file in page.get('files', []):
+                row = self._content_row(file)
+                if row is None:
+                    stats['skipped'] += 1
+                    continue
+                rows.append(row)
+                seen.append(file['id'])
+            stats['upserted'] += await Database.bulk_upsert_drive_content(rows)
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                break
+
+        stats['removed'] = await Database.flag_drive_content_removed_except(seen)
+        await Database.save_drive_sync_token(self.folder_id, start_token, full=True)
+        logger.info(f"Drive folder full sync: {stats}")
+        return stats
+
+    async def _incremental_sync(self, page_token: str) -> dict:
+        stats = {'mode': 'incremental', 'upserted': 0, 'removed': 0, 'skipped': 0}
+        while True:
+            page = await self.drive_client.list_changes(
+                page_token,
+                fields=f"nextPageToken, newStartPageToken, changes(changeType, fileId, removed, file({FILE_FIELDS}))",
+                page_size=self.page_size
+            )
+            rows, removed = [], []
+            for change in page.get('changes', []):
+                if change.get('changeType', 'file') != 'file' or not change.get('fileId'):
+                    continue # Shared drive changes (changeType 'drive') carry no file
+                file = change.get('file') or {}
+                if change.get('removed') or file.get('trashed') or self.folder_id not in file.get('parents', []):
+                    removed.append(change['fileId']) # Only matters if we imported it
+                    continue
+                row = self._content_row(file)
+                if row is None:
+                    stats['skipped'] += 1
+                else:
+                    rows.append(row)
+            stats['upserted'] += await Database.bulk_upsert_drive_content(rows)
+            stats['removed'] += await Database.flag_drive_content_removed(removed)
+
+            # Checkpoint after every page so an interrupted sync resumes where it stopped
+            page_token = page.get('nextPageToken') or page['newStartPageToken']
+            await Database.save_drive_sync_token(self.folder_id, page_token)
+            if 'newStartPageToken' in page:
+                break
+
+        logger.info(f"Drive folder incremental sync: {stats}")
+        return stats
+
+    @staticmethod
+    def _content_row(file: dict):
+        """Maps a Drive file to (drive_file_id, title, file_type, modified_at), or None if it is not content."""
+        mime_type = file.get('mimeType', '')
+        if mime_type == FOLDER_MIME_TYPE or mime_type.startswith('application/vnd.google-apps.'):
+            return None
+        title = (os.path.splitext(file['name'])[0] or file['name'])[:240]
+        file_type = 'video' if mime_type.startswith('video/') else 'document'
+        modified_at = None
+        if file.get('modifiedTime'):
+            # RFC 3339 in UTC, e.g. 2024-05-01T12:00:00.000Z
+            modified_at = datetime.fromisoformat(file['modifiedTime'].replace('Z', '+00:00')).replace(tzinfo=None)
+        return file['id'], title, file_type, modified_at
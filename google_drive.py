@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import quote
+
+import aiohttp
+from google.auth import crypt, jwt
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DRIVE_API_URL = "https://www.googleapis.com/drive/v3"
+DEFAULT_TOKEN_URI = "https://oauth2.googleapis.com/token"
+DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive']
+
+
+class DriveError(Exception):
+    """Raised when the Google Drive API returns an error response"""
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Drive API error {status}: {message}")
+        self.status = status
+
+
+class DownloadTooLarge(Exception):
+    """Raised when a download exceeds the byte limit given to AsyncDriveClient.download()"""
+    pass
+
+
+class AsyncDriveClient:
+    """
+    Minimal asyncio Google Drive v3 client built on aiohttp.
+    Mints service-account access tokens itself and keeps a pooled connector, so no Drive
+    call ever blocks the event loop.
+    """
+
+    def __init__(self, credentials_path: str, scopes=None, pool_size: int = 20, api_url: str = DRIVE_API_URL):
+        with open(credentials_path) as f:
+            info = json.load(f)
+        self._signer = crypt.RSASigner.from_service_account_info(info)
+        self._client_email = info['client_email']
+        self._token_uri = info.get('token_uri', DEFAULT_TOKEN_URI)
+        self._scopes = scopes or DRIVE_SCOPES
+        self._pool_size = pool_size
+        self._api_url = api_url
+        self._session = None
+        self._token = None
+        self._token_expiry = 0
+        self._token_lock = asyncio.Lock()
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_size, ttl_dns_cache=300)
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def _get_access_token(self):
+        """Returns a cached access token, minting a new one via the JWT bearer flow when near expiry."""
+        async with self._token_lock:
+            if self._token and time.time() < self._token_expiry - 60:
+                return self._token
+
+            now = int(time.time())
+            assertion = jwt.encode(self._signer, {
+                'iss': self._client_email,
+                'scope': ' '.join(self._scopes),
+                'aud': self._token_uri,
+                'iat': now,
+                'exp': now + 3600,
+            })
+            session = await self._get_session()
+            async with session.post(self._token_uri, data={
+                'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
+                'assertion': assertion.decode() if isinstance(assertion, bytes) else assertion,
+            }) as response:
+                data = await response.json()
+                if response.status != 200:
+                    raise DriveError(response.status, data.get('error_description', str(data)))
+
+            self._token = data['access_token']
+            self._token_expiry = now + int(data.get('expires_in', 3600))
+            logger.debug("Minted new Google Drive access token.")
+            return self._token
+
+    async def _request(self, method: str, path: str, params=None, operation: str = 'request'):
+        """Performs an authenticated JSON request against the Drive API."""
+        token = await self._get_access_token()
+        session = await self._get_session()
+        with metrics.DRIVE_REQUEST_SECONDS.time(operation=operation):
+            async with session.request(method, f"{self._api_url}{path}", params=params,
+                                       headers={'Authorization': f"Bearer {token}"}) as response:
+                if response.status >= 400:
+                    metrics.DRIVE_ERRORS.inc(operation=operation, status=response.status)
+                    raise DriveError(response.status, await response.text())
+                return await response.json()
+
+    async def get_metadata(self, file_id: str, fields: str = 'id,name,size,mimeType'):
+        """Returns metadata for a single file."""
+        return await self._request('GET', f"/files/{quote(file_id)}",
+                                   params={'fields': fields, 'supportsAllDrives': 'true'}, operation='get_metadata')
+
+    async def download(self, file_id: str, fd, chunk_size: int = 4 * 1024 * 1024, max_bytes: int = None):
+        """
+        Streams the file content into the writable file object `fd` chunk by chunk.
+        Returns the number of bytes written. Raises DownloadTooLarge as soon as more than
+        `max_bytes` arrive, if given.
+        """
+        token = await self._get_access_token()
+        session = await self._get_session()
+        written = 0
+        with metrics.DRIVE_REQUEST_SECONDS.time(operation='download'):
+            async with session.get(f"{self._api_url}/files/{quote(file_id)}",
+                                   params={'alt': 'media', 'supportsAllDrives': 'true'},
+                                   headers={'Authorization': f"Bearer {token}"}) as response:
+                if response.status >= 400:
+                    metrics.DRIVE_ERRORS.inc(operation='download', status=response.status)
+                    raise DriveError(response.status, await response.text())
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    if max_bytes is not None and written + len(chunk) > max_bytes:
+                        raise DownloadTooLarge(f"Drive file {file_id} is larger than {max_bytes} bytes")
+                    fd.write(chunk)
+                    written += len(chunk)
+                    metrics.DRIVE_DOWNLOAD_BYTES.inc(len(chunk))
+                    logger.debug(f"Drive download {file_id}: {written} bytes.")
+        return written
+
+    async def list_files(self, q: str = None, fields: str = 'nextPageToken, files(id,name,size,mimeType)',
+                         page_token: str = None, page_size: int = 1000):
+        """Returns one page of files.list results."""
+        params = {'fields': fields, 'pageSize': page_size,
+                  'supportsAllDrives': 'true', 'includeItemsFromAllDrives': 'true'}
+        if q:
+            params['q'] = q
+        if page_token:
+            params['pageToken'] = page_token
+        return await self._request('GET', "/files", params=params, operation='list_files')
+
+    async def get_start_page_token(self) -> str:
+        """Returns the Changes API token for 'now'; changes.list from it yields only later changes."""
+        data = await self._request('GET', "/changes/startPageToken", params={'supportsAllDrives': 'true'},
+                                   operation='changes_start_token')
+        return data['startPageToken']
+
+    async def list_changes(self, page_token: str, fields: str = 'nextPageToken, newStartPageToken, changes(changeType, fileId, removed, file)',
+                           page_size: int = 1000):
+        """
+        Returns one page of changes.list results. The last page carries newStartPageToken
+        instead of nextPageToken; save it for the next sync.
+        """
+        params = {'pageToken': page_token, 'fields': fields, 'pageSize': page_size, 'spaces': 'drive',
+                  'includeRemoved': 'true', 'supportsAllDrives': 'true', 'includeItemsFromAllDrives': 'true'}
+        return await self._request('GET', "/changes", params=params, operation='list_changes')
@@ -0,0 +1,213 @@
+import functools
+import logging
+import math
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from a fast cached query up to a large upload
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=()) -> str:
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class Registry:
+    """Holds every metric of this process and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.error(f"Failed to collect metric {metric.name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=(), function=None, registry=REGISTRY):
+        """
+        `function`, if given, is called at scrape time and returns either a number or a dict
+        mapping label-value tuples to numbers, for values that already live elsewhere.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._function = function
+        self._values = {} # label-value tuple -> value
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        if self._function is None:
+            return self._values.items()
+        values = self._function()
+        return values.items() if isinstance(values, dict) else [((), values)]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labelvalues, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry=registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0] # bucket counts, sum, count
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][index] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labelvalues, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# --- Metrics recorded by the bot ---
+
+HANDLER_SECONDS = Histogram('moviebot_handler_seconds', 'Update handler latency.', ['handler'])
+HANDLER_ERRORS = Counter('moviebot_handler_errors_total', 'Update handlers that raised.', ['handler'])
+
+DB_QUERY_SECONDS = Histogram('moviebot_db_query_seconds', 'Database query execution time (excluding pool wait).', ['query'])
+DB_QUERY_ERRORS = Counter('moviebot_db_query_errors_total', 'Database queries that raised.', ['query'])
+DB_POOL_ACQUIRE_SECONDS = Histogram('moviebot_db_pool_acquire_seconds', 'Time spent waiting for a pooled connection.')
+
+DRIVE_REQUEST_SECONDS = Histogram('moviebot_drive_request_seconds', 'Google Drive API request latency.', ['operation'])
+DRIVE_ERRORS = Counter('moviebot_drive_errors_total', 'Google Drive API error responses.', ['operation', 'status'])
+DRIVE_DOWNLOAD_BYTES = Counter('moviebot_drive_download_bytes_total', 'Bytes downloaded from Google Drive.')
+
+BOT_API_SECONDS = Histogram('moviebot_bot_api_seconds', 'Bot API call latency, excluding rate-limiter wait.', ['endpoint'])
+BOT_API_ERRORS = Counter('moviebot_bot_api_errors_total', 'Bot API calls that failed.', ['endpoint', 'error'])
+BOT_API_QUEUE_SECONDS = Histogram('moviebot_bot_api_queue_seconds', 'Time a send waited in the rate limiter.', ['priority'])
+
+JOB_SECONDS = Histogram('moviebot_job_seconds', 'Scheduled job duration.', ['job', 'status'])
+
+PROCESS_START_TIME = Gauge('moviebot_process_start_time_seconds', 'Unix time the process started.')
+PROCESS_START_TIME.set(time.time())
+
+
+def track_handler(callback):
+    """Wraps a PTB handler callback to record its latency and failures under its function name."""
+    name = getattr(callback, '__name__', repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+class MetricsServer:
+    """Serves REGISTRY on GET /metrics. Binds to localhost by default; metrics are not authenticated."""
+
+    def __init__(self, listen: str, port: int, registry: Registry = REGISTRY):
+        self.listen = listen
+        self.port = port
+        self.registry = registry
+        self._runner = None
+
+    async def start(self):
+        web_app = web.Application()
+        web_app.router.add_get('/metrics', self._handle_metrics)
+        self._runner = web.AppRunner(web_app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        logger.info(f"Metrics server listening on {self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_metrics(self, request):
+        return web.Response(body=self.registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
@@ -0,0 +1,370 @@
+from config import Config
+
+# Versioned schema migrations, applied in order by Database.init_db().
+# Each entry is (version, description, statements). Statements run one by one outside
+# an explicit transaction (CREATE INDEX CONCURRENTLY requires that) and are written to be
+# idempotent, so a migration interrupted half-way is simply re-run on the next start.
+# An interrupted CREATE INDEX CONCURRENTLY leaves an INVALID index behind that IF NOT EXISTS
+# would skip; init_db() drops such an index before re-running the statement.
+# Never edit a released migration; append a new one instead.
+
+MIGRATIONS = [
+    (1, "baseline schema", (
+        # Enable uuid-ossp extension
+        "CREATE EXTENSION IF NOT EXISTS \"uuid-ossp\";",
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username VARCHAR(32),
+            first_name VARCHAR(64),
+            last_name VARCHAR(64),
+            last_active TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            payment_id VARCHAR(128) PRIMARY KEY,
+            user_id BIGINT REFERENCES users(user_id),
+            amount INTEGER NOT NULL,
+            currency VARCHAR(3) NOT NULL,
+            status VARCHAR(16) DEFAULT 'pending',
+            request_timestamp TIMESTAMP DEFAULT NOW(),
+            completion_timestamp TIMESTAMP,
+            expiry_timestamp TIMESTAMP GENERATED ALWAYS AS 
+                (request_timestamp + INTERVAL '%s HOURS') STORED,
+            content_id UUID -- Changed from file_id, file_name, file_type
+        )
+        """ % Config.REQUEST_EXPIRY_HOURS,
+        """
+        -- Create content_library table
+        CREATE TABLE IF NOT EXISTS content_library (
+            content_id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+            title VARCHAR(255) NOT NULL UNIQUE,
+            file_path TEXT NOT NULL, -- This will store Google Drive File ID or CMS URL
+            file_type VARCHAR(50) DEFAULT 'document',
+            uploaded_at TIMESTAMP DEFAULT NOW(),
+            admin_id BIGINT
+        )
+        """,
+        """
+        -- Add foreign key constraint to payments table (if not already added)
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1
+                FROM pg_constraint
+                WHERE conname = 'fk_content'
+            ) THEN
+                ALTER TABLE payments
+                ADD CONSTRAINT fk_content
+                FOREIGN KEY (content_id) REFERENCES content_library(content_id)
+                ON DELETE SET NULL;
+            END IF;
+        END
+        $$;
+        """,
+        """
+        -- Cached Telegram file_id so repeat deliveries skip Google Drive
+        ALTER TABLE content_library
+        ADD COLUMN IF NOT EXISTS telegram_file_id TEXT
+        """,
+        """
+        -- Persistent delivery job queue consumed by the in-process worker pool
+        CREATE TABLE IF NOT EXISTS deliveries (
+            delivery_id BIGSERIAL PRIMARY KEY,
+            payment_id VARCHAR(128) NOT NULL REFERENCES payments(payment_id),
+            content_id UUID NOT NULL REFERENCES content_library(content_id),
+            user_id BIGINT NOT NULL,
+            requested_by BIGINT,
+            status VARCHAR(16) NOT NULL DEFAULT 'queued', -- queued, in_progress, done, failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            locked_at TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT NOW(),
+            completed_at TIMESTAMP
+        )
+        """,
+        """
+        -- At most one active delivery job per payment
+        CREATE UNIQUE INDEX IF NOT EXISTS deliveries_active_payment_idx
+        ON deliveries (payment_id) WHERE status IN ('queued', 'in_progress')
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS deliveries_claim_idx
+        ON deliveries (next_attempt_at) WHERE status = 'queued'
+        """,
+        """
+        -- Single-row rollup of payment statistics, maintained by triggers on payments
+        CREATE TABLE IF NOT EXISTS payment_stats (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            total_users BIGINT NOT NULL DEFAULT 0,
+            active_users BIGINT NOT NULL DEFAULT 0, -- Time-dependent; refreshed by reconciliation
+            total_payments BIGINT NOT NULL DEFAULT 0,
+            pending_payments BIGINT NOT NULL DEFAULT 0,
+            revenue_completed BIGINT NOT NULL DEFAULT 0,
+            revenue_pending BIGINT NOT NULL DEFAULT 0,
+            reconciled_at TIMESTAMP
+        )
+        """,
+        "INSERT INTO payment_stats (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING",
+        """
+        -- Payments per user, used to keep the distinct-payer count incrementally
+        CREATE TABLE IF NOT EXISTS payment_user_counts (
+            user_id BIGINT PRIMARY KEY,
+            payments BIGINT NOT NULL
+        )
+        """,
+        """
+        CREATE OR REPLACE FUNCTION payment_stats_apply() RETURNS trigger AS $$
+        DECLARE
+            remaining BIGINT;
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE payment_stats SET
+                    total_payments = total_payments - 1,
+                    pending_payments = pending_payments - (OLD.status = 'pending')::INT,
+                    revenue_completed = revenue_completed - CASE WHEN OLD.status = 'completed' THEN OLD.amount ELSE 0 END,
+                    revenue_pending = revenue_pending - CASE WHEN OLD.status = 'pending' THEN OLD.amount ELSE 0 END;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE payment_stats SET
+                    total_payments = total_payments + 1,
+                    pending_payments = pending_payments + (NEW.status = 'pending')::INT,
+                    revenue_completed = revenue_completed + CASE WHEN NEW.status = 'completed' THEN NEW.amount ELSE 0 END,
+                    revenue_pending = revenue_pending + CASE WHEN NEW.status = 'pending' THEN NEW.amount ELSE 0 END;
+            END IF;
+
+            IF TG_OP = 'INSERT' AND NEW.user_id IS NOT NULL THEN
+                INSERT INTO payment_user_counts (user_id, payments) VALUES (NEW.user_id, 1)
+                ON CONFLICT (user_id) DO UPDATE SET payments = payment_user_counts.payments + 1
+                RETURNING payments INTO remaining;
+                IF remaining = 1 THEN
+                    UPDATE payment_stats SET total_users = total_users + 1;
+                END IF;
+            ELSIF TG_OP = 'DELETE' AND OLD.user_id IS NOT NULL THEN
+                UPDATE payment_user_counts SET payments = payments - 1
+                WHERE user_id = OLD.user_id
+                RETURNING payments INTO remaining;
+                IF remaining = 0 THEN
+                    DELETE FROM payment_user_counts WHERE user_id = OLD.user_id;
+                    UPDATE payment_stats SET total_users = total_users - 1;
+                END IF;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+        """,
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1
+                FROM pg_trigger
+                WHERE tgname = 'payments_stats_trigger'
+            ) THEN
+                CREATE TRIGGER payments_stats_trigger
+                AFTER INSERT OR DELETE OR UPDATE OF status, amount ON payments
+                FOR EACH ROW EXECUTE FUNCTION payment_stats_apply();
+            END IF;
+        END
+        $$;
+        """
+    )),
+    (2, "add payments.provider_charge_id", (
+        """
+        ALTER TABLE payments
+        ADD COLUMN IF NOT EXISTS provider_charge_id VARCHAR(255)
+        """,
+    )),
+    (3, "hot-path payment indexes", (
+        """
+        -- cleanup_expired_pending_payments: status = 'pending' AND NOW() > expiry_timestamp
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS payments_pending_expiry_idx
+        ON payments (expiry_timestamp) WHERE status = 'pending'
+        """,
+        """
+        -- ON DELETE SET NULL from content_library and per-content lookups
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS payments_content_idx
+        ON payments (content_id) WHERE content_id IS NOT NULL
+        """,
+    )),
+    (4, "keyset pagination indexes for admin payment views", (
+        """
+        -- /getpayments: newest first, keyset on (request_timestamp, payment_id)
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS payments_request_keyset_idx
+        ON payments (request_timestamp DESC, payment_id DESC)
+        """,
+        """
+        -- /getpayments <status>
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS payments_status_keyset_idx
+        ON payments (status, request_timestamp DESC, payment_id DESC)
+        """,
+        """
+        -- /pending: paid but not yet delivered
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS payments_awaiting_delivery_idx
+        ON payments (request_timestamp DESC, payment_id DESC)
+        WHERE status = 'completed' AND content_id IS NULL
+        """,
+    )),
+    (5, "scheduled job run history", (
+        """
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name VARCHAR(64) PRIMARY KEY,
+            last_run_at TIMESTAMP,
+            last_duration_ms DOUBLE PRECISION,
+            avg_duration_ms DOUBLE PRECISION,
+            max_duration_ms DOUBLE PRECISION,
+            run_count BIGINT NOT NULL DEFAULT 0,
+            failure_count BIGINT NOT NULL DEFAULT 0,
+            last_status VARCHAR(16),
+            last_error TEXT,
+            last_runner VARCHAR(128)
+        )
+        """,
+    )),
+    (6, "broadcasts and blocked users", (
+        """
+        ALTER TABLE users
+        ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP -- Set when a send fails because the user blocked the bot
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id BIGSERIAL PRIMARY KEY,
+            message_text TEXT NOT NULL,
+            created_by BIGINT,
+            status VARCHAR(16) NOT NULL DEFAULT 'running', -- running, done, cancelled
+            last_user_id BIGINT NOT NULL DEFAULT 0, -- Checkpoint: recipients are processed in user_id order
+            delivered_count BIGINT NOT NULL DEFAULT 0,
+            blocked_count BIGINT NOT NULL DEFAULT 0,
+            failed_count BIGINT NOT NULL DEFAULT 0,
+            runner VARCHAR(128),
+            heartbeat_at TIMESTAMP, -- Lease: another process may take over once this is stale
+            created_at TIMESTAMP DEFAULT NOW(),
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        -- Recipient scan for broadcasts
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS users_reachable_idx
+        ON users (user_id) WHERE blocked_at IS NULL
+        """,
+    )),
+    (7, "catalog purchases", (
+        """
+        -- Catalog item the user picked before paying; delivered automatically once paid
+        ALTER TABLE payments
+        ADD COLUMN IF NOT EXISTS requested_content_id UUID REFERENCES content_library(content_id) ON DELETE SET NULL
+        """,
+    )),
+    (8, "catalog search indexes", (
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        """
+        -- Inline catalog search: substring and fuzzy title matches (3+ characters)
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS content_library_title_trgm_idx
+        ON content_library USING gin (title gin_trgm_ops)
+        """,
+        """
+        -- Inline catalog search: case-insensitive prefix matches for 1-2 character queries
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS content_library_title_prefix_idx
+        ON content_library (lower(title) text_pattern_ops)
+        """,
+    )),
+    (9, "drive folder sync", (
+        """
+        ALTER TABLE content_library
+        ADD COLUMN IF NOT EXISTS drive_file_id TEXT, -- Set for rows imported or adopted by the Drive folder sync
+        ADD COLUMN IF NOT EXISTS drive_modified_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS removed_at TIMESTAMP -- File was deleted or moved out of the folder; hidden from the catalog
+        """,
+        """
+        CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS content_library_drive_file_id_idx
+        ON content_library (drive_file_id)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS drive_sync_state (
+            folder_id TEXT PRIMARY KEY,
+            page_token TEXT NOT NULL, -- Changes API token to resume from
+            last_full_sync_at TIMESTAMP,
+            last_sync_at TIMESTAMP
+        )
+        """,
+    )),
+    (10, "append-only payment stats deltas", (
+        """
+        -- Changes to payment_stats recorded by the trigger as insert-only rows, so concurrent
+        -- payment writes no longer queue on the single rollup row. Readers add them to the
+        -- rollup; reconcile_stats() folds them in and deletes them.
+        CREATE TABLE IF NOT EXISTS payment_stats_deltas (
+            delta_id BIGSERIAL PRIMARY KEY,
+            total_users BIGINT NOT NULL DEFAULT 0,
+            total_payments BIGINT NOT NULL DEFAULT 0,
+            pending_payments BIGINT NOT NULL DEFAULT 0,
+            revenue_completed BIGINT NOT NULL DEFAULT 0,
+            revenue_pending BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE OR REPLACE FUNCTION payment_stats_apply() RETURNS trigger AS $$
+        DECLARE
+            remaining BIGINT;
+            users_delta BIGINT := 0;
+            payments_delta BIGINT := 0;
+            pending_delta BIGINT := 0;
+            completed_revenue_delta BIGINT := 0;
+            pending_revenue_delta BIGINT := 0;
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                payments_delta := payments_delta - 1;
+                pending_delta := pending_delta - COALESCE(OLD.status = 'pending', false)::INT;
+                completed_revenue_delta := completed_revenue_delta - CASE WHEN OLD.status = 'completed' THEN OLD.amount ELSE 0 END;
+                pending_revenue_delta := pending_revenue_delta - CASE WHEN OLD.status = 'pending' THEN OLD.amount ELSE 0 END;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                payments_delta := payments_delta + 1;
+                pending_delta := pending_delta + COALESCE(NEW.status = 'pending', false)::INT;
+                completed_revenue_delta := completed_revenue_delta + CASE WHEN NEW.status = 'completed' THEN NEW.amount ELSE 0 END;
+                pending_revenue_delta := pending_revenue_delta + CASE WHEN NEW.status = 'pending' THEN NEW.amount ELSE 0 END;
+            END IF;
+
+            IF TG_OP = 'INSERT' AND NEW.user_id IS NOT NULL THEN
+                INSERT INTO payment_user_counts (user_id, payments) VALUES (NEW.user_id, 1)
+                ON CONFLICT (user_id) DO UPDATE SET payments = payment_user_counts.payments + 1
+                RETURNING payments INTO remaining;
+                IF remaining = 1 THEN
+                    users_delta := 1;
+                END IF;
+            ELSIF TG_OP = 'DELETE' AND OLD.user_id IS NOT NULL THEN
+                UPDATE payment_user_counts SET payments = payments - 1
+                WHERE user_id = OLD.user_id
+                RETURNING payments INTO remaining;
+                IF remaining = 0 THEN
+                    DELETE FROM payment_user_counts WHERE user_id = OLD.user_id;
+                    users_delta := -1;
+                END IF;
+            END IF;
+
+            IF users_delta <> 0 OR payments_delta <> 0 OR pending_delta <> 0
+               OR completed_revenue_delta <> 0 OR pending_revenue_delta <> 0 THEN
+                INSERT INTO payment_stats_deltas (total_users, total_payments, pending_payments, revenue_completed, revenue_pending)
+                VALUES (users_delta, payments_delta, pending_delta, completed_revenue_delta, pending_revenue_delta);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+        """,
+    )),
+    (11, "drop unused per-user payment index", (
+        # Created by earlier builds of migration 3; no query filters payments by user_id
+        "DROP INDEX CONCURRENTLY IF EXISTS payments_user_request_idx",
+    )),
+    (12, "delivery sent state", (
+        """
+        -- Set once the content has reached the user, so a retry after a failed completion
+        -- finishes the job instead of sending the content again
+        ALTER TABLE deliveries
+        ADD COLUMN IF NOT EXISTS sent_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS telegram_file_id TEXT
+        """,
+    )),
+]
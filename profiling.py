@@ -0,0 +1,163 @@
+import asyncio
+import collections
+import cProfile
+import io
+import linecache
+import logging
+import pstats
+import sys
+import threading
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusy(Exception):
+    """Raised when a CPU profile is requested while another one is running"""
+    pass
+
+
+class MemoryTracer:
+    """
+    On-demand tracemalloc control. Tracing is off until start() is called, so the process
+    pays no per-allocation overhead unless someone is actually looking.
+    """
+
+    def __init__(self):
+        self._baseline = None # Snapshot that diff() compares against
+
+    @property
+    def is_tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        tracemalloc.start(frames)
+        self._baseline = self._snapshot()
+
+    def stop(self):
+        tracemalloc.stop()
+        self._baseline = None
+
+    def top(self, limit: int = 25) -> str:
+        """Returns the lines allocating the most memory that is still alive."""
+        snapshot = self._snapshot()
+        stats = snapshot.statistics('lineno')
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"tracemalloc top {limit}: current {current / 1024 / 1024:.1f} MiB, peak {peak / 1024 / 1024:.1f} MiB", ""]
+        for index, stat in enumerate(stats[:limit], 1):
+            frame = stat.traceback[0]
+            lines.append(f"#{index}: {frame.filename}:{frame.lineno}: {stat.size / 1024:.1f} KiB in {stat.count} blocks")
+            source = linecache.getline(frame.filename, frame.lineno).strip()
+            if source:
+                lines.append(f"    {source}")
+        other = stats[limit:]
+        if other:
+            lines.append(f"{len(other)} other lines: {sum(stat.size for stat in other) / 1024:.1f} KiB")
+        return "\n".join(lines)
+
+    def diff(self, limit: int = 25) -> str:
+        """Returns the biggest allocation changes since the previous diff (or since start)."""
+        snapshot = self._snapshot()
+        stats = snapshot.compare_to(self._baseline, 'lineno')
+        self._baseline = snapshot
+        lines = [f"tracemalloc diff top {limit}:", ""]
+        for index, stat in enumerate(stats[:limit], 1):
+            frame = stat.traceback[0]
+            lines.append(f"#{index}: {frame.filename}:{frame.lineno}: {stat.size_diff / 1024:+.1f} KiB "
+                         f"({stat.count_diff:+d} blocks), now {stat.size / 1024:.1f} KiB")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _snapshot():
+        # Leave out tracemalloc's own bookkeeping
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+
+class CpuProfiler:
+    """Time-limited CPU profiles of the event loop thread. Only one profile runs at a time."""
+
+    def __init__(self):
+        self._running = False
+
+    async def cprofile(self, seconds: float, limit: int = 60) -> str:
+        """
+        Runs cProfile on the event loop thread for `seconds`. cProfile is deterministic, so it
+        sees every call but slows the bot down noticeably while it runs.
+        """
+        self._claim()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+        finally:
+            self._running = False
+
+        out = io.StringIO()
+        out.write(f"cProfile of the event loop thread for {seconds:g}s\n\n")
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats(limit)
+        stats.sort_stats('tottime').print_stats(limit)
+        return out.getvalue()
+
+    async def sample(self, seconds: float, interval: float = 0.005, limit: int = 60) -> str:
+        """
+        Samples the event loop thread's stack every `interval` seconds from a helper thread.
+        Overhead is low enough for production; the report lists the hottest functions and the
+        collapsed stacks (flamegraph.pl / speedscope input format).
+        """
+        self._claim()
+        loop_thread_id = threading.get_ident()
+        stacks = collections.Counter()
+        stop = threading.Event()
+
+        def sampler():
+            while not stop.wait(interval):
+                frame = sys._current_frames().get(loop_thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stacks[";".join(reversed(stack))] += 1
+
+        thread = threading.Thread(target=sampler, name="loop-sampler", daemon=True)
+        try:
+            thread.start()
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(thread.join)
+            self._running = False
+
+        total = sum(stacks.values())
+        if not total:
+            return "No samples collected."
+        self_counts = collections.Counter()
+        inclusive_counts = collections.Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            for frame in set(frames):
+                inclusive_counts[frame] += count
+
+        lines = [f"Event loop samples: {total} over {seconds:g}s (every {interval * 1000:g} ms)", "",
+                 "Self time (function was on top of the stack):"]
+        for frame, count in self_counts.most_common(limit):
+            lines.append(f"{count / total * 100:6.2f}%  {frame}")
+        lines += ["", "Inclusive time (function anywhere on the stack):"]
+        for frame, count in inclusive_counts.most_common(limit):
+            lines.append(f"{count / total * 100:6.2f}%  {frame}")
+        lines += ["", "Collapsed stacks:"]
+        lines += [f"{stack} {count}" for stack, count in stacks.most_common()]
+        return "\n".join(lines)
+
+    def _claim(self):
+        if self._running:
+            raise ProfilerBusy("A profile is already running")
+        self._running = True
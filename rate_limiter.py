@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority classes: lower value is sent first
+PRIORITY_HIGH = 0    # Payment confirmations, invoices, content deliveries
+PRIORITY_NORMAL = 1  # Regular replies
+PRIORITY_LOW = 2     # Admin notifications, help text
+PRIORITY_BULK = 3    # Broadcasts: only use capacity nothing else needs
+
+# Endpoints that post a message into a chat and therefore count against Telegram's flood limits
+MESSAGE_ENDPOINTS = {
+    'sendMessage', 'sendDocument', 'sendVideo', 'sendPhoto', 'sendAudio', 'sendAnimation',
+    'sendVoice', 'sendMediaGroup', 'sendInvoice', 'sendSticker', 'copyMessage', 'forwardMessage',
+    'editMessageText', 'editMessageCaption', 'editMessageReplyMarkup',
+}
+HIGH_PRIORITY_ENDPOINTS = {'sendInvoice', 'sendDocument', 'sendVideo'}
+# Answers to queries Telegram expires within seconds (pre-checkout: 10 s); never held back by a flood pause
+ANSWER_ENDPOINTS = {'answerPreCheckoutQuery', 'answerCallbackQuery', 'answerInlineQuery', 'answerShippingQuery'}
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, 'total_seconds') else float(value)
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """
+    Central outbound scheduler for every Bot API call made through the Application's bot.
+    Message-sending calls wait for per-chat pacing (Telegram allows ~1 msg/s per private chat
+    and ~20 msg/min per group) and then for a token from a global bucket (~30 msg/s), which is
+    handed out strictly by priority class, FIFO within a class. A RetryAfter from Telegram
+    pauses the chat it was raised for (or all sending, if it was not chat-specific) for the
+    requested time and the call is retried. Query answers are never paused.
+    Callers can force a class with rate_limit_args={'priority': PRIORITY_HIGH}.
+    """
+
+    def __init__(self, overall_rate: float = 30.0, burst: int = 30, private_chat_interval: float = 1.0,
+                 group_chat_interval: float = 3.0, max_retries: int = 3, low_priority_chats=()):
+        self.overall_rate = overall_rate
+        self.burst = burst
+        self.private_chat_interval = private_chat_interval
+        self.group_chat_interval = group_chat_interval
+        self.max_retries = max_retries
+        self.low_priority_chats = {str(chat) for chat in low_priority_chats if chat}
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._waiters = [] # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._chat_next = {} # chat_id -> monotonic time the chat may receive its next message
+        self._dispatcher = None
+
+    async def initialize(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        is_message = endpoint in MESSAGE_ENDPOINTS and chat_id is not None
+        priority = self._priority_for(endpoint, chat_id, rate_limit_args)
+
+        for attempt in range(self.max_retries + 1):
+            if is_message:
+                await self.acquire(chat_id, priority)
+            elif endpoint not in ANSWER_ENDPOINTS:
+                await self._wait_pause()
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except Exception as e:
+                metrics.BOT_API_ERRORS.inc(endpoint=endpoint, error=type(e).__name__)
+                if not isinstance(e, RetryAfter):
+                    raise
+                delay = retry_after_seconds(e)
+                self.pause(delay, chat_id if is_message else None)
+                logger.warning(f"Flood limit hit on {endpoint} (chat {chat_id}); pausing {'the chat' if is_message else 'all sends'} for {delay:.1f}s "
+                               f"(attempt {attempt + 1}/{self.max_retries + 1}).")
+                if attempt == self.max_retries:
+                    raise
+            finally:
+                metrics.BOT_API_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+
+    def pause(self, seconds: float, chat_id=None):
+        """
+        Holds back sends to chat_id (or all sends, without a chat) for `seconds`.
+        Sends made outside the bot call this on a RetryAfter.
+        """
+        until = time.monotonic() + seconds
+        if chat_id is None:
+            self._paused_until = max(self._paused_until, until)
+        else:
+            self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), until)
+
+    async def acquire(self, chat_id, priority: int = PRIORITY_NORMAL):
+        """Waits until a message may be sent to chat_id. Also usable for sends made outside the bot."""
+        started = time.monotonic()
+        await self._pace_chat(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+        metrics.BOT_API_QUEUE_SECONDS.observe(time.monotonic() - started, priority=priority)
+
+    def _priority_for(self, endpoint, chat_id, rate_limit_args) -> int:
+        if isinstance(rate_limit_args, dict) and 'priority' in rate_limit_args:
+            return rate_limit_args['priority']
+        if str(chat_id) in self.low_priority_chats:
+            return PRIORITY_LOW
+        if endpoint in HIGH_PRIORITY_ENDPOINTS:
+            return PRIORITY_HIGH
+        return PRIORITY_NORMAL
+
+    async def _pace_chat(self, chat_id):
+        now = time.monotonic()
+        try:
+            is_private = int(chat_id) > 0
+        except (TypeError, ValueError):
+            is_private = False # '@channelusername'
+        interval = self.private_chat_interval if is_private else self.group_chat_interval
+        send_at = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = send_at + interval
+        if len(self._chat_next) > 10000:
+            self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+    async def _wait_pause(self):
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _dispatch(self):
+        """Hands out global tokens to waiters in priority order."""
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            await self._wait_pause()
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.overall_rate)
+            self._last_refill = now
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.overall_rate)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+            self._tokens -= 1
+            future.set_result(None)
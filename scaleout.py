@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import zlib
+from queue import Empty
+
+from telegram import Bot, Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import Config
+from database import Database
+from webhook import WebhookServer
+
+logger = logging.getLogger(__name__)
+
+# Update keys whose payload carries the acting user in 'from'
+_USER_UPDATE_KEYS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'pre_checkout_query', 'shipping_query', 'chat_member', 'my_chat_member', 'chat_join_request',
+    'poll_answer',
+)
+# Membership updates are about the member, not about whoever changed the membership ('from')
+_MEMBER_UPDATE_KEYS = ('chat_member', 'my_chat_member')
+
+
+def routing_key(data: dict) -> int:
+    """Returns the user id an update belongs to (falling back to the chat id, then the update id)."""
+    for key in _USER_UPDATE_KEYS:
+        payload = data.get(key)
+        if payload:
+            if key in _MEMBER_UPDATE_KEYS:
+                user = (payload.get('new_chat_member') or {}).get('user')
+            else:
+                user = payload.get('from') or payload.get('user')
+            if user:
+                return user['id']
+            if payload.get('chat'):
+                return payload['chat']['id']
+    for key in ('channel_post', 'edited_channel_post'):
+        if data.get(key):
+            return data[key]['chat']['id']
+    return data.get('update_id', 0)
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates concurrently across users but strictly in order for any single user,
+    so e.g. a successful_payment is never handled before the pre_checkout_query that preceded it.
+    An update waits for its user's lock before taking one of the max_concurrent_updates slots,
+    so a burst from one user queues on that user's lock instead of occupying every slot.
+    BaseUpdateProcessor.process_update is final and takes its own semaphore before calling
+    do_process_update, so that semaphore is left unbounded and the slots are enforced here.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(sys.maxsize)
+        self._slot_count = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = {} # user_id -> [Lock, holders]
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._slot_count
+
+    async def do_process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[user.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class UpdateRouter:
+    """Routes raw updates to worker queues by hashing the user id, preserving per-user ordering."""
+
+    def __init__(self, queues):
+        self.queues = queues
+
+    def worker_for(self, data: dict) -> int:
+        key = str(routing_key(data)).encode()
+        return zlib.crc32(key) % len(self.queues) # Stable across processes, unlike hash()
+
+    async def route(self, data: dict):
+        queue = self.queues[self.worker_for(data)]
+        await asyncio.to_thread(queue.put, data)
+
+
+def run_worker(index: int, queue, parent_pid: int):
+    """Entry point of a worker process."""
+    # A Ctrl+C goes to the whole process group; the supervisor handles it and sends the
+    # sentinel, so the worker is not interrupted in the middle of a payment
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_main(index, queue, parent_pid))
+
+
+async def _worker_main(index: int, queue, parent_pid: int):
+    from JoeMovieBot import MovieBot # Imported here: JoeMovieBot imports this module
+
+    logger.info(f"Worker {index} starting.")
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set) # Clean shutdown, same as the sentinel
+    bot = MovieBot()
+    if Config.METRICS_PORT:
+        bot.metrics_port = Config.METRICS_PORT + index # Each worker has its own metrics
+    try:
+        await bot.initialize(run_migrations=False) # The supervisor has already migrated the schema
+        await bot.app.initialize()
+        await bot.app.start()
+        await bot.start_background_tasks()
+        logger.info(f"Worker {index} ready.")
+
+        while not stop.is_set():
+            try:
+                data = await asyncio.to_thread(queue.get, True, 1)
+            except Empty:
+                # Nobody feeds the queue once the supervisor is gone (e.g. SIGKILL or OOM); an orphaned
+                # worker would otherwise keep the scheduler lock and its delivery workers
+                if os.getppid() != parent_pid:
+                    logger.error(f"Worker {index}: supervisor (pid {parent_pid}) is gone; shutting down.")
+                    break
+                continue
+            if data is None: # Shutdown sentinel
+                break
+            await bot.enqueue_update(data)
+    finally:
+        if bot.app and bot.app.running:
+            await bot.app.stop()
+        await bot.cleanup()
+        logger.info(f"Worker {index} stopped.")
+
+
+class Supervisor:
+    """
+    Starts Config.WORKER_PROCESSES bot processes and feeds them updates received via
+    polling or webhook, routed by user id. Workers that die are restarted with the same
+    queue, so a user's pending updates are not lost or reordered.
+    """
+
+    def __init__(self, num_workers: int):
+        self.num_workers = num_workers
+        self._ctx = multiprocessing.get_context('spawn')
+        self.queues = [self._ctx.Queue(maxsize=10000) for _ in range(num_workers)]
+        self.processes = [None] * num_workers
+        self.router = UpdateRouter(self.queues)
+        self._stop = asyncio.Event()
+        self._webhook_server = None
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(target=run_worker, args=(index, self.queues[index], os.getpid()), name=f"bot-worker-{index}")
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Spawned worker {index} (pid {process.pid}).")
+
+    async def run(self):
+        # Migrate once here rather than racing N workers on the same DDL
+        await Database.get_connection()
+        try:
+            await Database.init_db()
+        finally:
+            await Database.close()
+
+        for index in range(self.num_workers):
+            self._spawn(index)
+
+        bot = Bot(Config.TOKEN, base_url=f"{Config.TELEGRAM_API_URL}/bot",
+                  base_file_url=f"{Config.TELEGRAM_API_URL}/file/bot")
+        async with bot:
+            receiver = asyncio.create_task(self._receive(bot))
+            try:
+                await self._monitor()
+            finally:
+                self._stop.set()
+                receiver.cancel()
+                await asyncio.gather(receiver, return_exceptions=True)
+                if self._webhook_server:
+                    await self._webhook_server.stop()
+                await self._shutdown_workers()
+
+    def stop(self):
+        self._stop.set()
+
+    async def _receive(self, bot):
+        if Config.BOT_MODE == 'webhook':
+            self._webhook_server = WebhookServer(
+                self.router.route,
+                listen=Config.WEBHOOK_LISTEN,
+                port=Config.WEBHOOK_PORT,
+                path=Config.WEBHOOK_PATH,
+                secret_token=Config.WEBHOOK_SECRET_TOKEN
+            )
+            await self._webhook_server.start()
+            await bot.set_webhook(
+                url=f"{Config.WEBHOOK_URL.rstrip('/')}{Config.WEBHOOK_PATH}",
+                secret_token=Config.WEBHOOK_SECRET_TOKEN,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=Config.WEBHOOK_DROP_PENDING_UPDATES,
+                max_connections=Config.WEBHOOK_MAX_CONNECTIONS
+            )
+            return
+
+        await bot.delete_webhook(drop_pending_updates=True) # Skip old updates
+        offset = None
+        while not self._stop.is_set():
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error during polling: {e}")
+                await asyncio.sleep(5)
+                continue
+            for update in updates:
+                await self.router.route(update.to_dict())
+                offset = update.update_id + 1
+
+    async def _monitor(self):
+        while not self._stop.is_set():
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logger.error(f"Worker {index} exited with code {process.exitcode}; restarting.")
+                    self._spawn(index)
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _shutdown_workers(self):
+        for queue in self.queues:
+            queue.put(None)
+        for index, process in enumerate(self.processes):
+            await asyncio.to_thread(process.join, 30)
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not stop in time; terminating.")
+                process.terminate()
+        logger.info("All workers stopped.")
+
+
+async def run_supervisor():
+    """Runs the supervisor until SIGINT/SIGTERM."""
+    supervisor = Supervisor(Config.WORKER_PROCESSES)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, supervisor.stop)
+    logger.info(f"Starting supervisor with {Config.WORKER_PROCESSES} worker processes.")
+    await supervisor.run()
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+from datetime import datetime
+
+import metrics
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledJob:
+    def __init__(self, name: str, interval: float, func, jitter: float = 0.0):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.jitter = jitter
+        self.next_run = None # Wall-clock timestamp of the next run
+        self.task = None
+
+    def schedule_after(self, last_run: float):
+        self.next_run = last_run + self.interval + random.uniform(0, self.jitter)
+
+
+class JobScheduler:
+    """
+    Runs periodic jobs on exactly one replica.
+    Leadership is a session-level pg_try_advisory_lock held on a dedicated connection: if the
+    leader process dies its session ends, the lock is released, and another replica's next
+    attempt takes over. On becoming leader, jobs whose last recorded run is older than their
+    interval run immediately (missed-run catch-up, once rather than once per missed interval).
+    Each run's duration and outcome is recorded in the scheduled_jobs table.
+    """
+
+    def __init__(self, lock_key: int, leader_check_interval: float = 15.0):
+        self.lock_key = lock_key
+        self.leader_check_interval = leader_check_interval
+        self.jobs = {}
+        self.is_leader = False
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._conn = None
+
+    def add_job(self, name: str, interval: float, func, jitter: float = None):
+        """Registers an async callable to run every `interval` seconds (plus up to `jitter` seconds)."""
+        self.jobs[name] = ScheduledJob(name, interval, func, interval * 0.05 if jitter is None else jitter)
+
+    async def run(self, shutdown_event: asyncio.Event):
+        try:
+            while not shutdown_event.is_set():
+                try:
+                    await self._check_leadership()
+                    if self.is_leader:
+                        self._start_due_jobs()
+                except Exception as e:
+                    logger.error(f"Scheduler error: {e}")
+                    await self._step_down()
+
+                try:
+                    await asyncio.wait_for(shutdown_event.wait(), timeout=self._sleep_seconds())
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            running = [job.task for job in self.jobs.values() if job.task and not job.task.done()]
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            await self._step_down()
+
+    async def _check_leadership(self):
+        if self.is_leader:
+            # Confirm the lock connection is still alive; if not, the lock is gone with it
+            try:
+                await Database.execute_on(self._conn, "SELECT 1")
+            except Exception as e:
+                logger.warning(f"Scheduler lost its leadership connection: {e}")
+                await self._step_down()
+            return
+
+        if self._conn is None:
+            self._conn = await Database.connect_dedicated()
+        if await Database.try_advisory_lock(self._conn, self.lock_key):
+            self.is_leader = True
+            logger.info(f"Scheduler {self.runner_id} became leader.")
+            await self._load_schedule()
+
+    async def _step_down(self):
+        if self.is_leader:
+            logger.info(f"Scheduler {self.runner_id} stepped down.")
+        self.is_leader = False
+        conn, self._conn = self._conn, None
+        await Database.close_dedicated(conn) # Closing the session releases the advisory lock
+
+    async def _load_schedule(self):
+        """Computes each job's next run from its last recorded run, so missed runs are caught up."""
+        runs = await Database.get_job_runs()
+        now = time.time()
+        for job in self.jobs.values():
+            last_run = runs.get(job.name, {}).get('last_run_at')
+            if last_run is None:
+                job.next_run = now
+            else:
+                job.schedule_after(min(last_run.timestamp(), now))
+                if job.next_run <= now:
+                    logger.info(f"Job '{job.name}' missed its schedule; running now.")
+
+    def _start_due_jobs(self):
+        now = time.time()
+        for job in self.jobs.values():
+            if job.next_run is not None and job.next_run <= now and (job.task is None or job.task.done()):
+                job.task = asyncio.create_task(self._run_job(job))
+
+    async def _run_job(self, job: ScheduledJob):
+        started_at = datetime.now()
+        started = time.monotonic()
+        status, error = 'ok', None
+        try:
+            await job.func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status, error = 'failed', str(e)[:1000]
+            logger.error(f"Job '{job.name}' failed: {e}")
+        duration_ms = (time.monotonic() - started) * 1000
+        metrics.JOB_SECONDS.observe(duration_ms / 1000, job=job.name, status=status)
+        job.schedule_after(time.time())
+        logger.info(f"Job '{job.name}' finished in {duration_ms:.0f} ms ({status}).")
+        try:
+            await Database.record_job_run(job.name, started_at, duration_ms, status, error, self.runner_id)
+        except Exception as e:
+            logger.error(f"Failed to record run of job '{job.name}': {e}")
+
+    def _sleep_seconds(self) -> float:
+        if not self.is_leader:
+            return self.leader_check_interval
+        pending = [job.next_run for job in self.jobs.values() if job.next_run is not None]
+        until_next = min(pending) - time.time() if pending else self.leader_check_interval
+        return max(0.5, min(until_next, self.leader_check_interval))
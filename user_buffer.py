@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from cache import TTLCache
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class UserWriteBuffer:
+    """
+    Write-behind buffer for user upserts.
+    Updates are coalesced per user in memory and written with one multi-row upsert when the
+    buffer reaches max_size or every flush_interval seconds. A user whose profile has not changed
+    is skipped entirely unless their last_active was written more than last_active_resolution
+    seconds ago.
+    """
+
+    def __init__(self, max_size: int, flush_interval: float, last_active_resolution: float, known_size: int = 100000):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._pending = {} # user_id -> (username, first_name, last_name, last_active)
+        self._in_flight = {} # The batch a flush is writing, same shape as _pending
+        self._known = TTLCache(maxsize=known_size, ttl=last_active_resolution) # user_id -> last written profile
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+
+    def add(self, user_id: int, username: str, first_name: str, last_name: str) -> bool:
+        """Queues a user upsert. Returns False if it was skipped as unchanged."""
+        profile = (username, first_name, last_name)
+        if user_id not in self._pending and self._known.get(user_id) == profile:
+            return False
+
+        self._pending[user_id] = profile + (datetime.now(),)
+        if len(self._pending) >= self.max_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._background_flush())
+        return True
+
+    async def ensure_flushed(self, user_id: int):
+        """
+        Commits the buffered write for user_id on its own (e.g. before inserting rows that reference users).
+        A write held by a batch flush still in progress is written again here rather than waited for, so
+        the caller never depends on the rest of the batch. Errors are logged, not raised: the user row
+        usually exists already, and if not, the caller's own insert reports it.
+        """
+        values = self._pending.pop(user_id, None) or self._in_flight.get(user_id)
+        if values is None:
+            return
+        try:
+            await Database.bulk_upsert_users([(user_id,) + values])
+        except Exception as e:
+            logger.error(f"Failed to write buffered update for user {user_id}: {e}")
+            self._pending.setdefault(user_id, values) # Retried by the next flush
+            return
+        self._known.set(user_id, values[:3])
+
+    async def _background_flush(self):
+        try:
+            await self.flush()
+        except Exception:
+            pass # Already logged; the batch is retried on the next flush
+
+    async def flush(self):
+        """Writes all pending updates in a single multi-row upsert."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._in_flight = batch
+            rows = [(user_id,) + values for user_id, values in batch.items()]
+            try:
+                await Database.bulk_upsert_users(rows)
+            except Exception as e:
+                logger.error(f"Failed to flush {len(rows)} buffered user updates: {e}")
+                # Put the batch back without overwriting anything newer that arrived meanwhile
+                for user_id, values in batch.items():
+                    self._pending.setdefault(user_id, values)
+                raise
+            finally:
+                self._in_flight = {}
+
+            for user_id, values in batch.items():
+                self._known.set(user_id, values[:3])
+            logger.debug(f"Flushed {len(rows)} buffered user updates.")
+
+    async def run(self, shutdown_event: asyncio.Event):
+        """Periodically flushes the buffer until shutdown is requested."""
+        while not shutdown_event.is_set():
+            try:
+                await asyncio.wait_for(shutdown_event.wait(), timeout=self.flush_interval)
+                break # Shutdown requested; the final flush happens in MovieBot.cleanup()
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                pass # Already logged; the batch is retried on the next tick
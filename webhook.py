@@ -0,0 +1,60 @@
+import hmac
+import logging
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """
+    Embedded aiohttp server that receives Telegram webhook updates.
+    Each request is authenticated with the secret token, decoded and handed to `dispatch`
+    (an async callable taking the raw update dict) - the bot's update queue in single-process
+    mode, or the worker router in supervisor mode. Dispatch only enqueues, so Telegram never
+    waits on update processing.
+    """
+
+    def __init__(self, dispatch, listen: str, port: int, path: str, secret_token: str):
+        self.dispatch = dispatch
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self._runner = None
+
+    async def start(self):
+        web_app = web.Application(client_max_size=1024 * 1024)
+        web_app.router.add_post(self.path, self._handle_update)
+        web_app.router.add_get('/healthz', self._handle_health)
+        self._runner = web.AppRunner(web_app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        logger.info(f"Webhook server listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+            logger.info("Webhook server stopped.")
+
+    async def _handle_update(self, request):
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()): # str compare_digest rejects non-ASCII
+            logger.warning(f"Rejected webhook request with invalid secret token from {request.remote}")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+        except Exception as e:
+            logger.error(f"Failed to decode webhook update: {e}")
+            return web.Response(status=400)
+
+        await self.dispatch(data)
+        return web.Response(status=200)
+
+    async def _handle_health(self, request):
+        return web.Response(text="ok")